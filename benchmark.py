@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import re
+import shutil
+import tempfile
+import timeit
+from typing import Any, Callable
+
+import attrs
+import cattrs
+
+import models
+import utils
+from consts import META_MISSING_VALUE, POB_EXPORT_FNAME
+
+BENCHMARKS:dict[str,Callable[[],None]] = {}
+
+
+def main() -> None:
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"===== {name} =====")
+        BENCHMARKS[name]()
+        print()
+
+
+def benchmark(func:Callable[[],None]) -> Callable[[],None]:
+    """register a benchmark so it can be run by name from the command line"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def compare(label:str, funcs:dict[str,Callable[[],object]], number:int, repeat:int=5) -> None:
+    """time each function and print the best time, and the speedup relative to the first function"""
+    baseline = None
+    for name, func in funcs.items():
+        t = min(timeit.repeat(func, number=number, repeat=repeat))
+        if baseline is None:
+            baseline = t
+        print(f"{label:<24} {name:<12} {t*1000:10.3f} ms  {baseline/t:6.2f}x")
+
+
+def load_test_mod_lines() -> list[str]:
+    """get every mod line from the legacy test items"""
+    with open("test_data/legacy_test.json") as f:
+        test_items = json.load(f)
+    return [mod for item in test_items for key in ("implicitMods", "explicitMods") for mod in item.get(key, [])]
+
+
+def genericize_two_pass(line:str) -> tuple[str, list[list[float]]]:
+    """the previous implementation of GenericMod.genericize_mod (re.finditer for the ranges, then re.sub for the line), for comparison"""
+    number_pattern = r"-?\d+\.?\d*"
+    range_pattern = rf"(?P<sign>-?)\((?P<start>{number_pattern})-(?P<end>{number_pattern})\)|(?P<single>{number_pattern})"
+
+    ranges = []
+    for m in re.finditer(range_pattern, line):
+        if m["single"]:  # single number
+            n = float(m["single"])
+            ranges.append([n, n])
+        else:  # range
+            r = [float(m["start"]), float(m["end"])]
+            if m["sign"] == "-":
+                r = [-x for x in r]
+            ranges.append(sorted(r))
+
+    return re.sub(range_pattern, "#", line), ranges
+
+
+def structure_two_pass(data:list[dict[str,Any]]) -> list[models.PoBItem]:
+    """the previous way of structuring the json export (fill in the missing attributes of every item and mod, then the global cattrs converter), for comparison"""
+    def fix_loaded_data(o:dict[str,Any], type_:type) -> None:
+        for at in attrs.fields(type_):
+            if at.name not in o:
+                if at.default != attrs.NOTHING:
+                    o[at.name] = at.default
+                elif META_MISSING_VALUE in at.metadata:
+                    o[at.name] = at.metadata[META_MISSING_VALUE]
+
+    converter = cattrs.Converter()  # a fresh one, to stand in for the global converter without registering hooks on it
+    converter.register_structure_hook(models.UpgradePath|str|None, lambda o,t: converter.structure(o, models.UpgradePath) if isinstance(o, dict) else o)
+
+    for item in data:
+        fix_loaded_data(item, models.PoBItem)
+        for modlist in (item["implicits"], item["explicits"]):
+            for mod in modlist:
+                fix_loaded_data(mod, models.GenericMod)
+    return converter.structure(data, list[models.PoBItem])
+
+
+@benchmark
+def genericize() -> None:
+    """the single-pass mod tokenizer against the old two-pass regex, both uncached"""
+    lines = load_test_mod_lines()
+    for line in lines:
+        old_line, old_ranges = genericize_two_pass(line)
+        new_line, new_ranges = models.tokenize_mod(line)
+        assert (old_line, old_ranges) == (new_line, [list(r) for r in new_ranges]), line
+
+    compare(f"{len(lines)} test mod lines", {
+        "two-pass": lambda: [genericize_two_pass(line) for line in lines],
+        "tokenizer": lambda: [models.tokenize_mod(line) for line in lines],
+    }, number=100)
+
+    # an unclosed range makes the old number pattern backtrack over every way of splitting the digits
+    for n in (25, 50, 100):
+        line = f"({'1'*n}-{'2'*n} to Strength"
+        compare(f"{n}-digit unclosed range", {
+            "two-pass": lambda: genericize_two_pass(line),
+            "tokenizer": lambda: models.tokenize_mod(line),
+        }, number=5, repeat=3)
+
+
+@benchmark
+def load() -> None:
+    """the export converter against the old structuring, then the json, snapshot and lazy loaders. Uses the real export"""
+    if not os.path.exists(POB_EXPORT_FNAME):
+        print(f"{POB_EXPORT_FNAME} not found")
+        return
+    with open(POB_EXPORT_FNAME, "rb") as f:
+        raw = f.read()
+
+    converter = utils.export_converter()
+    items = [converter.structure(record, models.PoBItem) for record in json.loads(raw)]
+    assert structure_two_pass(json.loads(raw)) == items
+
+    # both include json.loads, since the two-pass way modifies the loaded data
+    compare(f"structure {len(items)} items", {
+        "two-pass": lambda: structure_two_pass(json.loads(raw)),
+        "converter": lambda: [converter.structure(record, models.PoBItem) for record in json.loads(raw)],
+    }, number=3)
+
+    # use a copy, so the benchmark doesn't write a snapshot next to the real export
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, os.path.basename(POB_EXPORT_FNAME))
+        shutil.copyfile(POB_EXPORT_FNAME, fname)
+        utils.save_pob_snapshot(items, fname)
+        compare("load_pob_db", {
+            "json": lambda: utils.load_pob_db(fname, use_snapshot=False),
+            "snapshot": lambda: utils.load_pob_db(fname),
+            "json lazy": lambda: utils.load_pob_db(fname, use_snapshot=False, lazy=True),
+            "snapshot lazy": lambda: utils.load_pob_db(fname, lazy=True),
+        }, number=3)
+
+
+
+def synthetic_export(num_items:int, mods_per_item:int) -> list[models.PoBItem]:
+    """make a PoB export of the given size out of the mod lines of the legacy test items, for when the real export isn't there"""
+    mods = [models.GenericMod(line, [list(r) for r in ranges], [0]) for line, ranges in map(models.tokenize_mod, load_test_mod_lines())]
+    return [
+        models.PoBItem(f"Unique {i}", "Iron Ring", [], "Ring", "Drop", "", None, ["Only"],
+            [mods[i % len(mods)]], [mods[(i * mods_per_item + j) % len(mods)] for j in range(1, mods_per_item)], 1)
+        for i in range(num_items)
+    ]
+
+
+@benchmark
+def snapshot() -> None:
+    """the eager and lazy snapshot loads of a synthetic export about the size of the real one (1860 items, 39k mods). The eager load should stay under 100 ms"""
+    items = synthetic_export(1860, 21)
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, os.path.basename(POB_EXPORT_FNAME))
+        with open(fname, "w") as f:
+            json.dump([utils.export_dict(item) for item in items], f)
+        utils.save_pob_snapshot(items, fname)
+        assert list(utils.load_pob_db(fname)) == items
+
+        compare(f"{len(items)} items, {sum(len(i.implicits) + len(i.explicits) for i in items)} mods", {
+            "snapshot": lambda: utils.load_pob_db(fname),
+            "snapshot lazy": lambda: utils.load_pob_db(fname, lazy=True),
+        }, number=1)
+        t = min(timeit.repeat(lambda: utils.load_pob_db(fname), number=1, repeat=5))
+        print(f"eager snapshot load {'under' if t < 0.1 else 'OVER'} 100 ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,6 @@ META_MISSING_VALUE = "_meta_missing_value"
 POB_EXPORT_FNAME = "pob_export.json"
 GG_EXPORT_FNAME = "gg_export.json"
 CORRUPTED_EXPORT_FNAME = "corrupted_export.json"
+MATCH_CACHE_FNAME = "match_cache.json"
+RATE_LIMIT_STATE_FNAME = "ratelimit_state.json"
+RESPONSE_CACHE_DIR = "response_cache"
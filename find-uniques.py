@@ -2,6 +2,8 @@
 
 import os
 import json
+import asyncio
+import hashlib
 import logging
 import re
 import sys
@@ -9,6 +11,7 @@ from typing import Any
 
 import pathofexile
 import legacy
+import timing
 from models import APIItem, VariantMatchList
 import utils
 from consts import *
@@ -20,15 +23,20 @@ logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
 
 
 def main() -> None:
-    poe = pathofexile.PoEClient("oauth.json", "secrets.json", "token.json")
+    timing.enable("--stats" in sys.argv)
+    poe = pathofexile.PoEClient("oauth.json", "secrets.json", "token.json", RATE_LIMIT_STATE_FNAME, pathofexile.ResponseCache(RESPONSE_CACHE_DIR, prefer_cached="--prefer-cached" in sys.argv))
     compare_unique_tabs(poe)
 
+    if timing.is_enabled():
+        print()
+        timing.print_stats()
+
 
 def compare_unique_tabs(poe:pathofexile.PoEClient) -> None:
     league, tab, api_items = load_unique_tabs(poe, "-c" in sys.argv)
 
     gg_export = utils.load_gg_export(GG_EXPORT_FNAME)
-    pob_db = utils.load_pob_db(POB_EXPORT_FNAME)
+    pob_db = utils.load_pob_db(POB_EXPORT_FNAME, lazy=True)  # only the uniques in the tabs are needed
 
     api_items_dict:list[dict[tuple[str,str],APIItem]] = []
     for j, api_item_list in enumerate(api_items):
@@ -38,6 +46,21 @@ def compare_unique_tabs(poe:pathofexile.PoEClient) -> None:
             icon:str = api_item["icon"].split("/")[-1].split(".")[0]
             api_items_dict[j][(name, icon)] = api_item
 
+    # match every item up front, so the matching can be spread across processes.
+    # results are saved between runs, so only items whose unique changed in the export (see its manifest) are matched again
+    # the workers are kept for all the tabs, and the Matcher only starts as many as the items of a tab keep busy (see legacy.MIN_ITEMS_PER_WORKER).
+    # each loads its own copy of the export, so --workers=N can cap them
+    workers = next((int(arg.split("=", 1)[1]) for arg in sys.argv if arg.startswith("--workers=")), os.cpu_count() or 1)
+    manifest = utils.load_pob_manifest(POB_EXPORT_FNAME)
+    cache = legacy.MatchCache(MATCH_CACHE_FNAME, manifest) if manifest is not None else None
+    matches:list[dict[tuple[str,str],VariantMatchList]] = []
+    with legacy.Matcher(pob_db, best_only=True, workers=workers) as matcher:
+        for items_dict in api_items_dict:
+            variants = matcher.match_many(list(items_dict.values()), cache=cache)
+            matches.append(dict(zip(items_dict.keys(), variants)))
+    if cache is not None:
+        cache.save()
+
     num_broken = 0
     with open("tab_compare.csv", "w") as f:
         tab0_name = f'{league[0]} {tab[0]["name"]}'
@@ -59,7 +82,7 @@ def compare_unique_tabs(poe:pathofexile.PoEClient) -> None:
                 if in_tab[i]:
                     it = api_items_dict[i][(name, icon)]
 
-                    v = legacy.get_variant(it, pob_db)
+                    v = matches[i][(name, icon)]
                     best_score[i] = v.best_score()
                     variant[i] = v.top(0)
 
@@ -150,49 +173,104 @@ def prompt_number(prompt, valids) -> int:
 
 
 def save(data, fname) -> None:
-    with open(fname, "w") as f:
+    """write the file atomically, so an interrupted save leaves the previous version"""
+    with open(fname + ".tmp", "w") as f:
         json.dump(data, f)
+    os.replace(fname + ".tmp", fname)
+
+
+def load(fname) -> Any:
+    with open(fname) as f:
+        return json.load(f)
 
 
 def fix_name(x) -> str:
     return re.sub(r'[<>:"/\\|?*]', "~", x)
 
 
-def download_all(poe:pathofexile.PoEClient, league:str, output_folder:str, start_index=0):
+def download_all(poe:pathofexile.PoEClient, league:str, output_folder:str, start_index=0, incremental=False):
+    asyncio.run(download_all_async(pathofexile.AsyncPoEClient(poe), league, output_folder, start_index, incremental))
+
+
+async def download_all_async(poe:pathofexile.AsyncPoEClient, league:str, output_folder:str, start_index=0, incremental=False):
+    """the same as a sequential download, but every tab and subtab is requested at once, so it's only limited by the rate limits
+
+    The stash list and the tabs are always revalidated with the server, so a ResponseCache can't give an old copy of them.
+    The stash list has no item counts or modification times, so every tab is requested. With a ResponseCache, an unchanged tab is only a 304 Not Modified response.
+    With `incremental`, the files of a tab are only written if its contents changed since the last download.
+    Tabs before `start_index` aren't requested, and are read from the files of the last download that has them.
+    """
     folder = f"{output_folder}/{league}"
     os.makedirs(folder, exist_ok=True)
+    sync_fname = f"{output_folder}/{league}_sync.json"
+    previous:dict[str,dict[str,Any]] = load(sync_fname) if os.path.exists(sync_fname) else {}  # {tab id : {"hash", "files", "tabs"}}
 
-    stash_list = poe.list_stashes(league)
-    save(stash_list, f"{folder}/stash_list.json")
+    stash_list = await poe.list_stashes(league, revalidate=True)
     print(f"Found {len(stash_list)} tabs in {league}")
 
-    all_tabs = []
-    for i, s in enumerate(stash_list):
-        if s["index"] < start_index:
-            continue
+    def have_files(sync:dict[str,Any]) -> bool:
+        return all(os.path.exists(f"{folder}/{fname}") for fname in sync["files"])
 
+    async def download_tab(i:int, s:dict[str,Any]) -> tuple[list[dict[str,Any]],dict[str,Any]]:
+        """get the tab and its subtabs, and the files they're saved in"""
         print(f'Downloading tab {i+1}/{len(stash_list)} "{s["name"]}" ({s["type"]}) [{s["index"]}]')
-        stash_data = poe.get_stash(league, s["id"])
-
-        if "children" in stash_data:
-            save(stash_data, f'{folder}/{stash_data["index"]}_{fix_name(stash_data["name"])}_{stash_data["type"]}_list.json')
-
-            if stash_data["type"] == "MapStash":
-                print("\tSkipping MapStash subtabs")
-            else:
-                num_subtabs = len(stash_data["children"])
-                print(f'\tFound {num_subtabs} subtabs')
-
-                for j, sub in enumerate(stash_data["children"]):
-                    print(f"\tDownloading subtab {j+1}/{num_subtabs}")
-                    subtab_data = poe.get_stash(league, stash_data["id"], sub["id"])
-                    all_tabs.append(subtab_data)
-                    save(subtab_data, f'{folder}/{stash_data["index"]}_{j}_{fix_name(subtab_data["name"])}_{subtab_data["type"]}.json')
+        stash_data = await poe.get_stash(league, s["id"], revalidate=True)
+        subtabs:list[dict[str,Any]] = []
+        if "children" in stash_data and stash_data["type"] == "MapStash":
+            print(f'\tSkipping MapStash subtabs of "{stash_data["name"]}"')
+        elif "children" in stash_data:
+            print(f'\tFound {len(stash_data["children"])} subtabs in "{stash_data["name"]}"')
+            subtabs = await asyncio.gather(*(poe.get_stash(league, stash_data["id"], sub["id"], revalidate=True) for sub in stash_data["children"]))
+
+        content_hash = hashlib.sha256(json.dumps([stash_data, subtabs], sort_keys=True).encode()).hexdigest()
+        synced = previous.get(s["id"])
+        if incremental and synced is not None and synced["hash"] == content_hash and have_files(synced):
+            return subtabs if "children" in stash_data else [stash_data], synced
+
+        if "children" not in stash_data:
+            fname = f'{stash_data["index"]}_{fix_name(stash_data["name"])}_{stash_data["type"]}.json'
+            save(stash_data, f"{folder}/{fname}")
+            return [stash_data], {"hash": content_hash, "files": [fname], "tabs": [fname]}
+
+        list_fname = f'{stash_data["index"]}_{fix_name(stash_data["name"])}_{stash_data["type"]}_list.json'
+        save(stash_data, f"{folder}/{list_fname}")
+        if stash_data["type"] == "MapStash":
+            return [], {"hash": content_hash, "files": [list_fname], "tabs": []}
+
+        fnames = []
+        for j, subtab_data in enumerate(subtabs):
+            fnames.append(f'{stash_data["index"]}_{j}_{fix_name(subtab_data["name"])}_{subtab_data["type"]}.json')
+            save(subtab_data, f"{folder}/{fnames[-1]}")
+        return subtabs, {"hash": content_hash, "files": [list_fname, *fnames], "tabs": fnames}
+
+    downloads = {s["id"]: download_tab(i, s) for i, s in enumerate(stash_list) if s["index"] >= start_index}
+    results = dict(zip(downloads.keys(), await asyncio.gather(*downloads.values())))
+    num_unchanged = sum(sync is previous.get(tab_id) for tab_id, (_, sync) in results.items())
+    print(f"{len(results) - num_unchanged} tabs saved, {num_unchanged} unchanged")
+
+    # tabs before start_index keep their files from the last download, so they're still in {league}_all.json
+    all_tabs = []
+    synced = {}
+    for s in stash_list:
+        if s["id"] in results:
+            tabs, synced[s["id"]] = results[s["id"]]
+        elif s["id"] in previous and have_files(previous[s["id"]]):
+            synced[s["id"]] = previous[s["id"]]
+            tabs = [load(f"{folder}/{fname}") for fname in synced[s["id"]]["tabs"]]
         else:
-            all_tabs.append(stash_data)
-            save(stash_data, f'{folder}/{stash_data["index"]}_{fix_name(stash_data["name"])}_{stash_data["type"]}.json')
+            continue
+        all_tabs += tabs
+
+    # files of tabs that were removed, renamed or moved would be read by load_cache
+    current_files = {fname for sync in synced.values() for fname in sync["files"]}
+    for sync in previous.values():
+        for fname in sync["files"]:
+            if fname not in current_files and os.path.exists(f"{folder}/{fname}"):
+                os.remove(f"{folder}/{fname}")
 
+    save(stash_list, f"{folder}/stash_list.json")
     save(all_tabs, f'{output_folder}/{league}_all.json')
+    save(synced, sync_fname)  # last, so an interrupted download is redone next time
 
 
 def load_cache(folder:str, league:str):
@@ -202,7 +280,7 @@ def load_cache(folder:str, league:str):
     with os.scandir(f"{folder}/{league}") as scan:
         for entry in scan:
             # print(entry.path)
-            if not entry.is_file():
+            if not entry.is_file() or entry.name.endswith(".tmp"):
                 continue
 
             with open(entry.path) as f:
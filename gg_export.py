@@ -1,18 +1,22 @@
 #!/usr/bin/env python
 
+import sys
 import json
+import hashlib
 import requests
 import subprocess
 import shutil
 import urllib.parse
 import os
+from typing import Any
 
 import cattrs
 
 from consts import GG_EXPORT_FNAME
 from models import GGItem
 
-EXPORT_DIR = "gg_export_tmp"
+CACHE_DIR = "gg_export_cache"  # holds the tables extracted for each patch, and the stamp of the last export
+LATEST_VERSION_URL = "https://raw.githubusercontent.com/poe-tool-dev/latest-patch-version/main/latest.txt"
 
 config = {
     "translations": ["English"],
@@ -60,23 +64,81 @@ config = {
 
 
 def main() -> None:
-    latest_version = requests.get("https://raw.githubusercontent.com/poe-tool-dev/latest-patch-version/main/latest.txt").text
-    config["patch"] = latest_version
+    """update gg_export.json, from the tables of the latest patch, or --patch=<version>, or the already extracted tables in --tables=<dir> (which doesn't need the network)"""
+    args = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if update_gg_export(tables_dir=args.get("tables"), patch=args.get("patch")):
+        print(f"wrote {GG_EXPORT_FNAME}")
+    else:
+        print(f"{GG_EXPORT_FNAME} is up to date")
+
+
+def update_gg_export(*, tables_dir:str|None=None, patch:str|None=None, export_fname:str=GG_EXPORT_FNAME, cache_dir:str=CACHE_DIR) -> bool:
+    """build the export from the game's tables, unless it was already built from the same tables. Returns whether it was built
+
+    The tables are either the ones in `tables_dir`, or the ones extracted for `patch` (the latest patch if not given, see extract_tables).
+    What the export was built from is recorded in a stamp in `cache_dir`, along with the size and modification time of the export,
+    so a rebuild with nothing changed only has to check some file stats (and get the latest patch version, if no patch is given).
+    """
+    source:dict[str,Any] = {"config": _config_hash()}
+    if tables_dir is not None:
+        source["tables"] = {fname: _file_stat(os.path.join(tables_dir, fname)) for fname in table_fnames()}
+    else:
+        patch = patch or requests.get(LATEST_VERSION_URL, timeout=30).text.strip()
+        source["patch"] = patch
+
+    stamp_fname = os.path.join(cache_dir, "gg_export.stamp")
+    try:
+        with open(stamp_fname) as f:
+            stamp = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        stamp = None
+    if stamp == {"source": source, "export": _file_stat(export_fname)}:
+        return False
+
+    if tables_dir is None:
+        assert patch is not None
+        tables_dir = extract_tables(patch, cache_dir)
+    data = build_gg_export(tables_dir)
+
+    with open(export_fname + ".tmp", "w") as f:
+        json.dump(cattrs.unstructure(data), f, indent="\t")
+    os.replace(export_fname + ".tmp", export_fname)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(stamp_fname, "w") as f:
+        json.dump({"source": source, "export": _file_stat(export_fname)}, f)
+    return True
+
+
+def extract_tables(patch:str, cache_dir:str=CACHE_DIR) -> str:
+    """extract the tables in `config` from the given patch with pathofexile-dat, and return the folder they're in.
+    They're kept in `cache_dir`, and only extracted again if the patch or the config changes"""
+    export_dir = os.path.join(cache_dir, f"{patch}-{_config_hash()[:16]}")
+    tables_dir = os.path.join(export_dir, "tables", "English")
+    if all(os.path.exists(os.path.join(tables_dir, fname)) for fname in table_fnames()):
+        return tables_dir
+
+    os.makedirs(export_dir, exist_ok=True)
+    with open(os.path.join(export_dir, "config.json"), "w") as f:
+        json.dump({**config, "patch": patch}, f, indent="\t")
+
+    subprocess.run(shutil.which("pathofexile-dat"), cwd=export_dir, check=True)  #type: ignore
+    return tables_dir
 
-    os.makedirs(EXPORT_DIR, exist_ok=True)
-    with open(f"{EXPORT_DIR}/config.json", "w") as f:
-        json.dump(config, f, indent="\t")
 
-    subprocess.run(shutil.which("pathofexile-dat"), cwd=EXPORT_DIR)  #type: ignore
+def table_fnames() -> list[str]:
+    return [f'{table["name"]}.json' for table in config["tables"]]  #type: ignore
 
-    tables_folder = f"{EXPORT_DIR}/tables/English/"
-    with open(tables_folder + "UniqueStashLayout.json") as f:
+
+def build_gg_export(tables_dir:str) -> list[GGItem]:
+    """make the export from the extracted tables"""
+    with open(os.path.join(tables_dir, "UniqueStashLayout.json")) as f:
         unique_stash_layout = json.load(f)
-    with open(tables_folder + "UniqueStashTypes.json") as f:
+    with open(os.path.join(tables_dir, "UniqueStashTypes.json")) as f:
         unique_stash_types = json.load(f)
-    with open(tables_folder + "ItemVisualIdentity.json") as f:
+    with open(os.path.join(tables_dir, "ItemVisualIdentity.json")) as f:
         item_visual_identity = json.load(f)
-    with open(tables_folder + "Words.json") as f:
+    with open(os.path.join(tables_dir, "Words.json")) as f:
         words = json.load(f)
 
     data = []
@@ -101,8 +163,20 @@ def main() -> None:
                 sort_key = sort_key
             ))
 
-    with open(GG_EXPORT_FNAME, "w") as f:
-        json.dump(cattrs.unstructure(data), f, indent="\t")
+    return data
+
+
+def _config_hash() -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def _file_stat(fname:str) -> list[int]|None:
+    """the size and modification time of a file (as a list, so it's the same after a round trip through json), or None if it doesn't exist"""
+    try:
+        st = os.stat(fname)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
 
 
 if __name__ == "__main__":
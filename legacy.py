@@ -1,82 +1,424 @@
 #!/usr/bin/env python
 
+import os
+import sys
 import json
-import bisect
+import hashlib
 import logging
-import io
+import functools
+import concurrent.futures
+from collections.abc import Sequence
+from typing import Any
 
-import cattrs
+import attrs
 import rapidfuzz
 import numpy as np
 import numpy.typing as npt
 
 from consts import POB_EXPORT_FNAME
-from models import UpgradePath, APIItem, PoBItem, ItemVariant, GenericMod, VariantMatch, VariantMatchList
+from models import FName, APIItem, ModSignature, PoBItem, PoBDB, PoBManifest, ItemVariant, VariantSet, GenericMod, GenericLine, PackedRanges, VariantMatch, VariantMatchList, genericize_line
 import utils
+import timing
+import models
+import consts
 
 from pprint import pprint as pp
 
 log = logging.getLogger(__name__)
-vm_log = logging.getLogger(__name__ + ".variant_match")
-vm_log.propagate = False
-
-cattrs.register_structure_hook(UpgradePath|str|None, lambda o,t: cattrs.structure(o, UpgradePath) if isinstance(o, dict) else o)  # not sure why it can't figure that out itself
 
 FUZZ_FUNCTION = rapidfuzz.fuzz.ratio
+CHUNKS_PER_WORKER = 4  # more chunks than workers evens out the load, since some uniques are much slower to match than others
+MIN_ITEMS_PER_WORKER = 50  # every worker loads its own PoB database, which is only worth it for enough items
+SCORE_CUTOFF_TOLERANCE = 0.01  # rapidfuzz can drop scores equal to score_cutoff because of rounding in its cutoff check, so cut off a little below
+
+timing.register_cache("genericize_line", genericize_line.cache_info)
 
 
 def main() -> None:
     logging.basicConfig(level=logging.DEBUG)
+    timing.enable("--stats" in sys.argv)
 
     with open("test_data/legacy_test.json") as f:
         test_items:list[APIItem] = json.load(f)
 
-    pob_db = utils.load_pob_db(POB_EXPORT_FNAME)
+    matcher = Matcher(utils.load_pob_db(POB_EXPORT_FNAME), best_only=True)
 
     failures = []
     for i,test_item in enumerate(test_items):
-        stream = io.StringIO()
-        handler = logging.StreamHandler(stream)
-        vm_log.addHandler(handler)
-
-        variant_matches = get_variant(test_item, pob_db).backwards_compatible()
+        trace = MatchTrace()
+        variant_matches = matcher.match(test_item, trace).backwards_compatible()
         print(f'({i}, "{test_item["name"]}", {variant_matches})')
         if not variant_matches:
             failures.append(test_item["name"])
-            print(stream.getvalue())
-
-        vm_log.removeHandler(handler)
+            print(trace.dump())
 
     print("\nFailures:")
     pp(failures)
 
+    if timing.is_enabled():
+        print()
+        timing.print_stats()
+
+
+@attrs.define
+class TraceEvent:
+    """one thing the matcher did while matching an item, recorded by MatchTrace"""
+    kind: str
+    variant: str|None
+    data: dict[str,Any]
+
+
+    def __str__(self) -> str:
+        fields = []
+        for key, value in self.data.items():
+            if isinstance(value, np.ndarray):
+                fields.append(f"{key}=\n{value.round(0)}")
+            else:
+                fields.append(f"{key}={value!r}")
+        variant = f" [{self.variant}]" if self.variant is not None else ""
+        return f"{self.kind}{variant}: " + ", ".join(fields)
+
+
+
+@attrs.define
+class MatchTrace:
+    """an opt-in record of what the matcher did, for debugging matches
+
+    Pass one to Matcher.match or get_variant to turn tracing on for that call. Without one, the matcher does no trace work at all.
+    Events are kept as structured data (kind, variant name, and fields like the mismatch reason, score matrices, and chosen pairs) and only formatted by dump().
+    """
+    events: list[TraceEvent] = attrs.field(factory=list)
+
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+
+    def record(self, kind:str, variant:ItemVariant|None=None, **data:Any) -> None:
+        """record an event, optionally about a particular variant"""
+        self.events.append(TraceEvent(kind, variant.variant_name if variant is not None else None, data))
+
+
+    def dump(self) -> str:
+        """format all the recorded events as text"""
+        return "\n".join(str(e) for e in self.events)
 
-def get_variant(api_item:APIItem, pob_db:list[PoBItem]) -> VariantMatchList:
-    """return the variant(s) of the given item"""
-    stream = io.StringIO()
-    handler = logging.StreamHandler(stream)
-    vm_log.addHandler(handler)
 
-    fix_timeless_jewel(api_item)
 
-    pob_item = find_pob_unique(pob_db, api_item["name"], api_item["baseType"])
+@attrs.define
+class Matcher:
+    """matches API items to the variants of their PoB uniques
+
+    A Matcher owns a PoB database along with its indexes and caches (see PoBDB), and is safe to share between threads:
+    matching never modifies the items it's given, and tracing is recorded separately for each call (see MatchTrace).
+    The caches are filled in as items are matched. Concurrent calls may occasionally build the same cache entry twice, which is harmless.
+    With `workers` > 1, match_many uses a pool of worker processes that is started the first time it's needed and kept until close(), so a Matcher with workers should be used as a context manager.
+    The pool only has as many workers as the largest batch so far keeps busy, so `workers` is a cap rather than a number of processes.
+    To match against an export file, load it with utils.load_pob_db first.
+    """
+    pob_db: PoBDB = attrs.field(repr=False)
+    best_only: bool = attrs.field(default=False, kw_only=True)  # see get_variant
+    workers: int = attrs.field(default=1, kw_only=True)  # see match_many
+    _pool: concurrent.futures.ProcessPoolExecutor|None = attrs.field(init=False, default=None, repr=False)
+    _pool_workers: int = attrs.field(init=False, default=0, repr=False)
+
+
+    def __enter__(self) -> 'Matcher':
+        return self
+
+
+    def __exit__(self, *exc_info:Any) -> None:
+        self.close()
+
+
+    def close(self) -> None:
+        """stop the worker processes, if they were started"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_workers = 0
+
+
+    def match(self, api_item:APIItem, trace:'MatchTrace|None'=None) -> VariantMatchList:
+        """return the variant(s) of the given item. If `trace` is given, what the matcher did is recorded in it"""
+        return match_item(prepare_item(api_item), self.pob_db, best_only=self.best_only, trace=trace)
+
+
+    def match_many(self, api_items:Sequence[APIItem], *, cache:'MatchCache|None'=None) -> list[VariantMatchList]:
+        """return the variants of each of the given items, in the same order
+
+        With `workers` > 1, the items are grouped into chunks by unique name and matched in the pool of worker processes.
+        Each worker loads its own copy of the PoB database once (from pob_db.fname if it has one, lazily if pob_db is lazy, otherwise a pickled copy is sent).
+        Small batches are matched in this process instead, since they wouldn't keep the workers busy for long (see MIN_ITEMS_PER_WORKER). Either way, the results are the same.
+        With a `cache`, only the items without a usable saved result are matched, and their results are added to it.
+        """
+        if cache is not None:
+            cached = [cache.get(api_item, self.best_only) for api_item in api_items]
+            missing = [i for i, result in enumerate(cached) if result is None]
+            log.info(f"matching {len(missing)} of {len(api_items)} items, the rest are cached")
+            matched = dict(zip(missing, self.match_many([api_items[i] for i in missing])))
+            for i, result in matched.items():
+                cache.put(api_items[i], self.best_only, result)
+            return [matched[i] if result is None else result for i, result in enumerate(cached)]
+
+        workers = min(self.workers, len(api_items) // MIN_ITEMS_PER_WORKER)
+        if workers <= 1:
+            return [self.match(api_item) for api_item in api_items]
+
+        if self._pool_workers < workers:
+            # every worker loads the PoB database, so the pool is only restarted with more of them when a batch needs them
+            self.close()
+            initargs = (self.pob_db.fname or self.pob_db, self.best_only, self.pob_db.lazy, timing.is_enabled())
+            self._pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs)
+            self._pool_workers = workers
+        assert self._pool is not None
+
+        chunks = chunk_by_name(api_items, workers * CHUNKS_PER_WORKER)
+        results:dict[int,VariantMatchList] = {}
+        chunk_results = self._pool.map(_match_chunk, [[api_items[i] for i in chunk] for chunk in chunks])
+        for chunk, (chunk_result, taken) in zip(chunks, chunk_results):
+            for i, variant_matches in zip(chunk, chunk_result):
+                results[i] = variant_matches
+            if taken is not None:
+                timing.merge(taken)
+
+        return [results[i] for i in range(len(api_items))]
+
+
+@attrs.define
+class MatchCache:
+    """match results saved between runs, so that only the items whose PoB unique changed have to be matched again
+
+    Results are grouped by the name and basetype of their item, and each group is saved with the hash of the PoB unique it was matched against,
+    from the manifest of the export (see utils.save_pob_manifest). When the cache is loaded, the groups of the uniques the manifest lists as added, removed or modified are dropped.
+    A saved result is used for an item with the same name, basetype and mods, matched with the same best_only, as long as the hash of its unique hasn't changed.
+    The results are saved as json, along with match_cache_version, so they're all matched again when the matcher changes.
+    """
+    fname: FName
+    manifest: PoBManifest = attrs.field(repr=False)
+    results: dict[tuple[str,str],tuple[str|None,dict[tuple[str,bool],VariantMatchList]]] = attrs.field(init=False, factory=dict, repr=False)
+
+    def __attrs_post_init__(self) -> None:
+        try:
+            with open(self.fname) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            log.warning(f"{self.fname!r} couldn't be read, so every item will be matched again: {e}")
+            return
+        if data.get("version") != match_cache_version():
+            log.info(f"{self.fname!r} is from a different version of the matcher")
+            return
+
+        manifest = self.manifest
+        changed = {(entry.name, basetype) for entry in (*manifest.added, *manifest.removed, *manifest.modified) for basetype in entry.basetypes}
+        for group in data["uniques"]:
+            key = (group["name"], group["basetype"])
+            if key in changed:
+                log.info(f"dropping {len(group['results'])} saved results for {key}, which changed")
+                continue
+            results = {(item_key, best_only): _decode_match_list(result) for item_key, best_only, result in group["results"]}
+            self.results[key] = (group["hash"], results)
+
+
+    def get(self, api_item:APIItem, best_only:bool) -> VariantMatchList|None:
+        """return the saved result for an item, or None if there isn't one or its unique has changed"""
+        key = (api_item["name"], api_item["baseType"])
+        group = self.results.get(key)
+        saved = group[1].get((self._item_key(api_item), best_only)) if group is not None and group[0] == self.manifest.find_hash(*key) else None
+        if saved is None:
+            timing.count("match_cache.miss")
+            return None
+        timing.count("match_cache.hit")
+        return saved
+
+
+    def put(self, api_item:APIItem, best_only:bool, result:VariantMatchList) -> None:
+        key = (api_item["name"], api_item["baseType"])
+        unique_hash = self.manifest.find_hash(*key)
+        group = self.results.get(key)
+        if group is None or group[0] != unique_hash:
+            group = self.results[key] = (unique_hash, {})
+        group[1][(self._item_key(api_item), best_only)] = result
+
+
+    def save(self) -> None:
+        uniques = [
+            {"name": name, "basetype": basetype, "hash": unique_hash, "results": [[item_key, best_only, _encode_match_list(result)] for (item_key, best_only), result in results.items()]}
+            for (name, basetype), (unique_hash, results) in self.results.items()
+        ]
+        with open(f"{os.fsdecode(self.fname)}.tmp", "w") as f:
+            json.dump({"version": match_cache_version(), "uniques": uniques}, f, separators=(",", ":"))
+        os.replace(f"{os.fsdecode(self.fname)}.tmp", self.fname)
+
+
+    @staticmethod
+    def _item_key(api_item:APIItem) -> str:
+        """identifies an item by everything the matcher uses"""
+        fields = [api_item["name"], api_item["baseType"], api_item.get("implicitMods", []), api_item.get("explicitMods", [])]
+        return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+@functools.cache
+def match_cache_version() -> str:
+    """a hash of the source of the matcher and the models it uses, so that the results saved by MatchCache are matched again whenever either changes"""
+    h = hashlib.sha256()
+    for fname in (__file__, models.__file__, consts.__file__):
+        with open(fname, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _encode_match_list(result:VariantMatchList) -> list[dict[str,Any]]:
+    """convert a VariantMatchList into json data for MatchCache. The matrices are saved with their shapes, since empty ones can't be told apart by their lists"""
+    return [{
+        "variant_name": match.variant_name,
+        "variant_number": match.variant_number,
+        "basic_mismatch": match.basic_mismatch,
+        "implicit_matrix": [match.implicit_matrix.shape, match.implicit_matrix.ravel().tolist()],
+        "explicit_matrix": [match.explicit_matrix.shape, match.explicit_matrix.ravel().tolist()],
+        "scores": [float(score) for score in match.scores],
+        "minumim_score": float(match.minumim_score),
+        "average_score": float(match.average_score),
+        "aggregate_score": float(match.aggregate_score),
+    } for match in result.match_list]
+
+
+def _decode_match_list(data:list[dict[str,Any]]) -> VariantMatchList:
+    """the reverse of _encode_match_list"""
+    matches = []
+    for record in data:
+        match = VariantMatch(
+            record["variant_name"],
+            record["variant_number"],
+            record["basic_mismatch"],
+            np.array(record["implicit_matrix"][1], dtype=np.float64).reshape(record["implicit_matrix"][0]),
+            np.array(record["explicit_matrix"][1], dtype=np.float64).reshape(record["explicit_matrix"][0]),
+            record["scores"],
+        )
+        match.minumim_score = record["minumim_score"]
+        match.average_score = record["average_score"]
+        match.aggregate_score = record["aggregate_score"]
+        matches.append(match)
+    return VariantMatchList(matches)
+
+
+def get_variant(api_item:APIItem, pob_db:PoBDB, *, best_only=False, report=False, trace:'MatchTrace|None'=None) -> VariantMatchList:
+    """return the variant(s) of the given item
+
+    When the mods of the item are inside the ranges of some of the variants (see exact_match), only those variants are returned, scored in full.
+    Otherwise every variant is returned with its scores, or with `best_only`, only the variants tied for the best minimum score, and variants that can't reach it are abandoned early.
+    With `report`, every variant is scored and returned even when some match exactly, for callers that need the scores of all of them.
+    top(), best_score() and backwards_compatible() give the same results either way.
+    If `trace` is given, what the matcher did is recorded in it.
+    """
+    return match_item(prepare_item(api_item), pob_db, best_only=best_only, report=report, trace=trace)
+
+
+def get_variants(api_items:Sequence[APIItem], pob_db:PoBDB, *, workers:int=1, best_only=False, cache:MatchCache|None=None) -> list[VariantMatchList]:
+    """return the variants of each of the given items, in the same order. See Matcher.match_many"""
+    with Matcher(pob_db, best_only=best_only, workers=workers) as matcher:
+        return matcher.match_many(api_items, cache=cache)
+
+
+def match_item(api_item:APIItem, pob_db:PoBDB, *, best_only=False, report=False, trace:'MatchTrace|None'=None) -> VariantMatchList:
+    """return the variant(s) of an item that has already been through prepare_item. See get_variant"""
+    with timing.stage("match_item"):
+        return _match_item(api_item, pob_db, best_only=best_only, report=report, trace=trace)
+
+
+def _match_item(api_item:APIItem, pob_db:PoBDB, *, best_only:bool, report:bool, trace:'MatchTrace|None') -> VariantMatchList:
+    if trace is not None:
+        trace.record("item", name=api_item["name"], basetype=api_item["baseType"], ilvl=api_item.get("ilvl"))
+
+    with timing.stage("find_pob_unique"):
+        pob_item = find_pob_unique(pob_db, api_item["name"], api_item["baseType"])
     if not pob_item:
+        if trace is not None:
+            trace.record("no_unique")
         return VariantMatchList()
 
-    variants = make_variants(pob_item)
+    variant_set = get_variant_set(pob_db, pob_item)
 
-    variant_matches:list[VariantMatch] = []
-    for variant in variants:
-        variant_matches.append(variant_match_fuzzy(api_item, variant))
+    with timing.stage("genericize"):
+        api_implicits = [genericize_line(m) for m in api_item["implicitMods"]]
+        api_explicits = [genericize_line(m) for m in api_item["explicitMods"]]
+
+    if best_only or not report:
+        # a report has every variant with its scores, so there's nothing to skip
+        with timing.stage("exact_match"):
+            exact_variants = exact_match(api_item["baseType"], api_implicits, api_explicits, variant_set)
+        timing.count("exact_match.hit" if exact_variants else "exact_match.miss")
+        if exact_variants:
+            if trace is not None:
+                trace.record("exact_match", variants=[v.variant_name for v in exact_variants])
+            # only the exact variants are scored, in full, so they're reported the same as by fuzzy matching
+            return VariantMatchList([score_variant(api_item, variant, api_implicits, api_explicits, trace=trace) for variant in exact_variants])
 
-    if not variant_matches and "corrupted" not in api_item and pob_item.variant_slots == 1 and "synthesised" not in api_item:
-        print(stream.getvalue())
-        print("=======================================================")
-    vm_log.removeHandler(handler)
+    pack_variant_set(pob_db, pob_item, variant_set)
+
+    variant_matches:list[VariantMatch] = []
+    if best_only:
+        best:float = -1
+        scored:list[tuple[ItemVariant,VariantMatch,bool]] = []  # (variant, match, whether scores were cut off)
+        for variant in variant_set.variants:
+            match = variant_match_fuzzy_bounded(api_item, variant, api_implicits, api_explicits, best, variant_set=variant_set, trace=trace)
+            if match is not None and match.minumim_score >= best:
+                scored.append((variant, match, best > 0))
+                best = match.minumim_score
+        # the cut off scores are never paired, but they're reported in the matrices, so those winners are scored again in full
+        variant_matches = [score_variant(api_item, variant, api_implicits, api_explicits) if cut_off else match for variant, match, cut_off in scored if match.minumim_score == best]
+    else:
+        item_scores = ItemScores.score(api_implicits, api_explicits, pob_item.implicits, pob_item.explicits, implicit_ranges=variant_set.implicit_ranges, explicit_ranges=variant_set.explicit_ranges)
+        for variant in variant_set.variants:
+            variant_matches.append(variant_match_fuzzy(api_item, variant, item_scores=item_scores, trace=trace))
 
     return VariantMatchList(variant_matches)
 
 
+def chunk_by_name(api_items:Sequence[APIItem], num_chunks:int) -> list[list[int]]:
+    """split the indices of a list of items into about `num_chunks` chunks, keeping items with the same name in the same chunk"""
+    by_name:dict[str,list[int]] = {}
+    for i, api_item in enumerate(api_items):
+        by_name.setdefault(api_item["name"], []).append(i)
+
+    chunk_size = max(1, len(api_items) // num_chunks)
+    chunks:list[list[int]] = [[]]
+    for name in sorted(by_name):
+        if len(chunks[-1]) >= chunk_size:
+            chunks.append([])
+        chunks[-1].extend(by_name[name])
+    return [c for c in chunks if c]
+
+
+_worker_matcher:Matcher|None = None
+
+
+def _init_worker(pob_db:FName|PoBDB, best_only:bool, lazy:bool, timing_enabled:bool) -> None:
+    """create the Matcher for a Matcher.match_many worker process"""
+    global _worker_matcher
+    timing.enable(timing_enabled)
+    timing.take()  # discard anything copied from the parent process
+    _worker_matcher = Matcher(pob_db if isinstance(pob_db, PoBDB) else utils.load_pob_db(pob_db, lazy=lazy), best_only=best_only)
+
+
+def _match_chunk(api_items:list[APIItem]) -> tuple[list[VariantMatchList],dict[str,Any]|None]:
+    """match a chunk of items in a Matcher.match_many worker process. Also returns what timing recorded, to be merged into the parent process"""
+    assert _worker_matcher is not None
+    results = [_worker_matcher.match(api_item) for api_item in api_items]
+    return results, timing.take() if timing.is_enabled() else None
+
+
+def prepare_item(api_item:APIItem) -> APIItem:
+    """return a copy of an API item with its modlists fixed up for matching (see ensure_modlists and fix_timeless_jewel). The original item isn't modified"""
+    result = dict(api_item)
+    result["implicitMods"] = list(api_item.get("implicitMods", []))
+    result["explicitMods"] = list(api_item.get("explicitMods", []))
+    fix_timeless_jewel(result)
+    return result
+
+
 def fix_timeless_jewel(api_item:APIItem) -> None:
     """modifes an item if it is a timeless jewel to split the 'conquered by' line to a separate mod"""
     if "explicitMods" not in api_item:
@@ -90,21 +432,28 @@ def fix_timeless_jewel(api_item:APIItem) -> None:
             break
 
 
-def find_pob_unique(pob_db:list[PoBItem], name:str, basetype:str) -> PoBItem|None:
+def find_pob_unique(pob_db:PoBDB, name:str, basetype:str) -> PoBItem|None:
     """return the PoB data of the unique item with the given name and basetype"""
+    return pob_db.find(name, basetype)
 
-    index = bisect.bisect_left(pob_db, name, key=lambda x:x.name)
-    while pob_db[index].name == name:
-        if pob_db[index].basetype is not None:
-            if pob_db[index].basetype == basetype:
-                return pob_db[index]
-        else:
-            if basetype in [b.basetype for b in pob_db[index].basetypes]:
-                return pob_db[index]
 
-        index += 1
+def get_variant_set(pob_db:PoBDB, pob_item:PoBItem) -> VariantSet:
+    """return the variants of a PoB item, making them the first time they're needed"""
+    variant_set = pob_db.variant_sets.get(id(pob_item))
+    if variant_set is None:
+        timing.count("variant_set.miss")
+        with timing.stage("make_variants"):
+            variant_set = VariantSet(make_variants(pob_item))
+        pob_db.variant_sets[id(pob_item)] = variant_set
+    else:
+        timing.count("variant_set.hit")
+    return variant_set
 
-    return None
+
+def pack_variant_set(pob_db:PoBDB, pob_item:PoBItem, variant_set:VariantSet) -> None:
+    """pack the ranges of all the mods of a PoB item into its variant set from the mod store, the first time they're needed for fuzzy matching"""
+    if variant_set.implicit_ranges is None or variant_set.explicit_ranges is None:
+        variant_set.implicit_ranges, variant_set.explicit_ranges = pob_db.pack_item(pob_item)
 
 
 def make_variants(pob_item:PoBItem) -> list[ItemVariant]:
@@ -123,24 +472,61 @@ def make_variants(pob_item:PoBItem) -> list[ItemVariant]:
 
         implicits:list[GenericMod] = []
         explicits:list[GenericMod] = []
-        for outlist,inlist in ((implicits, pob_item.implicits), (explicits, pob_item.explicits)):
-            for mod in inlist:
+        implicit_indices:list[int] = []
+        explicit_indices:list[int] = []
+        for outlist,indexlist,inlist in ((implicits, implicit_indices, pob_item.implicits), (explicits, explicit_indices, pob_item.explicits)):
+            for i,mod in enumerate(inlist):
                 if variant_num in mod.variants:
                     outlist.append(mod)
+                    indexlist.append(i)
+
+        signature, packed_ranges = make_signature(basetype, implicits, explicits)
+        result.append(ItemVariant(pob_item.name, basetype, variant_name, variant_num, implicits, explicits, implicit_indices, explicit_indices, signature, packed_ranges))
+
+    return result
+
+
+def make_signature(basetype:str, implicits:Sequence[GenericLine|GenericMod], explicits:Sequence[GenericLine|GenericMod]) -> tuple[ModSignature, npt.NDArray[np.float64]]:
+    """make the signature of a set of mods, for exact matching, and the ranges of the mods packed in the same order
+
+    The signature is the basetype and the sorted, normalized generic lines of the implicits and of the explicits.
+    Mods with the same line keep their relative order.
+    """
+    lines:list[tuple[str,...]] = []
+    bounds:list[Sequence[float]] = []
+    for modlist in (implicits, explicits):
+        normalized = sorted(((normalize_mod_line(m.line), m.ranges) for m in modlist), key=lambda x:x[0])
+        lines.append(tuple(line for line, _ in normalized))
+        bounds.extend(r for _, ranges in normalized for r in ranges)
+    return (basetype, lines[0], lines[1]), np.array(bounds, dtype=np.float64).reshape(-1, 2)
+
+
+def exact_match(basetype:str, api_implicits:Sequence[GenericLine], api_explicits:Sequence[GenericLine], variant_set:VariantSet) -> list[ItemVariant]:
+    """find the variants that an item matches exactly: the same normalized mod lines, with every number inside the variant's ranges.
 
-        result.append(ItemVariant(pob_item.name, basetype, variant_name, variant_num, implicits, explicits))
+    These are exactly the variants that variant_match_fuzzy would give a minimum score of 100, as long as the item has no repeated mod lines.
+    If the item does have repeated lines (or nothing matches exactly), an empty list is returned and the item needs to be fuzzy matched.
+    """
+    signature, packed_ranges = make_signature(basetype, api_implicits, api_explicits)
+    if len(set(signature[1])) != len(signature[1]) or len(set(signature[2])) != len(signature[2]):
+        return []
 
+    result = []
+    for variant in variant_set.by_signature.get(signature, []):
+        if np.all(packed_ranges[:,0] >= variant.packed_ranges[:,0]) and np.all(packed_ranges[:,1] <= variant.packed_ranges[:,1]):
+            result.append(variant)
     return result
 
 
-def variant_match(api_item:APIItem, variant:ItemVariant) -> bool:
+def variant_match(api_item:APIItem, variant:ItemVariant, *, trace:'MatchTrace|None'=None) -> bool:
     """test if an item matches a variant"""
 
-    vm_log.debug(f'variant testing "{api_item["name"]}, {api_item["baseType"]}" ({api_item["ilvl"]}) against variant "{variant.variant_name}"')
+    if trace is not None:
+        trace.record("variant", variant, method="exact")
 
     ensure_modlists(api_item)
 
-    if check_basic_mismatch(api_item, variant):
+    if check_basic_mismatch(api_item, variant, trace):
         return False
 
     api_implicits_matched = [False] * len(api_item["implicitMods"])
@@ -158,15 +544,11 @@ def variant_match(api_item:APIItem, variant:ItemVariant) -> bool:
                     api_matched[i] = True
                     variant_matched[j] = True
 
-    bad_api_impl = GenericMod.genericize_mod(api_item['implicitMods'][api_implicits_matched.index(False)]) if api_implicits_matched.count(False) == 1     else ''
-    bad_var_impl =                           variant.implicits[variant_implicits_matched.index(False)]     if variant_implicits_matched.count(False) == 1 else ''
-    bad_api_expl = GenericMod.genericize_mod(api_item['explicitMods'][api_explicits_matched.index(False)]) if api_explicits_matched.count(False) == 1     else ''
-    bad_var_expl =                           variant.explicits[variant_explicits_matched.index(False)]     if variant_explicits_matched.count(False) == 1 else ''
-
-    vm_log.debug(f"    api impl: {api_implicits_matched} {bad_api_impl}")
-    vm_log.debug(f"    var impl: {variant_implicits_matched} {bad_var_impl}")
-    vm_log.debug(f"    api expl: {api_explicits_matched} {bad_api_expl}")
-    vm_log.debug(f"    var expl: {variant_explicits_matched} {bad_var_expl}")
+    if trace is not None:
+        trace.record("mods_matched", variant,
+            api_implicits=api_implicits_matched, variant_implicits=variant_implicits_matched,
+            api_explicits=api_explicits_matched, variant_explicits=variant_explicits_matched,
+        )
 
     return all([all(x) for x in (api_implicits_matched, api_explicits_matched, variant_implicits_matched, variant_explicits_matched)])
 
@@ -174,7 +556,7 @@ def variant_match(api_item:APIItem, variant:ItemVariant) -> bool:
 def mod_match(api_mod:str, variant_mod:GenericMod, item_name:str|None=None) -> bool:  # item_name is a debugging param
     """test if a concrete mod matches a generic mod"""
 
-    api_generic = GenericMod.genericize_mod(api_mod)
+    api_generic = genericize_line(api_mod)
 
     # if api_generic["line"] != variant_mod["line"] and api_generic["line"].lower() == variant_mod["line"].lower():
     #     print(item_name)
@@ -194,35 +576,104 @@ def mod_match(api_mod:str, variant_mod:GenericMod, item_name:str|None=None) -> b
     return api_generic.is_inside_range(variant_mod)
 
 
-def variant_match_fuzzy(api_item:APIItem, variant:ItemVariant, *, fuzz_function=FUZZ_FUNCTION) -> VariantMatch:
-    """test if an item fuzzy matches a variant"""
+def variant_match_fuzzy(api_item:APIItem, variant:ItemVariant, *, fuzz_function=FUZZ_FUNCTION, item_scores:'ItemScores|None'=None, trace:'MatchTrace|None'=None) -> VariantMatch:
+    """test if an item fuzzy matches a variant
+
+    `item_scores` can be given to reuse the scores of the item against all the mods of the variant's PoBItem (see ItemScores).
+    Otherwise, the item is only scored against the mods of this variant.
+    """
 
-    vm_log.debug(f'fuzzy variant testing "{api_item["name"]}, {api_item["baseType"]}" ({api_item["ilvl"]}) against variant "{variant.variant_name}"')
+    if trace is not None:
+        trace.record("variant", variant, method="fuzzy")
 
     ensure_modlists(api_item)
 
-    if check_basic_mismatch(api_item, variant):
+    if check_basic_mismatch(api_item, variant, trace):
         return VariantMatch(variant.variant_name, variant.variant_number, True)
 
-    api_implicit_generics = [GenericMod.genericize_mod(m) for m in api_item["implicitMods"]]
-    api_explicit_generics = [GenericMod.genericize_mod(m) for m in api_item["explicitMods"]]
+    if item_scores is None:
+        api_implicits = [genericize_line(m) for m in api_item["implicitMods"]]
+        api_explicits = [genericize_line(m) for m in api_item["explicitMods"]]
+        item_scores = ItemScores.score(api_implicits, api_explicits, variant.implicits, variant.explicits, fuzz_function=fuzz_function)
+        implicit_matrix = item_scores.implicit_matrix
+        explicit_matrix = item_scores.explicit_matrix
+    else:
+        # fancy indexing makes a copy, so the shared matrices are not modified below
+        implicit_matrix = item_scores.implicit_matrix[:, variant.implicit_indices]
+        explicit_matrix = item_scores.explicit_matrix[:, variant.explicit_indices]
+
+    return pair_mods(api_item, variant, item_scores.api_implicits, item_scores.api_explicits, implicit_matrix, explicit_matrix, fuzz_function=fuzz_function, trace=trace)
+
+
+def score_variant(api_item:APIItem, variant:ItemVariant, api_implicits:list[GenericLine], api_explicits:list[GenericLine], *, fuzz_function=FUZZ_FUNCTION, trace:'MatchTrace|None'=None) -> VariantMatch:
+    """fuzzy match an item against a variant it has no basic mismatch with, using its already genericized mods. The result is the same as variant_match_fuzzy's"""
+    if trace is not None:
+        trace.record("variant", variant, method="full")
+
+    implicit_matrix = score_matrix(api_implicits, variant.implicits, fuzz_function=fuzz_function)
+    explicit_matrix = score_matrix(api_explicits, variant.explicits, fuzz_function=fuzz_function)
+    return pair_mods(api_item, variant, api_implicits, api_explicits, implicit_matrix, explicit_matrix, fuzz_function=fuzz_function, trace=trace)
+
+
+def variant_match_fuzzy_bounded(api_item:APIItem, variant:ItemVariant, api_implicits:list[GenericLine], api_explicits:list[GenericLine], best:float, *, fuzz_function=FUZZ_FUNCTION, variant_set:VariantSet|None=None, trace:'MatchTrace|None'=None) -> VariantMatch|None:
+    """fuzzy match an item against a variant, giving up as soon as the variant can't at least tie the `best` minimum score found so far.
 
-    implicit_matrix = np.zeros((len(api_implicit_generics), len(variant.implicits)))
-    explicit_matrix = np.zeros((len(api_explicit_generics), len(variant.explicits)))
+    Scores below `best` are cut off (set to 0) while scoring. A variant's minimum score can be no higher than the lowest of the best scores of each row,
+    so the variant is abandoned (and None is returned) if that bound falls below `best` after scoring the implicits or the explicits.
+    A variant that isn't abandoned is paired up exactly as variant_match_fuzzy would, since the cut-off scores are never chosen.
+    If the VariantSet the variant belongs to is given, the variant's ranges are taken from its packed ranges instead of being packed again.
+    """
 
+    if trace is not None:
+        trace.record("variant", variant, method="bounded", best=float(best))
+
+    if check_basic_mismatch(api_item, variant, trace):
+        return None
+
+    score_cutoff = max(best - SCORE_CUTOFF_TOLERANCE, 0)
+
+    implicit_ranges = explicit_ranges = None
+    if variant_set is not None and variant_set.implicit_ranges is not None and variant_set.explicit_ranges is not None:
+        implicit_ranges = variant_set.implicit_ranges.take(variant.implicit_indices)
+        explicit_ranges = variant_set.explicit_ranges.take(variant.explicit_indices)
+
+    implicit_matrix = score_matrix(api_implicits, variant.implicits, fuzz_function=fuzz_function, score_cutoff=score_cutoff, variant_ranges=implicit_ranges)
+    if (bound := score_bound(implicit_matrix)) < best:
+        if trace is not None:
+            trace.record("abandoned", variant, which="implicit", bound=bound, best=float(best), matrix=implicit_matrix)
+        return None
+
+    explicit_matrix = score_matrix(api_explicits, variant.explicits, fuzz_function=fuzz_function, score_cutoff=score_cutoff, variant_ranges=explicit_ranges)
+    if (bound := score_bound(explicit_matrix)) < best:
+        if trace is not None:
+            trace.record("abandoned", variant, which="explicit", bound=bound, best=float(best), matrix=explicit_matrix)
+        return None
+
+    return pair_mods(api_item, variant, api_implicits, api_explicits, implicit_matrix, explicit_matrix, fuzz_function=fuzz_function, trace=trace)
+
+
+def score_bound(matrix:npt.NDArray[np.float64]) -> float:
+    """the highest minimum score that pairing up the rows and columns of a score matrix could possibly give"""
+    if matrix.size == 0:
+        return 100
+    return float(matrix.max(axis=1).min())
+
+
+def pair_mods(api_item:APIItem, variant:ItemVariant, api_implicit_generics:list[GenericLine], api_explicit_generics:list[GenericLine], implicit_matrix:npt.NDArray[np.float64], explicit_matrix:npt.NDArray[np.float64], *, fuzz_function=FUZZ_FUNCTION, trace:'MatchTrace|None'=None) -> VariantMatch:
+    """greedily pair up the API and variant mods with the highest scores and make a VariantMatch from the result. The matrices are modified"""
+    with timing.stage("pair_mods"):
+        return _pair_mods(api_item, variant, api_implicit_generics, api_explicit_generics, implicit_matrix, explicit_matrix, fuzz_function=fuzz_function, trace=trace)
+
+
+def _pair_mods(api_item:APIItem, variant:ItemVariant, api_implicit_generics:list[GenericLine], api_explicit_generics:list[GenericLine], implicit_matrix:npt.NDArray[np.float64], explicit_matrix:npt.NDArray[np.float64], *, fuzz_function, trace:'MatchTrace|None') -> VariantMatch:
     implicit_data = ("implicit", api_implicit_generics, variant.implicits, implicit_matrix)
     explicit_data = ("explicit", api_explicit_generics, variant.explicits, explicit_matrix)
 
-    for which, api_generic_modlist, variant_modlist, matrix in (implicit_data, explicit_data):
-        for r,api_generic in enumerate(api_generic_modlist):
-            for c,variant_mod in enumerate(variant_modlist):
-                matrix[r,c] = mod_match_fuzzy(api_generic, variant_mod, fuzz_function=fuzz_function)
-
     result = VariantMatch(variant.variant_name, variant.variant_number, False, implicit_matrix.copy(), explicit_matrix.copy())
 
-    scores = []
-    api_mod_order = []
-    variant_mod_order = []
+    scores:list[float] = []
+    api_mod_order:list[str] = []
+    variant_mod_order:list[str] = []
 
     for which, api_generic_modlist, variant_modlist, matrix in (implicit_data, explicit_data):
         if (mmc := matrix_max_count(matrix)) > 1:
@@ -230,6 +681,10 @@ def variant_match_fuzzy(api_item:APIItem, variant:ItemVariant, *, fuzz_function=
 
         assert len(matrix.shape) == 2 and matrix.shape[0] == matrix.shape[1]
 
+        if trace is not None:
+            trace.record("matrix", variant, which=which, matrix=matrix.copy())
+            pairs_start = len(scores)
+
         # find the closest matching api/variant pairs of mods
         for _ in range(matrix.shape[0]):
             # find the largest score in the matrix and store it and the corresponding mods
@@ -242,15 +697,99 @@ def variant_match_fuzzy(api_item:APIItem, variant:ItemVariant, *, fuzz_function=
             matrix[r,:] = -1
             matrix[:,c] = -1
 
+        if trace is not None:
+            trace.record("pairs", variant, which=which, pairs=[(a, v, float(score)) for a, v, score in zip(api_mod_order[pairs_start:], variant_mod_order[pairs_start:], scores[pairs_start:])])
+
     result.scores = scores
     result.minumim_score = min(scores) if scores else 100
     result.average_score = sum(scores) / len(scores) if scores else 100
     result.aggregate_score = fuzz_function(" ".join(api_mod_order), " ".join(variant_mod_order), processor=normalize_mod_line)
 
+    if trace is not None:
+        trace.record("scores", variant, minimum=float(result.minumim_score), average=float(result.average_score), aggregate=float(result.aggregate_score))
+
     return result
 
 
-def mod_match_fuzzy(api_generic:GenericMod, variant_mod:GenericMod, *, fuzz_function=FUZZ_FUNCTION) -> float:
+@attrs.define
+class ItemScores:
+    """the fuzzy scores of every mod of an API item against every mod in a list of variant mods
+
+    Scoring an item against all the mods of a PoBItem at once lets every variant of it share the work.
+    Each variant then takes the columns it needs using ItemVariant.implicit_indices and explicit_indices.
+    """
+    api_implicits: list[GenericLine]
+    api_explicits: list[GenericLine]
+    implicit_matrix: npt.NDArray[np.float64]
+    explicit_matrix: npt.NDArray[np.float64]
+
+
+    @classmethod
+    def score(cls, api_implicits:list[GenericLine], api_explicits:list[GenericLine], implicits:list[GenericMod], explicits:list[GenericMod], *, fuzz_function=FUZZ_FUNCTION, implicit_ranges:PackedRanges|None=None, explicit_ranges:PackedRanges|None=None) -> 'ItemScores':
+        """score the genericized mods of an API item against the given variant mods. See score_matrix for `implicit_ranges` and `explicit_ranges`"""
+        return cls(
+            api_implicits,
+            api_explicits,
+            score_matrix(api_implicits, implicits, fuzz_function=fuzz_function, variant_ranges=implicit_ranges),
+            score_matrix(api_explicits, explicits, fuzz_function=fuzz_function, variant_ranges=explicit_ranges)
+        )
+
+
+def score_matrix(api_generics:Sequence[GenericLine|GenericMod], variant_mods:Sequence[GenericMod], *, fuzz_function=FUZZ_FUNCTION, score_cutoff:float|None=None, variant_ranges:PackedRanges|None=None) -> npt.NDArray[np.float64]:
+    """find the similarity (from 0 to 100) between each API mod (rows) and each variant mod (columns).
+    This is the same as calling mod_match_fuzzy on every pair, but each mod is only normalized once and the scoring is done in a single call.
+    Similarities below `score_cutoff` are set to 0. `variant_ranges` are the already-packed ranges of `variant_mods`, if available (see range_mask)"""
+
+    if not api_generics or not variant_mods:
+        return np.zeros((len(api_generics), len(variant_mods)))
+
+    with timing.stage("score_matrix"):
+        matrix = rapidfuzz.process.cdist(
+            [normalize_mod_line(m.line) for m in api_generics],
+            [normalize_mod_line(m.line) for m in variant_mods],
+            scorer=fuzz_function,
+            score_cutoff=score_cutoff,
+            dtype=np.float64
+        )
+        matrix[~range_mask(api_generics, variant_mods, variant_ranges)] = 0
+    #TODO: increased/reduced/more/less sign swapping
+    return matrix
+
+
+def range_mask(api_generics:Sequence[GenericLine|GenericMod], variant_mods:Sequence[GenericMod], variant_ranges:PackedRanges|None=None) -> npt.NDArray[np.bool_]:
+    """find whether the ranges of each API mod (rows) are inside the ranges of each variant mod (columns).
+    This is the same as calling GenericMod.is_inside_range on every pair.
+    `variant_ranges` are the ranges of `variant_mods` packed with ModStore.pack. They're packed here if not given"""
+
+    # padding is chosen so that padded ranges are always inside each other. Mods with different numbers of ranges are handled by the counts
+    width = max((len(m.ranges) for m in api_generics), default=0)
+    if variant_ranges is None:
+        width = max(width, max((len(m.ranges) for m in variant_mods), default=0))
+        variant_ranges = pack_ranges(variant_mods, width, -np.inf, np.inf)
+    else:
+        width = max(width, variant_ranges.width)
+        variant_ranges = variant_ranges.pad(width, -np.inf, np.inf)
+    api_ranges = pack_ranges(api_generics, width, np.inf, -np.inf)
+
+    inside = (api_ranges.low[:,None,:] >= variant_ranges.low[None,:,:]) & (api_ranges.high[:,None,:] <= variant_ranges.high[None,:,:])
+    return inside.all(axis=2) & (api_ranges.counts[:,None] == variant_ranges.counts[None,:])
+
+
+def pack_ranges(mods:Sequence[GenericLine|GenericMod], width:int, low_fill:float, high_fill:float) -> PackedRanges:
+    """pack the ranges of a list of mods into arrays of lower bounds and upper bounds (one row per mod, padded to `width`), and an array of range counts"""
+    low = np.full((len(mods), width), low_fill)
+    high = np.full((len(mods), width), high_fill)
+    counts = np.zeros(len(mods), dtype=np.int64)
+    for i,mod in enumerate(mods):
+        if len(mod.ranges):
+            bounds = np.asarray(mod.ranges, dtype=np.float64)
+            low[i,:len(bounds)] = bounds[:,0]
+            high[i,:len(bounds)] = bounds[:,1]
+        counts[i] = len(mod.ranges)
+    return PackedRanges(low, high, counts)
+
+
+def mod_match_fuzzy(api_generic:GenericLine|GenericMod, variant_mod:GenericMod, *, fuzz_function=FUZZ_FUNCTION) -> float:
     """find the similarity (from 0 to 100) between two mods using fuzzy matching.
     If the ranges of the API mod don't match the variant mod, the similarity is 0"""
 
@@ -282,20 +821,24 @@ def ensure_modlists(api_item:APIItem) -> None:
         api_item["explicitMods"] = []
 
 
-def check_basic_mismatch(api_item:APIItem, variant:ItemVariant) -> bool:
+def check_basic_mismatch(api_item:APIItem, variant:ItemVariant, trace:'MatchTrace|None'=None) -> bool:
     """check if an API item has a basic mismatch with a variant (ie, it's name, basetype, or number of mods are unequal)"""
     basic_mismatch = False
     if api_item["name"] != variant.item_name:
-        vm_log.debug(f'    name: "{api_item["name"]}"/"{variant.item_name}" (a/v)')
+        if trace is not None:
+            trace.record("basic_mismatch", variant, field="name", api=api_item["name"], var=variant.item_name)
         basic_mismatch = True
     if api_item["baseType"] != variant.basetype:
-        vm_log.debug(f'    basetype: "{api_item["baseType"]}"/"{variant.basetype}" (a/v)')
+        if trace is not None:
+            trace.record("basic_mismatch", variant, field="basetype", api=api_item["baseType"], var=variant.basetype)
         basic_mismatch = True
     if len(api_item["implicitMods"]) != len(variant.implicits):
-        vm_log.debug(f'    implicits: {len(api_item["implicitMods"])}/{len(variant.implicits)} (a/v)')
+        if trace is not None:
+            trace.record("basic_mismatch", variant, field="implicits", api=len(api_item["implicitMods"]), var=len(variant.implicits))
         basic_mismatch = True
     if len(api_item["explicitMods"]) != len(variant.explicits):
-        vm_log.debug(f'    explicits: {len(api_item["explicitMods"])}/{len(variant.explicits)} (a/v)')
+        if trace is not None:
+            trace.record("basic_mismatch", variant, field="explicits", api=len(api_item["explicitMods"]), var=len(variant.explicits))
         basic_mismatch = True
     return basic_mismatch
 
@@ -3,8 +3,12 @@ from __future__ import annotations
 
 import os
 import re
+import sys
 import logging
-from typing import Any
+import functools
+import threading
+from typing import Any, overload
+from collections.abc import Callable, Container, Iterator, Sequence
 
 import attrs
 import numpy as np
@@ -18,7 +22,15 @@ log = logging.getLogger(__name__)
 
 FName = str|bytes|os.PathLike
 Ranges = list[list[float]]
+ModRanges = Ranges|npt.NDArray[np.float64]  # the ranges of a GenericMod. For mods in a PoBDB, it's a read-only view into its ModStore (see ModStore.attach)
 APIItem = dict[str,Any]
+ModSignature = tuple[str, tuple[str,...], tuple[str,...]]  # basetype, sorted normalized implicit lines, sorted normalized explicit lines
+LuaRecord = dict[str,Any]  # a Lua item or mod from PoB converted to plain data, see lua_item_record
+
+NUMBER_PATTERN = r"-?\d+(?:\.\d*)?"  # same as -?\d+\.?\d* but without the ambiguity that made failed range matches backtrack
+MOD_TOKEN_PATTERN = re.compile(rf"(-?)\(({NUMBER_PATTERN})-({NUMBER_PATTERN})\)|({NUMBER_PATTERN})")  # sign, start, end | single
+DIGIT_PATTERN = re.compile(r"\d")
+GENERICIZE_CACHE_SIZE = 2**16
 
 
 
@@ -50,7 +62,7 @@ class GenericMod:
         ranges=[[1,2], [4,6], [10,10]]
     """
     line: str
-    ranges: Ranges = attrs.field(metadata={META_MISSING_VALUE: []})
+    ranges: ModRanges = attrs.field(metadata={META_MISSING_VALUE: []}, eq=lambda r: [tuple(x) for x in r])  # compares lists and ModStore views alike
     variants: list[int] = attrs.field(default=[])
     crafted: bool = attrs.field(default=False)
 
@@ -58,12 +70,18 @@ class GenericMod:
     @classmethod
     def from_lua_mod(cls, lua_mod, all_variants:list[str], *, item_name=None) -> 'GenericMod':
         """create a GenericMod from a Lua mod (as pulled from PoB)"""
-        result = cls.genericize_mod(lua_mod.line, item_name=item_name)
+        return cls.from_lua_record(lua_mod_record(lua_mod), all_variants, item_name=item_name)
+
+
+    @classmethod
+    def from_lua_record(cls, record:LuaRecord, all_variants:list[str], *, item_name=None) -> 'GenericMod':
+        """create a GenericMod from a Lua mod that has been converted to plain data (see lua_mod_record)"""
+        result = cls.genericize_mod(record["line"], item_name=item_name)
 
-        result.variants = utils.make_variant_list(lua_mod, len(all_variants))
+        result.variants = utils.make_variant_list(record["variantList"], len(all_variants))
 
-        if lua_mod.crafted:
-            assert lua_mod.crafted == r"{crafted}"
+        if record["crafted"]:
+            assert record["crafted"] == r"{crafted}"
             result.crafted = True
 
         return result
@@ -76,40 +94,118 @@ class GenericMod:
         Either general, like "+(20-30) to Strength", or specific, like "+25 to Strength".
         Both of these would result in a `line` of "+# to Strength",
         and a `ranges` of [[20,30]] and [[25,25]] respectively.
-        """
-        number_pattern = r"-?\d+\.?\d*"
-        range_pattern = rf"(?P<sign>-?)\((?P<start>{number_pattern})-(?P<end>{number_pattern})\)|(?P<single>{number_pattern})"
-
-        ranges = []
-        for m in re.finditer(range_pattern, line):
-            if m["single"]:  # single number
-                n = float(m["single"])
-                ranges.append([n, n])
-            else:  # range
-                r = [float(m["start"]), float(m["end"])]
-                if m["sign"] == "-":
-                    r = [-x for x in r]
-                ranges.append(sorted(r))
-
-        line = re.sub(range_pattern, "#", line)
 
+        The result is a new object that the caller is free to modify. Use genericize_line for a shared, immutable result.
+        """
         if "Area of Effect of Area Skills" in line:
             log.info(f'"{item_name}" has "Area of Effect of Area Skills"')
-            line = line.replace("Area of Effect of Area Skills", "Area of Effect")  #TODO: fix in PoB
 
-        return cls(line, ranges)
+        generic = genericize_line(line)
+        return cls(generic.line, [list(r) for r in generic.ranges])
 
 
-    def is_inside_range(self, other:'GenericMod') -> bool:
+    def is_inside_range(self, other:'GenericMod|GenericLine') -> bool:
         """checks if the ranges of this GenericMod are inside the ranges of another GenericMod"""
-        if len(self.ranges) != len(other.ranges):
+        return _is_inside_range(self.ranges, other.ranges)
+
+
+
+@attrs.frozen
+class GenericLine:
+    """the immutable result of genericizing a line of mod text: a GenericMod without variant or crafted information.
+
+    These are cached by genericize_line and shared between all callers, so they must not be modified.
+    """
+    line: str
+    ranges: tuple[tuple[float,float],...]
+
+
+    def is_inside_range(self, other:'GenericMod|GenericLine') -> bool:
+        """checks if the ranges of this GenericLine are inside the ranges of another GenericMod or GenericLine"""
+        return _is_inside_range(self.ranges, other.ranges)
+
+
+
+@functools.lru_cache(maxsize=GENERICIZE_CACHE_SIZE)
+def genericize_line(line:str) -> GenericLine:
+    """genericize mod text (see GenericMod.genericize_mod)
+
+    Results are memoized by `line` in a bounded LRU cache, since identical mods show up many times across an account.
+    Hit/miss counters are available from genericize_line.cache_info().
+    """
+    line, ranges = tokenize_mod(line)
+
+    if "Area of Effect of Area Skills" in line:
+        line = line.replace("Area of Effect of Area Skills", "Area of Effect")  #TODO: fix in PoB
+
+    return GenericLine(line, tuple(ranges))
+
+
+def tokenize_mod(line:str) -> tuple[str, list[tuple[float,float]]]:
+    """split mod text into its generic line (with each number or number range replaced by #) and its list of ranges, in a single scan"""
+    if DIGIT_PATTERN.search(line) is None:
+        return line, []
+
+    pieces:list[str] = []
+    ranges:list[tuple[float,float]] = []
+    pos = 0
+    for m in MOD_TOKEN_PATTERN.finditer(line):
+        sign, start, end, single = m.groups()
+        pieces.append(line[pos:m.start()])
+        pieces.append("#")
+        pos = m.end()
+
+        if single is not None:  # single number
+            n = float(single)
+            ranges.append((n, n))
+        else:  # range
+            low, high = float(start), float(end)
+            if sign:
+                low, high = -low, -high
+            ranges.append((low, high) if low <= high else (high, low))
+
+    pieces.append(line[pos:])
+    return "".join(pieces), ranges
+
+
+def _is_inside_range(inner:ModRanges|tuple[tuple[float,float],...], outer:ModRanges|tuple[tuple[float,float],...]) -> bool:
+    """checks if each range in `inner` is inside the corresponding range in `outer`"""
+    if len(inner) != len(outer):
+        return False
+
+    for inner_range, outer_range in zip(inner, outer):
+        if inner_range[0] < outer_range[0] or inner_range[1] > outer_range[1]:
             return False
 
-        for self_range, other_range in zip(self.ranges, other.ranges):
-            if self_range[0] < other_range[0] or self_range[1] > other_range[1]:
-                return False
+    return True
+
+
+
+def lua_item_record(lua_item:Any) -> LuaRecord:
+    """convert the fields of a Lua item that PoBItem uses into plain data: lists for Lua lists, the keys of variantLists, and None for nil.
+    pob_export.EXPORT_LUA does the same thing in Lua, for the whole uniqueDB at once"""
+    return {
+        "title": lua_item.title,
+        "baseName": lua_item.baseName,
+        "type": lua_item.type,
+        "source": lua_item.source,
+        "league": lua_item.league,
+        "variantList": list(lua_item.variantList.values()) if lua_item.variantList else None,
+        "variantAlts": [lua_item.variantAlt, lua_item.variantAlt2, lua_item.variantAlt3, lua_item.variantAlt4, lua_item.variantAlt5],
+        "baseLines": [lua_mod_record(b) for b in lua_item.baseLines.values()],
+        "implicitModLines": [lua_mod_record(mod) for mod in lua_item.implicitModLines.values()],
+        "explicitModLines": [lua_mod_record(mod) for mod in lua_item.explicitModLines.values()],
+        "upgradePaths": list(lua_item.upgradePaths.values()) if lua_item.upgradePaths else None,
+    }
 
-        return True
+
+def lua_mod_record(lua_mod:Any) -> LuaRecord:
+    """convert a Lua mod (or base line) into plain data. See lua_item_record"""
+    return {
+        "line": lua_mod["line"],
+        "variantList": list(lua_mod.variantList.keys()) if lua_mod.variantList else None,
+        "crafted": lua_mod.crafted,
+    }
 
 
 
@@ -130,56 +226,376 @@ class PoBItem:
 
     @classmethod
     def from_lua_item(cls, lua_item:Any) -> 'PoBItem':
-        variants = list(lua_item.variantList.values() if lua_item.variantList else ["Only"])
+        """create a PoBItem from a Lua item (as pulled from PoB). Each field read crosses into Lua, so pob_export reads the whole uniqueDB in Lua and uses from_lua_record instead"""
+        return cls.from_lua_record(lua_item_record(lua_item))
+
+
+    @classmethod
+    def from_lua_record(cls, record:LuaRecord) -> 'PoBItem':
+        """create a PoBItem from a Lua item that has been converted to plain data (see lua_item_record)"""
+        title = record["title"]
+        variants = list(record["variantList"] if record["variantList"] is not None else ["Only"])
 
         variant_slots = 1
-        if lua_item.variantAlt:
-            variant_slots = 2
-        if lua_item.variantAlt2:
-            variant_slots = 3
-        if lua_item.variantAlt3:
-            variant_slots = 4
-        if lua_item.variantAlt4:
-            variant_slots = 5
-        if lua_item.variantAlt5:
-            variant_slots = 6
+        for slots, alt in enumerate(record["variantAlts"], start=2):
+            if alt:
+                variant_slots = slots
 
         basetypes:list[BaseTypeVariant] = []
-        for b in lua_item.baseLines.values():
-            basetypes.append(BaseTypeVariant(b["line"], utils.make_variant_list(b, len(variants))))
+        for b in record["baseLines"]:
+            basetypes.append(BaseTypeVariant(b["line"], utils.make_variant_list(b["variantList"], len(variants))))
 
         implicits:list[GenericMod] = []
         explicits:list[GenericMod] = []
-        for outlist, inlist in ((implicits, lua_item.implicitModLines), (explicits, lua_item.explicitModLines)):
-            for mod in inlist.values():
-                generic = GenericMod.from_lua_mod(mod, variants, item_name=lua_item.title)
+        for outlist, inlist in ((implicits, record["implicitModLines"]), (explicits, record["explicitModLines"])):
+            for mod in inlist:
+                generic = GenericMod.from_lua_record(mod, variants, item_name=title)
 
                 if generic.line.startswith("LevelReq: "):
-                    log.info(f'LevelReq: {lua_item.title}')
+                    log.info(f'LevelReq: {title}')
                     continue
 
                 if generic.line == "This item can be anointed by Cassia":
-                    log.info(f'{lua_item.title} can be annointed')
+                    log.info(f'{title} can be annointed')
                     continue
 
                 outlist.append(generic)
 
         basetype:str|None = None
         if len(basetypes) <= 1:
-            basetype = lua_item.baseName
+            basetype = record["baseName"]
             basetypes = []
 
         upgrade:UpgradePath|str|None = None
-        if lua_item.upgradePaths:
-            assert len(lua_item.upgradePaths) == 1
+        if record["upgradePaths"] is not None:
+            assert len(record["upgradePaths"]) == 1
             upgrade_pattern = r"Upgrades to unique{(.+?)} (?:using|via) currency{(.+?)}"
-            upgrade_match = re.fullmatch(upgrade_pattern, lua_item.upgradePaths[1])
+            upgrade_match = re.fullmatch(upgrade_pattern, record["upgradePaths"][0])
             if upgrade_match:
                 upgrade = UpgradePath(upgrade_match[1], upgrade_match[2])
             else:
-                upgrade = lua_item.upgradePaths[1]
+                upgrade = record["upgradePaths"][0]
+
+        return cls(title, basetype, basetypes, record["type"], record["source"], record["league"], upgrade, variants, implicits, explicits, variant_slots)
+
+
+
+@attrs.frozen
+class PackedRanges:
+    """the ranges of a list of mods packed into arrays, for checking many ranges at once
+
+    Row i of `low` and `high` holds the lower and upper bounds of the ranges of mod i, padded to the same width. `counts` holds the number of ranges of each mod.
+    """
+    low: npt.NDArray[np.float64]
+    high: npt.NDArray[np.float64]
+    counts: npt.NDArray[np.int64]
+
+
+    @property
+    def width(self) -> int:
+        return self.low.shape[1]
 
-        return cls(lua_item.title, basetype, basetypes, lua_item.type, lua_item.source, lua_item.league, upgrade, variants, implicits, explicits, variant_slots)
+
+    def take(self, indices:list[int]|npt.NDArray[np.int64]) -> 'PackedRanges':
+        """the packed ranges of a subset of the mods"""
+        return PackedRanges(self.low[indices], self.high[indices], self.counts[indices])
+
+
+    def pad(self, width:int, low_fill:float, high_fill:float) -> 'PackedRanges':
+        """widen the packed ranges to `width`, filling in the new columns"""
+        if width <= self.width:
+            return self
+        extra = ((0, 0), (0, width - self.width))
+        return PackedRanges(np.pad(self.low, extra, constant_values=low_fill), np.pad(self.high, extra, constant_values=high_fill), self.counts)
+
+
+
+@attrs.define
+class ModStore:
+    """columnar storage for the lines and ranges of every mod in a PoBDB
+
+    Lines and sets of ranges are both stored once, however many mods share them.
+    `lines` holds each distinct generic line, and `line_ids` holds the index into `lines` of each mod.
+    `bounds` holds each distinct set of ranges as consecutive rows of [low, high]. Set j is bounds[offsets[j]:offsets[j+1]].
+    `range_ids` holds the index of the set of ranges of each mod.
+    `packed` holds every set of ranges packed for range checks (see PackedRanges), so the ranges of any mods can be packed with a single lookup.
+    The mods of each item are stored together, implicits then explicits. `item_mods` maps id(PoBItem) to the index of its first mod and its numbers of implicits and explicits.
+    More items can be stored later with extend, which isn't thread-safe.
+    """
+    lines: list[str]
+    line_ids: npt.NDArray[np.int32]
+    bounds: npt.NDArray[np.float64]
+    offsets: npt.NDArray[np.int64]
+    range_ids: npt.NDArray[np.int32]
+    packed: PackedRanges = attrs.field(repr=False)
+    item_mods: dict[int,tuple[int,int,int]] = attrs.field(repr=False)
+    _line_index: dict[str,int] = attrs.field(factory=dict, repr=False)
+    _range_index: dict[tuple[tuple[float,float],...],int] = attrs.field(factory=dict, repr=False)
+    _views: list[npt.NDArray[np.float64]] = attrs.field(factory=list, repr=False)
+    """a read-only view of each set of ranges, for attach"""
+
+
+    @classmethod
+    def build(cls, items:list[PoBItem]) -> 'ModStore':
+        """store the mods of the given items. The mods themselves aren't changed until attach is called"""
+        result = cls(
+            [],
+            np.zeros(0, dtype=np.int32),
+            np.zeros((0, 2), dtype=np.float64),
+            np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.int32),
+            PackedRanges(np.zeros((0, 0)), np.zeros((0, 0)), np.zeros(0, dtype=np.int64)),
+            {},
+        )
+        result.extend(items)
+        return result
+
+
+    def __len__(self) -> int:
+        return len(self.line_ids)
+
+
+    def extend(self, items:list[PoBItem]) -> None:
+        """store the mods of more items. The mods themselves aren't changed until attach is called.
+        New sets of ranges are added as a block of their own, so the views already attached to mods stay valid"""
+        num_sets = len(self._range_index)
+        new_sets:list[tuple[tuple[float,float],...]] = []
+        line_ids:list[int] = []
+        range_ids:list[int] = []
+        for item in items:
+            self.item_mods[id(item)] = (len(self.line_ids) + len(line_ids), len(item.implicits), len(item.explicits))
+            for mod in (*item.implicits, *item.explicits):
+                line_id = self._line_index.setdefault(mod.line, len(self._line_index))
+                if line_id == len(self.lines):
+                    self.lines.append(sys.intern(mod.line))
+                line_ids.append(line_id)
+
+                ranges = tuple((float(r[0]), float(r[1])) for r in mod.ranges)
+                range_id = self._range_index.setdefault(ranges, len(self._range_index))
+                if range_id == num_sets + len(new_sets):
+                    new_sets.append(ranges)
+                range_ids.append(range_id)
+
+        counts = np.array([len(ranges) for ranges in new_sets], dtype=np.int64)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        block = np.array([r for ranges in new_sets for r in ranges], dtype=np.float64).reshape(-1, 2)
+        block.flags.writeable = False
+        block_offsets = offsets.tolist()
+        self._views.extend(block[start:end] for start, end in zip(block_offsets, block_offsets[1:]))
+
+        # padding is always outside other ranges, as suits the ranges of variant mods (see legacy.range_mask)
+        width = max(self.packed.width, int(counts.max()) if len(counts) else 0)
+        low = np.full((len(counts), width), -np.inf)
+        high = np.full((len(counts), width), np.inf)
+        rows = np.repeat(np.arange(len(counts)), counts)
+        cols = np.arange(len(block)) - np.repeat(offsets[:-1], counts)
+        low[rows, cols] = block[:,0]
+        high[rows, cols] = block[:,1]
+        packed = self.packed.pad(width, -np.inf, np.inf)
+
+        self.line_ids = np.concatenate([self.line_ids, np.array(line_ids, dtype=np.int32)])
+        self.range_ids = np.concatenate([self.range_ids, np.array(range_ids, dtype=np.int32)])
+        self.bounds = np.concatenate([self.bounds, block]) if len(self.bounds) else block
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + offsets[1:]])
+        self.packed = PackedRanges(np.concatenate([packed.low, low]), np.concatenate([packed.high, high]), np.concatenate([packed.counts, counts]))
+
+
+    def attach(self, items:list[PoBItem]) -> None:
+        """make the mods of the items (which must have been stored already) share this storage,
+        by replacing their lines with the interned lines and their ranges with read-only views into the stored ranges. Mods with the same ranges share a view"""
+        for item in items:
+            start, num_implicits, num_explicits = self.item_mods[id(item)]
+            end = start + num_implicits + num_explicits
+            for mod, line_id, range_id in zip((*item.implicits, *item.explicits), self.line_ids[start:end].tolist(), self.range_ids[start:end].tolist()):
+                mod.line = self.lines[line_id]
+                mod.ranges = self._views[range_id]
+
+
+    def pack(self, indices:npt.NDArray[np.int64]|slice) -> PackedRanges:
+        """pack the ranges of the mods with the given indices. The padding is always outside other ranges, as suits the ranges of variant mods"""
+        range_ids = self.range_ids[indices]
+        counts = self.packed.counts[range_ids]
+        width = int(counts.max()) if len(counts) else 0
+        return PackedRanges(self.packed.low[range_ids, :width], self.packed.high[range_ids, :width], counts)
+
+
+    def pack_item(self, item:PoBItem) -> tuple[PackedRanges, PackedRanges]:
+        """pack the ranges of the implicits and of the explicits of an item"""
+        start, num_implicits, num_explicits = self.item_mods[id(item)]
+        return self.pack(slice(start, start + num_implicits)), self.pack(slice(start + num_implicits, start + num_implicits + num_explicits))
+
+
+
+@attrs.define(eq=False)
+class LazyItems(Sequence[PoBItem]):
+    """a list of PoBItems that are each only built from their raw records the first time they're accessed
+
+    `records` are the raw records (like dicts loaded from json), and `keys` are the name and basetypes of each record (see PoBDB.index).
+    `structure` builds a PoBItem from a record. It must be picklable (a module-level function) for the list to be pickled.
+    A record is dropped once its item is built.
+    Items are built under a lock, so concurrent accesses build each item once.
+    """
+    records: list[Any] = attrs.field(repr=False)
+    keys: Sequence[tuple[str,list[str]]] = attrs.field(repr=False)
+    structure: Callable[[Any],PoBItem]
+    built: list[PoBItem|None] = attrs.field(init=False, default=attrs.Factory(lambda self: [None] * len(self.records), takes_self=True), repr=False)
+    _lock: threading.Lock = attrs.field(init=False, factory=threading.Lock, repr=False)
+
+
+    def __reduce__(self) -> tuple[Callable[..., LazyItems], tuple[list[Any], Sequence[tuple[str,list[str]]], Callable[[Any],PoBItem], list[PoBItem|None]]]:
+        return (LazyItems._unpickle, (self.records, self.keys, self.structure, self.built))
+
+
+    @classmethod
+    def _unpickle(cls, records:list[Any], keys:Sequence[tuple[str,list[str]]], structure:Callable[[Any],PoBItem], built:list[PoBItem|None]) -> 'LazyItems':
+        # the lock can't be pickled
+        result = cls(records, keys, structure)
+        result.built = built
+        return result
+
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+    @overload
+    def __getitem__(self, i:int) -> PoBItem: ...
+    @overload
+    def __getitem__(self, i:slice) -> list[PoBItem]: ...
+    def __getitem__(self, i:int|slice) -> PoBItem|list[PoBItem]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        item = self.built[i]
+        if item is None:
+            with self._lock:
+                item = self.built[i]
+                if item is None:
+                    item = self.structure(self.records[i])
+                    self.built[i] = item
+                    self.records[i] = None
+        return item
+
+
+    def num_built(self) -> int:
+        """the number of items that have been built so far"""
+        return sum(item is not None for item in self.built)
+
+
+
+@attrs.define
+class PoBDB:
+    """the PoB unique database, as loaded by utils.load_pob_db
+
+    `items` is the list of PoBItem, sorted by name. It can be a LazyItems, to only build the items that are used (see utils.load_pob_db).
+    `index` maps every (name, basetype) pair, including each entry in PoBItem.basetypes, to the index of its PoBItem in `items`.
+        If more than one item has the same pair, the first one in `items` wins.
+    `mod_store` holds the lines and ranges of the mods of the items that have been packed. The mods of an item are added to it and changed to share it (see ModStore.attach)
+        the first time the item is packed, so loading doesn't pay for the items that are never matched.
+    """
+    items: Sequence[PoBItem]
+    fname: FName|None = attrs.field(default=None)
+    """the file the database was loaded from, if any. Lets worker processes load their own copy"""
+    index: dict[tuple[str,str],int] = attrs.field(init=False, repr=False)
+    mod_store: ModStore = attrs.field(init=False, factory=lambda: ModStore.build([]), repr=False, eq=False)
+    _mod_store_lock: threading.Lock = attrs.field(init=False, factory=threading.Lock, repr=False, eq=False)
+    variant_sets: dict[int,'VariantSet'] = attrs.field(init=False, factory=dict, repr=False)
+    """cache of the variants of each PoBItem, keyed by id(PoBItem). Filled in as needed by legacy.get_variant_set"""
+
+
+    def __attrs_post_init__(self) -> None:
+        keys:Sequence[tuple[str,list[str]]]
+        if isinstance(self.items, LazyItems):
+            keys = self.items.keys
+        else:
+            keys = [(item.name, [item.basetype] if item.basetype is not None else [b.basetype for b in item.basetypes]) for item in self.items]
+
+        self.index = {}
+        for i, (name, basetypes) in enumerate(keys):
+            for basetype in basetypes:
+                self.index.setdefault((name, basetype), i)
+
+
+    def __reduce__(self) -> tuple[type, tuple[Sequence[PoBItem], FName|None]]:
+        # the index and caches are keyed by object ids, so they have to be rebuilt when unpickled
+        return (PoBDB, (self.items, self.fname))
+
+
+    @property
+    def lazy(self) -> bool:
+        return isinstance(self.items, LazyItems)
+
+
+    def warm_up(self, names:Container[str]|None=None) -> None:
+        """build the lazy items with the given names now, or all of them if no names are given. Does nothing if the items aren't lazy"""
+        if isinstance(self.items, LazyItems):
+            for i, (name, _) in enumerate(self.items.keys):
+                if names is None or name in names:
+                    self.items[i]
+
+
+    def pack_item(self, item:PoBItem) -> tuple[PackedRanges, PackedRanges]:
+        """pack the ranges of the implicits and of the explicits of one of the items, adding its mods to `mod_store` the first time"""
+        if id(item) not in self.mod_store.item_mods:
+            with self._mod_store_lock:
+                if id(item) not in self.mod_store.item_mods:
+                    self.mod_store.extend([item])
+                    self.mod_store.attach([item])
+        return self.mod_store.pack_item(item)
+
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+    def __iter__(self) -> Iterator[PoBItem]:
+        return iter(self.items)
+
+
+    def __getitem__(self, i:int) -> PoBItem:
+        return self.items[i]
+
+
+    def find(self, name:str, basetype:str) -> PoBItem|None:
+        """return the unique item with the given name and basetype, or None if there isn't one"""
+        i = self.index.get((name, basetype))
+        return self.items[i] if i is not None else None
+
+
+
+@attrs.define
+class ManifestEntry:
+    name: str
+    basetypes: list[str]
+    hash: str
+    """see utils.pob_item_hash"""
+
+
+
+@attrs.define
+class PoBManifest:
+    """the content hash of every item in a PoB export, and the items that were added, removed or modified since the export before it. See utils.save_pob_manifest
+
+    Items are identified by name and basetypes. Like PoBDB.index, if more than one item has the same name and basetype, the first one wins.
+    """
+    items: list[ManifestEntry]
+    added: list[ManifestEntry] = attrs.field(factory=list)
+    removed: list[ManifestEntry] = attrs.field(factory=list)
+    modified: list[ManifestEntry] = attrs.field(factory=list)
+    index: dict[tuple[str,str],str] = attrs.field(init=False, repr=False, eq=False)
+
+
+    def __attrs_post_init__(self) -> None:
+        self.index = {}
+        for entry in self.items:
+            for basetype in entry.basetypes:
+                self.index.setdefault((entry.name, basetype), entry.hash)
+
+
+    def find_hash(self, name:str, basetype:str) -> str|None:
+        """return the hash of the unique item with the given name and basetype, or None if there isn't one. The same item as PoBDB.find"""
+        return self.index.get((name, basetype))
 
 
 
@@ -191,6 +607,34 @@ class ItemVariant:
     variant_number: int
     implicits: list[GenericMod]
     explicits: list[GenericMod]
+    implicit_indices: list[int] = attrs.field(factory=list, repr=False)
+    """indices of `implicits` in the implicits of the PoBItem this variant was made from"""
+    explicit_indices: list[int] = attrs.field(factory=list, repr=False)
+    """indices of `explicits` in the explicits of the PoBItem this variant was made from"""
+    signature: ModSignature = attrs.field(default=("", (), ()), repr=False)
+    """the basetype and normalized mod lines of this variant, for exact matching. See legacy.make_signature"""
+    packed_ranges: npt.NDArray[np.float64] = attrs.field(factory=lambda: np.zeros((0, 2)), repr=False, eq=False)
+    """the ranges of all mods, as rows of [low, high], in the same order as the lines in `signature`"""
+
+
+
+@attrs.define
+class VariantSet:
+    """all the variants of a PoBItem, with an index of their signatures for exact matching
+
+    `implicit_ranges` and `explicit_ranges` are the packed ranges of all the implicits and explicits of the PoBItem, if it's from a PoBDB (see ModStore.pack_item).
+    Each variant's share of them can be taken with ItemVariant.implicit_indices and explicit_indices.
+    """
+    variants: list[ItemVariant]
+    implicit_ranges: PackedRanges|None = attrs.field(default=None, repr=False, eq=False)
+    explicit_ranges: PackedRanges|None = attrs.field(default=None, repr=False, eq=False)
+    by_signature: dict[ModSignature,list[ItemVariant]] = attrs.field(init=False, repr=False)
+
+
+    def __attrs_post_init__(self) -> None:
+        self.by_signature = {}
+        for variant in self.variants:
+            self.by_signature.setdefault(variant.signature, []).append(variant)
 
 
 
@@ -1,16 +1,24 @@
 #!/usr/bin/env python
 
+import os
 import time
+import hashlib
+import atexit
+import asyncio
+import threading
 import requests
 import json
 from collections import deque
 import logging
 
 from typing import Any
+from collections.abc import Callable, Container
 
 
 ROOT = "https://api.pathofexile.com"
 TIME_PADDING = 1
+_shared_ratelimiters:dict[str,"RateLimiter"] = {}  # by absolute file name, see RateLimiter.shared
+CACHED_ENDPOINTS = ("stash",)  # the endpoints a ResponseCache caches by default. Stash tabs are big and requested often, the rest are small
 
 STASH_TAB_COLOUR_NAMES = {
     "7c5436" : "brown1",
@@ -66,21 +74,21 @@ class RateLimitOnCooldownError (Exception):
 
 class RateLimiter:
     def __init__(self) -> None:
-        self.policies:dict[str,dict[int,RateLimitRule]]  = {}  # {policy : {period : RateLimitRule}}
+        self.policies:dict[str,dict[tuple[str,int],RateLimitRule]] = {}  # {policy : {(rule, period) : RateLimitRule}}
         self.endpoint_policies:dict[tuple[str,bool],str] = {}  # {(endpoint, has_args) : policy}
 
 
-    def update(self, endpoint:str, has_args, headers) -> None:
-        """update the RateLimiter after a request"""
+    def update(self, endpoint:str, has_args, headers, reserved=False) -> None:
+        """update the RateLimiter after a request. `reserved` is whether the request was already counted by reserve()"""
         ep = (endpoint, has_args)
-        policy = self.parse_headers(headers)
+        policy = self.parse_headers(headers, reserved)
         if ep not in self.endpoint_policies:
             self.endpoint_policies[ep] = policy
         else:
             assert self.endpoint_policies[ep] == policy
 
 
-    def parse_headers(self, headers:dict[str,str]) -> str:
+    def parse_headers(self, headers:dict[str,str], reserved=False) -> str:
         """update the RateLimiter from the given response headers and return the policy that applied to the request"""
         # adapted from https://github.com/BPL-Development-Team/poe-client/blob/3b31b0dbed753dac9ef79844eb103b57b5cf865e/poe_client/rate_limiter.py#L103
 
@@ -88,29 +96,25 @@ class RateLimiter:
             # endpoint has no rate limiting
             return ""
 
-        rule_names = headers["X-Rate-Limit-Rules"].split(",")
-        if len(rule_names) > 1:
-            raise NotImplementedError(f"processing for multiple X-Rate-Limit-Rules is not implemented (found {rule_names})")
-
-        for rule_name in rule_names:
-            policy = f"{rule_name}/{headers['X-Rate-Limit-Policy']}"
-
-            if policy not in self.policies:
-                self.policies[policy] = {}
+        # every rule (e.g. Account and Ip) applies to every request of the policy
+        policy = headers["X-Rate-Limit-Policy"]
+        if policy not in self.policies:
+            self.policies[policy] = {}
 
+        for rule_name in headers["X-Rate-Limit-Rules"].split(","):
             rule_specs = headers[f"X-Rate-Limit-{rule_name}"].split(",")
             for rule_spec in rule_specs:
                 max_hits, period, penalty = (int(x) for x in rule_spec.split(":"))
 
-                if period not in self.policies[policy]:
-                    self.policies[policy][period] = RateLimitRule(policy, max_hits, period, penalty)
+                if (rule_name, period) not in self.policies[policy]:
+                    self.policies[policy][rule_name, period] = RateLimitRule(f"{rule_name}/{policy}", max_hits, period, penalty)
 
             states = headers[f"X-Rate-Limit-{rule_name}-State"].split(",")
             for state in states:
                 current_hits, period, time_restricted = (int(x) for x in state.split(":"))
-                self.policies[policy][period].state.update(current_hits, time_restricted)
+                self.policies[policy][rule_name, period].state.update(current_hits, time_restricted, reserved)
 
-        return policy  # only works for one rule
+        return policy
 
 
     def time_until_ready(self, endpoint:str, has_args:bool) -> float:
@@ -123,7 +127,7 @@ class RateLimiter:
 
         policy = self.endpoint_policies[ep]
         result:float = 0
-        for rule in self.policies[policy].values():
+        for rule in self.policies.get(policy, {}).values():  # no rules if the endpoint has no rate limiting
             t = rule.time_until_ready()
             if t:
                 log.debug(f"time_until_ready {rule.name()} {t:.2f}")
@@ -131,6 +135,82 @@ class RateLimiter:
         return result
 
 
+    def save(self, fname:str) -> None:
+        """save the rules and their states, so that the next session knows about the requests made in this one (see load)"""
+        data = {
+            "policies": {
+                policy: [
+                    {"rule": rule_name, "max_hits": rule.max_hits, "period": period, "penalty": rule.penalty, "times": list(rule.state.times), "restricted_until": rule.state.restricted_until}
+                    for (rule_name, period), rule in rules.items()
+                ]
+                for policy, rules in self.policies.items()
+            },
+            "endpoint_policies": [[endpoint, has_args, policy] for (endpoint, has_args), policy in self.endpoint_policies.items()],
+        }
+        with open(fname + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(fname + ".tmp", fname)
+
+
+    @classmethod
+    def load(cls, fname:str) -> "RateLimiter":
+        """load a RateLimiter saved by save. Times are wall-clock times, so requests and restrictions that have expired since then are ignored.
+        Returns a new RateLimiter if there's no file, or if it can't be read"""
+        ratelimiter = cls()
+        if not os.path.exists(fname):
+            return ratelimiter
+
+        try:
+            with open(fname) as f:
+                data = json.load(f)
+
+            for policy, rules in data["policies"].items():
+                ratelimiter.policies[policy] = {}
+                for r in rules:
+                    rule = RateLimitRule(f"{r['rule']}/{policy}", r["max_hits"], r["period"], r["penalty"])
+                    rule.state.times.extend(r["times"])
+                    rule.state.purge_times()
+                    rule.state.current_hits = len(rule.state.times)
+                    rule.state.restricted_until = r["restricted_until"]
+                    ratelimiter.policies[policy][r["rule"], r["period"]] = rule
+
+            for endpoint, has_args, policy in data["endpoint_policies"]:
+                ratelimiter.endpoint_policies[endpoint, has_args] = policy
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            log.warning(f"couldn't load the rate limit state from {fname!r}, starting without it: {e!r}")
+            return cls()
+
+        return ratelimiter
+
+
+    @classmethod
+    def shared(cls, fname:str) -> "RateLimiter":
+        """the RateLimiter for a state file, which is shared by everything that uses the same file. It's loaded the first time (see load), and saved once on exit"""
+        key = os.path.abspath(fname)
+        ratelimiter = _shared_ratelimiters.get(key)
+        if ratelimiter is None:
+            ratelimiter = _shared_ratelimiters[key] = cls.load(fname)
+            atexit.register(ratelimiter.save, key)
+        return ratelimiter
+
+
+    def reserve(self, endpoint:str, has_args:bool) -> float:
+        """if the indicated request is allowed now, count it against the rules of its policy right away and return 0. Otherwise return the number of seconds until it's allowed (see time_until_ready)
+
+        update() only counts a request once its response arrives, so requests that are made at the same time have to reserve their place in the rules before they're sent.
+        Call update() with reserved=True once the response arrives. Requests to an endpoint that hasn't been used before can't be reserved, since its policy isn't known yet.
+        """
+        result = self.time_until_ready(endpoint, has_args)
+        if result:
+            return result
+
+        policy = self.endpoint_policies.get((endpoint, has_args))
+        if policy is not None:
+            for rule in self.policies.get(policy, {}).values():
+                rule.state.times.append(time.time())
+        return 0
+
+
 
 class RateLimitRule:
     """a single rate limit rule, with a maximum number of hits over a given period, and a time penalty for going over"""
@@ -180,14 +260,19 @@ class RateLimitState:
         self.times:deque[float] = deque()
 
 
-    def update(self, current_hits:int, time_restricted:int) -> None:
-        """update the rate limit state"""
+    def update(self, current_hits:int, time_restricted:int, reserved=False) -> None:
+        """update the rate limit state after a request. If the request was `reserved`, it's already in `times`"""
         self.current_hits    = current_hits
         self.restricted_until = time.time() + time_restricted
 
-        self.times.append(time.time())
+        if not reserved:
+            self.times.append(time.time())
         self.purge_times()
 
+        # the server also counts requests that weren't made here (e.g. by another session). Assume they were just made, so they don't expire early
+        for _ in range(current_hits - len(self.times)):
+            self.times.append(time.time())
+
 
     def purge_times(self) -> None:
         """remove times older than the period"""
@@ -197,6 +282,113 @@ class RateLimitState:
 
 
 
+class RateLimitScheduler:
+    """a queue of requests for each policy of a RateLimiter, for making requests at the same time
+
+    Requests of the same policy are released one at a time, in the order they were made, at the earliest moment that every rule of the policy allows (see RateLimiter.reserve).
+    Waiting for a rule is much cheaper than violating it, since the penalty for a violation is usually much longer than the rule's period.
+    """
+    def __init__(self, ratelimiter:RateLimiter) -> None:
+        self._ratelimiter = ratelimiter
+        self._queues:dict[str,asyncio.Lock] = {}  # {policy : queue}. Waiters acquire an asyncio.Lock in the order they wait for it
+
+
+    async def acquire(self, endpoint:str, has_args:bool) -> bool:
+        """wait until the indicated request can be made, and reserve it. Returns whether it was reserved, so it can be passed on to RateLimiter.update"""
+        policy = self._ratelimiter.endpoint_policies.get((endpoint, has_args))
+        if policy is None:
+            # never used this endpoint before
+            return False
+
+        async with self._queues.setdefault(policy, asyncio.Lock()):
+            while rate_limit_wait := self._ratelimiter.reserve(endpoint, has_args):
+                log.info(f"rate limited. sleeping for {rate_limit_wait:.2f} seconds")
+                await asyncio.sleep(rate_limit_wait)
+        return True
+
+
+
+class ResponseCache:
+    """an on-disk cache of API responses, with one file for each account and url
+
+    Only the responses of `endpoints` are cached. The account keeps the responses of different accounts that share the cache apart.
+    A response is used without making a request for `ttl` seconds after it was received, or for as long as it's cached with `prefer_cached`.
+    After that it's revalidated with its ETag or Last-Modified header, if the server sent one, so an unchanged response isn't downloaded again.
+    A cache file that can't be read is treated as missing.
+    """
+    def __init__(self, folder:str, ttl:float=300, prefer_cached=False, endpoints:Container[str]=CACHED_ENDPOINTS) -> None:
+        self.folder = folder
+        self.ttl = ttl
+        self.prefer_cached = prefer_cached
+        self.endpoints = endpoints
+        os.makedirs(folder, exist_ok=True)
+
+
+    def _fname(self, account:str, url:str) -> str:
+        return os.path.join(self.folder, hashlib.sha256(f"{account}\n{url}".encode()).hexdigest() + ".json")
+
+
+    def _load(self, account:str, url:str) -> dict[str,Any]|None:
+        try:
+            with open(self._fname(account, url)) as f:
+                entry = json.load(f)
+            if entry["account"] == account and entry["url"] == url:
+                return entry
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f"ignoring unreadable cached response for {url}: {e!r}")
+        return None
+
+
+    def _save(self, account:str, url:str, entry:dict[str,Any]) -> None:
+        fname = self._fname(account, url)
+        with open(fname + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(fname + ".tmp", fname)
+
+
+    def get(self, account:str, url:str) -> Any:
+        """get the cached data for the url if it can be used without making a request, otherwise None"""
+        entry = self._load(account, url)
+        if entry is None:
+            return None
+        if self.prefer_cached or time.time() - entry["time"] < self.ttl:
+            log.debug(f"using cached response for {url}")
+            return entry["data"]
+        return None
+
+
+    def headers(self, account:str, url:str) -> dict[str,str]:
+        """get the headers that ask the server to only send the response for the url if it changed since it was cached"""
+        entry = self._load(account, url)
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+    def update(self, account:str, url:str, r:requests.Response) -> tuple[Any,int]:
+        """get the data and status code of a response to a request with `headers`, and cache it if it was successful. The data of a 304 (not modified) response comes from the cache"""
+        if r.status_code == 304:
+            entry = self._load(account, url)
+            if entry is None:
+                raise PoEError("not modified, but the response isn't cached", r.status_code, None)
+            log.debug(f"cached response for {url} is still valid")
+            entry["time"] = time.time()
+            self._save(account, url, entry)
+            return entry["data"], 200
+
+        data = r.json()
+        if r.status_code == 200 and "error" not in data:
+            self._save(account, url, {"account": account, "url": url, "time": time.time(), "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"), "data": data})
+        return data, r.status_code
+
+
+
 class PoEClient:
     """a Path of Exile API client"""
     _ses: requests.Session
@@ -207,10 +399,17 @@ class PoEClient:
     _secrets: dict[str,str]
     _token: dict[str,Any]
     _ratelimiter: RateLimiter
+    _cache: ResponseCache|None
+    _cache_account: str
 
-    def __init__(self, oauth_fname, secrets_fname, token_fname) -> None:
+    def __init__(self, oauth_fname, secrets_fname, token_fname, ratelimit_fname:str|None=None, cache:ResponseCache|None=None) -> None:
+        """with `ratelimit_fname`, the rate limit state is loaded from that file, and saved to it on exit (see RateLimiter.shared). With a `cache`, responses are cached and revalidated through it"""
         self._ses = requests.Session()
-        self._ratelimiter = RateLimiter()
+        self._cache = cache
+        if ratelimit_fname is None:
+            self._ratelimiter = RateLimiter()
+        else:
+            self._ratelimiter = RateLimiter.shared(ratelimit_fname)
         self._user_agent_suffix = ""
 
         with open(oauth_fname) as f:
@@ -223,6 +422,8 @@ class PoEClient:
         with open(token_fname) as f:
             self._token = json.load(f)
         self._ses.headers.update({"Authorization" : f"Bearer {self._token['access_token']}"})
+        # the account id stays the same when the token is refreshed. Tokens without one are told apart by a hash, so the token itself isn't written to the cache
+        self._cache_account = self._token.get("sub") or hashlib.sha256(self._token["access_token"].encode()).hexdigest()
 
 
     def _update_user_agent(self) -> None:
@@ -239,8 +440,8 @@ class PoEClient:
         self._update_user_agent()
 
 
-    def _get(self, endpoint:str, response_key:str="", *args:str, has_args=None, blocking=True) -> Any:
-        """make a get request"""
+    def _get(self, endpoint:str, response_key:str="", *args:str, has_args=None, blocking=True, revalidate=False) -> Any:
+        """make a get request. With `revalidate`, a cached response is always revalidated with the server, even if it's fresh"""
         if has_args is None:
             has_args = bool(args)
 
@@ -248,6 +449,10 @@ class PoEClient:
         if args:
             url += "/" + "/".join(args)
 
+        cache = self._cache_for(endpoint)
+        if cache is not None and not revalidate and (data := cache.get(self._cache_account, url)) is not None:
+            return _parse_response(data, 200, response_key)
+
         for _ in range(2):  # might violate rate limit base on past session that we don't know about, so try again at most one time
             rate_limit_wait = self._ratelimiter.time_until_ready(endpoint, has_args)
             if rate_limit_wait and not blocking:
@@ -256,26 +461,27 @@ class PoEClient:
                 log.info(f"rate limited. sleeping for {rate_limit_wait:.2f} seconds")
             time.sleep(rate_limit_wait)
 
-            r = self._ses.get(url)
+            r = self._ses.get(url, headers=cache.headers(self._cache_account, url) if cache else None)
             self._ratelimiter.update(endpoint, has_args, r.headers)
             if r.status_code != 429:
                 break
             log.info(f"rate limit violated. time until ready: {self._ratelimiter.time_until_ready(endpoint, has_args):.2f}")
 
-        data = r.json()
-        if r.status_code == 200 and "error" not in data:
-            if response_key:
-                return data[response_key]
-            else:
-                return data
-        else:
-            if "error" in data:
-                if not isinstance(data["error"], dict):
-                    raise RuntimeError(data)
-                else:
-                    raise PoEError(data["error"]["message"], r.status_code, data["error"]["code"])
-            else:
-                raise PoEError("unknown error", r.status_code, None)
+        return self._read_response(url, r, response_key, cache)
+
+
+    def _cache_for(self, endpoint:str) -> ResponseCache|None:
+        """the cache for the responses of an endpoint, if there's a cache and it caches that endpoint"""
+        if self._cache is not None and endpoint in self._cache.endpoints:
+            return self._cache
+        return None
+
+
+    def _read_response(self, url:str, r:requests.Response, response_key:str, cache:ResponseCache|None) -> Any:
+        """get the data from a response to a get request, through the cache if there is one"""
+        if cache is None:
+            return _parse_response(r.json(), r.status_code, response_key)
+        return _parse_response(*cache.update(self._cache_account, url, r), response_key)
 
 
     def get_profile(self, blocking=True) -> dict[str,Any]:
@@ -293,9 +499,9 @@ class PoEClient:
         return self._get("character", "character", name, blocking=blocking)
 
 
-    def list_stashes(self, league:str, flatten=True, blocking=True) -> list[dict[str,Any]]:
-        """list stash tabs in the given league"""
-        data = self._get("stash", "stashes", league, has_args=False, blocking=blocking)
+    def list_stashes(self, league:str, flatten=True, blocking=True, revalidate=False) -> list[dict[str,Any]]:
+        """list stash tabs in the given league. See _get for `revalidate`"""
+        data = self._get("stash", "stashes", league, has_args=False, blocking=blocking, revalidate=revalidate)
         if flatten:
             flattened = []
             for stashtab in data:
@@ -309,19 +515,131 @@ class PoEClient:
             return data
 
 
-    def get_stash(self, league:str, stash_id:str, substash_id:str|None=None, get_children=False, blocking=True) -> dict[str,Any]:
-        """get a stash tab"""
+    def get_stash(self, league:str, stash_id:str, substash_id:str|None=None, get_children=False, blocking=True, revalidate=False) -> dict[str,Any]:
+        """get a stash tab. See _get for `revalidate`"""
         if substash_id is not None and get_children:
             raise TypeError("get_children is not supported when specifying a substash_id")
 
         result = None
         if substash_id:
-            result = self._get("stash", "stash", league, stash_id, substash_id, blocking=blocking)
+            result = self._get("stash", "stash", league, stash_id, substash_id, blocking=blocking, revalidate=revalidate)
         else:
-            result = self._get("stash", "stash", league, stash_id, blocking=blocking)
+            result = self._get("stash", "stash", league, stash_id, blocking=blocking, revalidate=revalidate)
 
         if get_children and ("children" in result):
             for i,sub in enumerate(result["children"]):
-                result["children"][i] = self.get_stash(league, stash_id, sub["id"], blocking=blocking)
+                result["children"][i] = self.get_stash(league, stash_id, sub["id"], blocking=blocking, revalidate=revalidate)
 
         return result
+
+
+
+class AsyncPoEClient:
+    """an asyncio version of PoEClient, for making many requests at once. It uses the session and RateLimiter of a PoEClient, so the two can be used together
+
+    The requests are made in worker threads, at most `max_in_flight` at a time. A requests.Session isn't thread-safe, so each thread makes its own (with `session_factory`),
+    and sends the headers of the PoEClient's session with it. Reading and writing the ResponseCache is done in the worker threads too, so the files don't block the event loop.
+    Every request waits its turn in a RateLimitScheduler and reserves its place in the rate limits when it's sent, so requests still in flight count against the limits.
+    The first request to an endpoint is made on its own, since its limits aren't known until it returns.
+    """
+    _poe: PoEClient
+    _max_in_flight: asyncio.Semaphore
+    _discovery_locks: dict[tuple[str,bool],asyncio.Lock]
+    _scheduler: RateLimitScheduler
+    _session_factory: Callable[[],requests.Session]
+    _sessions: threading.local
+
+    def __init__(self, poe:PoEClient, max_in_flight:int=8, session_factory:Callable[[],requests.Session]=requests.Session) -> None:
+        self._poe = poe
+        self._max_in_flight = asyncio.Semaphore(max_in_flight)
+        self._discovery_locks = {}
+        self._scheduler = RateLimitScheduler(poe._ratelimiter)
+        self._session_factory = session_factory
+        self._sessions = threading.local()
+
+
+    async def _get(self, endpoint:str, response_key:str="", *args:str, has_args=None, revalidate=False) -> Any:
+        """make a get request. See PoEClient._get for `revalidate`"""
+        if has_args is None:
+            has_args = bool(args)
+
+        url = f"{ROOT}/{endpoint}"
+        if args:
+            url += "/" + "/".join(args)
+
+        cache = self._poe._cache_for(endpoint)
+        if cache is not None and not revalidate and (data := await asyncio.to_thread(cache.get, self._poe._cache_account, url)) is not None:
+            return _parse_response(data, 200, response_key)
+
+        ep = (endpoint, has_args)
+        ratelimiter = self._poe._ratelimiter
+        if ep not in ratelimiter.endpoint_policies:
+            async with self._discovery_locks.setdefault(ep, asyncio.Lock()):
+                if ep not in ratelimiter.endpoint_policies:
+                    r = await self._request(endpoint, has_args, url, cache)
+                    return await asyncio.to_thread(self._poe._read_response, url, r, response_key, cache)
+        r = await self._request(endpoint, has_args, url, cache)
+        return await asyncio.to_thread(self._poe._read_response, url, r, response_key, cache)
+
+
+    async def _request(self, endpoint:str, has_args:bool, url:str, cache:ResponseCache|None) -> requests.Response:
+        ratelimiter = self._poe._ratelimiter
+        async with self._max_in_flight:
+            for _ in range(2):  # might violate rate limit base on past session that we don't know about, so try again at most one time
+                reserved = await self._scheduler.acquire(endpoint, has_args)
+                r = await asyncio.to_thread(self._send, url, cache)
+                ratelimiter.update(endpoint, has_args, r.headers, reserved)
+                if r.status_code != 429:
+                    break
+                log.info(f"rate limit violated. time until ready: {ratelimiter.time_until_ready(endpoint, has_args):.2f}")
+        return r
+
+
+    def _send(self, url:str, cache:ResponseCache|None) -> requests.Response:
+        """send a get request with the session of the current worker thread"""
+        ses = getattr(self._sessions, "ses", None)
+        if ses is None:
+            ses = self._sessions.ses = self._session_factory()
+        ses.headers.update(self._poe._ses.headers)  # every time, in case the user agent changed
+        return ses.get(url, headers=cache.headers(self._poe._cache_account, url) if cache else None)
+
+
+    async def list_stashes(self, league:str, flatten=True, revalidate=False) -> list[dict[str,Any]]:
+        """list stash tabs in the given league. See PoEClient._get for `revalidate`"""
+        data = await self._get("stash", "stashes", league, has_args=False, revalidate=revalidate)
+        if flatten:
+            return [subtab for stashtab in data for subtab in stashtab.get("children", [stashtab])]
+        return data
+
+
+    async def get_stash(self, league:str, stash_id:str, substash_id:str|None=None, get_children=False, revalidate=False) -> dict[str,Any]:
+        """get a stash tab. With `get_children`, its children are all requested at once. See PoEClient._get for `revalidate`"""
+        if substash_id is not None and get_children:
+            raise TypeError("get_children is not supported when specifying a substash_id")
+
+        if substash_id:
+            result = await self._get("stash", "stash", league, stash_id, substash_id, revalidate=revalidate)
+        else:
+            result = await self._get("stash", "stash", league, stash_id, revalidate=revalidate)
+
+        if get_children and ("children" in result):
+            result["children"] = await asyncio.gather(*(self.get_stash(league, stash_id, sub["id"], revalidate=revalidate) for sub in result["children"]))
+
+        return result
+
+
+def _parse_response(data:Any, status_code:int, response_key:str) -> Any:
+    """get the data from an API response, or raise the error it contains"""
+    if status_code == 200 and "error" not in data:
+        if response_key:
+            return data[response_key]
+        else:
+            return data
+    else:
+        if "error" in data:
+            if not isinstance(data["error"], dict):
+                raise RuntimeError(data)
+            else:
+                raise PoEError(data["error"]["message"], status_code, data["error"]["code"])
+        else:
+            raise PoEError("unknown error", status_code, None)
@@ -1,22 +1,101 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import json
 import logging
+import concurrent.futures
 import attrs
 
 import lupa.lua51 as lupa  #type: ignore
 
 from typing import Any, Callable
-from collections.abc import Container
+from collections.abc import Container, Iterable
 from pprint import pprint as pp
 
-from consts import POB_DIR
+from consts import POB_DIR, POB_EXPORT_FNAME
 from models import PoBItem
+import pob_uniques
 import utils
 
 log = logging.getLogger(__name__)
 
+# reads the fields of every item in the uniqueDB that PoBItem uses, and returns them as a single json string of records in the form of models.lua_item_record.
+# reading them from Python instead crosses into Lua for every field of every mod, which is much slower.
+# only reads one shard of the items (see export_shard), along with their positions in the uniqueDB
+EXPORT_LUA = r"""
+function(uniqueDB, generated, shard, num_shards)
+    local concat, format, find, floor = table.concat, string.format, string.find, math.floor
+
+    local function value(v)
+        local t = type(v)
+        if v == nil then
+            return "null"
+        elseif t == "string" then
+            -- control characters are left as they are, for json.loads(strict=False). Plain finds are much faster than a pattern
+            if find(v, '"', 1, true) or find(v, "\\", 1, true) then
+                v = v:gsub('["\\]', "\\%0")
+            end
+            return '"' .. v .. '"'
+        elseif t == "number" then
+            return v == floor(v) and tostring(v) or format("%.17g", v)
+        elseif t == "boolean" then
+            return tostring(v)
+        end
+        error("can't export a " .. t)
+    end
+
+    local function list(t, keys)
+        if not t then
+            return "null"
+        end
+        local out, n = {}, 0
+        for k, v in pairs(t) do
+            n = n + 1
+            out[n] = value(keys and k or v)
+        end
+        return "[" .. concat(out, ",") .. "]"
+    end
+
+    local function mods(t)
+        local out, n = {}, 0
+        for _, mod in pairs(t) do
+            n = n + 1
+            out[n] = '{"line":' .. value(mod.line) .. ',"variantList":' .. list(mod.variantList, true) .. ',"crafted":' .. (mod.crafted == nil and "null" or value(mod.crafted)) .. "}"
+        end
+        return "[" .. concat(out, ",") .. "]"
+    end
+
+    local items, positions, skipped = {}, {}, {}
+    local position = -1
+    for _, item in pairs(uniqueDB) do
+        position = position + 1
+        if position % num_shards ~= shard then
+            -- another shard's item
+        elseif generated[item.title] then
+            skipped[#skipped+1] = "[" .. value(item.title) .. "," .. value(item.baseName) .. "]"
+        else
+            positions[#positions+1] = position
+            items[#items+1] = concat({
+                '{"title":', value(item.title),
+                ',"baseName":', value(item.baseName),
+                ',"type":', value(item.type),
+                ',"source":', value(item.source),
+                ',"league":', value(item.league),
+                ',"variantList":', list(item.variantList),
+                ',"variantAlts":[', concat({value(item.variantAlt), value(item.variantAlt2), value(item.variantAlt3), value(item.variantAlt4), value(item.variantAlt5)}, ","), "]",
+                ',"baseLines":', mods(item.baseLines),
+                ',"implicitModLines":', mods(item.implicitModLines),
+                ',"explicitModLines":', mods(item.explicitModLines),
+                ',"upgradePaths":', list(item.upgradePaths),
+                "}"
+            })
+        end
+    end
+    return '{"items":[' .. concat(items, ",") .. '],"positions":[' .. concat(positions, ",") .. '],"skipped":[' .. concat(skipped, ",") .. "]}"
+end
+"""
+
 try:
     from CompactJSONEncoder import CompactJSONEncoder
     class JE (CompactJSONEncoder):
@@ -30,7 +109,7 @@ try:
 
         def encode(self, o):
             if attrs.has(o):
-                return self._encode_object(attrs.asdict(o, filter=utils.asdict_filter, recurse=False))
+                return self._encode_object(attrs.asdict(o, filter=utils.asdict_filter, value_serializer=utils.asdict_value, recurse=False))
             return super().encode(o)
 except ImportError:
     class JE (json.JSONEncoder):  #type: ignore
@@ -38,13 +117,40 @@ except ImportError:
             if attrs.has(o):
                 # recursion in attrs means that the filter is only applied to the top-level attrs object.
                 # recurse=False lets json handle the recursion, which allows the filter to apply to member objects
-                return attrs.asdict(o, filter=utils.asdict_filter, recurse=False)
+                return attrs.asdict(o, filter=utils.asdict_filter, value_serializer=utils.asdict_value, recurse=False)
             return super().default(o)
 
 
 def main() -> None:
     logging.basicConfig(level=logging.DEBUG)
 
+    compact = "--compact" in sys.argv
+    if "--direct" in sys.argv:
+        # read the unique data files instead of starting PoB
+        save_export(pob_uniques.pob_export_direct(POB_DIR), POB_EXPORT_FNAME, compact=compact)
+        return
+
+    export_fname = os.path.abspath(POB_EXPORT_FNAME)
+    pob_dir = os.path.abspath(POB_DIR)
+    workers = next((int(arg.split("=", 1)[1]) for arg in sys.argv if arg.startswith("--workers=")), 1)
+
+    if workers > 1:
+        uniques = pob_export_sharded(workers)
+    else:
+        lua, uniqueDB, generated_names = load_pob()
+        if "--per-item" in sys.argv:
+            uniques = pob_export(uniqueDB, generated_names)
+        else:
+            uniques = pob_export_bulk(lua, uniqueDB, generated_names)
+
+    save_export(uniques, export_fname, compact=compact)
+
+    if "--compare" in sys.argv:
+        compare_exports(uniques, pob_uniques.pob_export_direct(pob_dir))
+
+
+def load_pob() -> tuple[lupa.LuaRuntime, Any, set[str]]:
+    """start PoB in a new Lua runtime, and get its uniqueDB and the names of its generated uniques. Changes the working directory to POB_DIR"""
     lua = lupa.LuaRuntime()
     os.chdir(POB_DIR)
 
@@ -82,10 +188,60 @@ def main() -> None:
         lines = item_text.split("\n")
         generated_names.add(lines[0])
 
-    uniques = pob_export(uniqueDB, generated_names)
-
-    with open("../../pob_export.json", "w") as f:
-        json.dump(uniques, f, cls=JE, indent=4)
+    return lua, uniqueDB, generated_names
+
+
+def save_export(uniques:list[PoBItem], fname:str, *, compact:bool=False) -> None:
+    """save the export json, along with its snapshot and manifest. See write_export for `compact`"""
+    write_export(uniques, fname, compact=compact)
+    utils.save_pob_snapshot(uniques, fname)
+
+    manifest = utils.save_pob_manifest(uniques, fname)
+    print(f"{len(manifest.added)} added, {len(manifest.removed)} removed, {len(manifest.modified)} modified")
+
+
+def write_export(uniques:list[PoBItem], fname:str, *, compact:bool=False) -> None:
+    """write the export json one item at a time, instead of encoding the whole list at once
+
+    The default is the same indented format as json.dump with JE, which is easy to diff between exports.
+    JE is given the items themselves, like json.dump did, since CompactJSONEncoder decides which lists go on one line from what's in them.
+    With `compact`, each item is written on one line with no extra whitespace, which is smaller and faster to write and load.
+    """
+    encoder = json.JSONEncoder(separators=(",", ":")) if compact else JE(indent=4)
+    with open(fname + ".tmp", "w") as f:
+        f.write("[")
+        for i, item in enumerate(uniques):
+            if compact:
+                text = encoder.encode(utils.export_dict(item))
+            else:
+                text = encoder.encode(item).replace("\n", "\n    ")  # one level deeper, inside the list
+            f.write(("\n" if i == 0 else ",\n") + ("" if compact else "    ") + text)
+        f.write("\n]" if uniques else "]")
+    os.replace(fname + ".tmp", fname)
+
+
+def compare_exports(uniques:list[PoBItem], direct:list[PoBItem]) -> bool:
+    """log the differences between an export from PoB and one from pob_uniques. Returns whether they're the same, in the same order"""
+    expected = {utils.pob_export_key(item): item for item in uniques}
+    actual = {utils.pob_export_key(item): item for item in direct}
+    for k in expected.keys() - actual.keys():
+        log.warning(f"missing from the direct export: {k}")
+    for k in actual.keys() - expected.keys():
+        log.warning(f"only in the direct export: {k}")
+    for k in expected.keys() & actual.keys():
+        if expected[k] != actual[k]:
+            log.warning(f"different in the direct export: {k}\n{expected[k]}\n{actual[k]}")
+
+    expected_order = [k for k in map(utils.pob_export_key, uniques) if k in actual]
+    actual_order = [k for k in map(utils.pob_export_key, direct) if k in expected]
+    for i, (e, a) in enumerate(zip(expected_order, actual_order)):
+        if e != a:
+            log.warning(f"out of order in the direct export at {i}: {a}, expected {e}")
+            break
+
+    same = [utils.export_dict(item) for item in uniques] == [utils.export_dict(item) for item in direct]
+    print(f"direct export {'matches' if same else 'differs'}: {len(direct)} items, {len(uniques)} expected")
+    return same
 
 
 def pob_export(uniqueDB:Any, generated_names:Container[str]) -> list[PoBItem]:
@@ -99,11 +255,48 @@ def pob_export(uniqueDB:Any, generated_names:Container[str]) -> list[PoBItem]:
 
         uniques.append(PoBItem.from_lua_item(item))
 
-    uniques.sort(key=lambda x:x.name)
+    uniques.sort(key=utils.pob_export_key)
 
     return uniques
 
 
+def pob_export_bulk(lua:lupa.LuaRuntime, uniqueDB:Any, generated_names:Iterable[str]) -> list[PoBItem]:
+    """the same as pob_export, but the uniqueDB is read by EXPORT_LUA in a single call"""
+    return merge_shards([export_shard(lua, uniqueDB, generated_names, 0, 1)])
+
+
+def pob_export_sharded(workers:int) -> list[PoBItem]:
+    """the same as pob_export_bulk, but split between worker processes that each start their own PoB and convert every `workers`th item of its uniqueDB"""
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return merge_shards(pool.map(_export_worker, range(workers), [workers] * workers))
+
+
+def _export_worker(shard:int, num_shards:int) -> list[tuple[int,PoBItem]]:
+    lua, uniqueDB, generated_names = load_pob()
+    return export_shard(lua, uniqueDB, generated_names, shard, num_shards)
+
+
+def export_shard(lua:lupa.LuaRuntime, uniqueDB:Any, generated_names:Iterable[str], shard:int, num_shards:int) -> list[tuple[int,PoBItem]]:
+    """convert the items at positions `shard`, `shard + num_shards`, `shard + 2*num_shards`... of the uniqueDB (in the order Lua iterates it), along with their positions
+
+    The order only depends on how the uniqueDB was built, since Lua 5.1 doesn't randomize its hashes, so every runtime that starts PoB sees the same positions.
+    """
+    export = lua.eval(EXPORT_LUA)
+    data = json.loads(export(uniqueDB, lua.table_from({name: True for name in generated_names}), shard, num_shards), strict=False)
+
+    for title, base_name in data["skipped"]:
+        log.info(f"generated skipped: {title}, {base_name}")
+
+    return [(position, PoBItem.from_lua_record(record)) for position, record in zip(data["positions"], data["items"])]
+
+
+def merge_shards(shards:Iterable[list[tuple[int,PoBItem]]]) -> list[PoBItem]:
+    """merge the items from export_shard into the same order as pob_export (see utils.pob_export_key)"""
+    merged = [positioned for shard in shards for positioned in shard]
+    merged.sort(key=lambda x:(utils.pob_export_key(x[1]), x[0]))
+    return [item for _, item in merged]
+
+
 def l(x) -> int|None:
     try:
         return len(x)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import os
+import re
+import glob
+import logging
+from typing import Any
+
+from models import LuaRecord, PoBItem
+import utils
+
+log = logging.getLogger(__name__)
+
+# tokens of a Lua file that can contain "[[", so the item texts can be picked out of the rest
+LUA_TOKEN_PATTERN = re.compile(r'--\[(=*)\[.*?\]\1\]|--[^\n]*|\[(=*)\[(.*?)\]\2\]|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+ITEM_BASE_PATTERN = re.compile(r'^itemBases\["((?:\\.|[^"\\])*)"\] = \{(.*?)^\}', re.DOTALL | re.MULTILINE)
+ITEM_BASE_TYPE_PATTERN = re.compile(r'^\s*type = "((?:\\.|[^"\\])*)",', re.MULTILINE)
+SPEC_PATTERN = re.compile(r"([A-Za-z ]+): (.+)")  # Lua: ^([%a ]+): (.+)$
+VARIANT_SPEC_PATTERN = re.compile(r"\{variant:([\d,]+)\}")
+BRACES_PATTERN = re.compile(r"\{[^{}]*\}")  # Lua: %b{}, which is the same for the unnested braces used in the unique files
+HAS_ALT_VARIANT_SPECS = ("Has Alt Variant", "Has Alt Variant Two", "Has Alt Variant Three", "Has Alt Variant Four", "Has Alt Variant Five")
+# the files in Data/Uniques/Special that hold item texts, like the ones in Data/Uniques. The others hold mods (WatchersEye) or generate uniques from them (Generated), which pob_export skips
+SPECIAL_UNIQUE_FILES = ("race.lua", "New.lua")
+
+
+def load_unique_records(pob_dir:str) -> list[LuaRecord]:
+    """parse the unique items in the Data/Uniques files of a PoB source directory (like consts.POB_DIR), without starting PoB
+
+    The files return lists of item texts (see parse_unique), which are parsed into the same records as models.lua_item_record.
+
+    Like PoB's uniqueDB, items with an unknown base type are left out, and if the same name and base type are in several files, the one from the last file (by name) is used.
+    Of Data/Uniques/Special, only SPECIAL_UNIQUE_FILES are read, so the generated uniques (which pob_export skips) aren't included.
+    """
+    item_bases = load_item_bases(pob_dir)
+    fnames = glob.glob(os.path.join(pob_dir, "Data", "Uniques", "*.lua"))
+    fnames += [fname for fname in (os.path.join(pob_dir, "Data", "Uniques", "Special", special) for special in SPECIAL_UNIQUE_FILES) if os.path.exists(fname)]
+
+    records:dict[tuple[str,str],LuaRecord] = {}
+    for fname in sorted(fnames, key=lambda fname: os.path.basename(fname).lower()):
+        with open(fname, encoding="utf-8") as f:
+            source = f.read()
+        for text in lua_long_strings(source):
+            record = parse_unique(text, item_bases)
+            if record is None:
+                continue
+            records[(record["title"], re.sub(r" \(.+\)", "", record["baseName"]))] = record
+
+    return list(records.values())
+
+
+def load_item_bases(pob_dir:str) -> dict[str,str]:
+    """get the type (like "Ring" or "Body Armour") of each base type in the Data/Bases files of a PoB source directory"""
+    item_bases:dict[str,str] = {}
+    for fname in sorted(glob.glob(os.path.join(pob_dir, "Data", "Bases", "*.lua"))):
+        with open(fname, encoding="utf-8") as f:
+            source = f.read()
+        for match in ITEM_BASE_PATTERN.finditer(source):
+            type_match = ITEM_BASE_TYPE_PATTERN.search(match[2])
+            if type_match:
+                item_bases[match[1]] = type_match[1]
+    return item_bases
+
+
+def lua_long_strings(source:str) -> list[str]:
+    """get the [[long strings]] in Lua source, skipping ones that are commented out"""
+    return [match[3] for match in LUA_TOKEN_PATTERN.finditer(source) if match[3] is not None]
+
+
+def parse_unique(text:str, item_bases:dict[str,str]) -> LuaRecord|None:
+    """parse the text of a unique item into a record in the form of models.lua_item_record. Returns None if its base type isn't in `item_bases`
+
+    This follows PoB's Item:ParseRaw for the parts that PoBItem uses: the name, the base type, then "Key: value" lines and mod lines.
+    Mod lines can be prefixed with {variant:1,2}, {crafted}, {tags:...} etc, and the first "Implicits: n" of them are implicits.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    if len(lines) < 2:
+        log.info(f"not an item: {text!r}")
+        return None
+
+    title = lines[0]
+    base_name = BRACES_PATTERN.sub("", lines[1])
+    if base_name not in item_bases:
+        log.info(f"unknown base skipped: {title}, {base_name}")
+        return None
+
+    record:dict[str,Any] = {
+        "title": title,
+        "baseName": base_name,
+        "type": item_bases[base_name],
+        "source": None,
+        "league": None,
+        "variantList": None,
+        "variantAlts": [None] * len(HAS_ALT_VARIANT_SPECS),
+        "baseLines": [],
+        "implicitModLines": [],
+        "explicitModLines": [],
+        "upgradePaths": None,
+    }
+    has_alt_variant = [False] * len(HAS_ALT_VARIANT_SPECS)
+    num_implicits = 0
+
+    for line in lines[1:]:
+        spec = SPEC_PATTERN.fullmatch(line)
+        if spec:
+            name, value = spec[1], spec[2]
+            if name == "Variant":
+                record["variantList"] = record["variantList"] or []
+                old_style = re.search(r"\{(\w+)\}(.+)", value)  # kept in PoB for backwards compatibility
+                record["variantList"].append(old_style[2] if old_style else value)
+            elif name in HAS_ALT_VARIANT_SPECS:
+                has_alt_variant[HAS_ALT_VARIANT_SPECS.index(name)] = True
+            elif name == "League":
+                record["league"] = value
+            elif name == "Source":
+                record["source"] = value
+            elif name == "Upgrade":
+                record["upgradePaths"] = (record["upgradePaths"] or []) + [value]
+            elif name == "Implicits":
+                num_implicits = int(value)
+            continue
+
+        variant_spec = VARIANT_SPEC_PATTERN.search(line)
+        mod = {
+            "line": BRACES_PATTERN.sub("", line).strip(),
+            "variantList": sorted({int(x) for x in variant_spec[1].split(",") if x}) if variant_spec else None,
+            "crafted": "{crafted}" if "{crafted}" in line else None,
+        }
+        if mod["line"] in item_bases:
+            record["baseLines"].append(mod)
+        elif num_implicits > 0:
+            record["implicitModLines"].append(mod)
+            num_implicits -= 1
+        else:
+            record["explicitModLines"].append(mod)
+
+    # PoB selects the last variant for each alt variant slot the item has
+    if record["variantList"]:
+        record["variantAlts"] = [len(record["variantList"]) if has else None for has in has_alt_variant]
+
+    return record
+
+
+def pob_export_direct(pob_dir:str) -> list[PoBItem]:
+    """the same as pob_export.pob_export, but from PoB's data files instead of a running PoB"""
+    uniques = [PoBItem.from_lua_record(record) for record in load_unique_records(pob_dir)]
+    uniques.sort(key=utils.pob_export_key)
+    return uniques
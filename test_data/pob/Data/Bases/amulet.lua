@@ -0,0 +1,18 @@
+-- This file is automatically generated, do not edit!
+-- Item data (c) Grinding Gear Games
+local itemBases = ...
+
+itemBases["Gold Amulet"] = {
+	type = "Amulet",
+	tags = { amulet = true, default = true, },
+	implicit = "(12-20)% increased Rarity of Items found",
+	implicitModTypes = { { "drop" }, },
+	req = { level = 8, },
+}
+itemBases["Jade Amulet"] = {
+	type = "Amulet",
+	tags = { amulet = true, default = true, },
+	implicit = "+(20-30) to Dexterity",
+	implicitModTypes = { { "attribute" }, },
+	req = { level = 5, },
+}
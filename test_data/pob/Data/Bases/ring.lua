@@ -0,0 +1,25 @@
+-- This file is automatically generated, do not edit!
+-- Item data (c) Grinding Gear Games
+local itemBases = ...
+
+itemBases["Iron Ring"] = {
+	type = "Ring",
+	tags = { ring = true, default = true, },
+	implicit = "Adds 1 to 4 Physical Damage to Attacks",
+	implicitModTypes = { { "damage", "physical", "attack" }, },
+	req = { },
+}
+itemBases["Gold Ring"] = {
+	type = "Ring",
+	tags = { ring = true, default = true, },
+	implicit = "(6-15)% increased Rarity of Items found",
+	implicitModTypes = { { "drop" }, },
+	req = { level = 20, },
+}
+itemBases["Two-Stone Ring (Fire/Cold)"] = {
+	type = "Ring",
+	tags = { ring = true, default = true, },
+	implicit = "+(12-16)% to Fire and Cold Resistances",
+	implicitModTypes = { { "elemental", "fire", "cold", "resistance" }, },
+	req = { level = 20, },
+}
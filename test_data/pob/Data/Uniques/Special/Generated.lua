@@ -0,0 +1,9 @@
+-- Item data (c) Grinding Gear Games
+
+data.uniques.generated = { }
+
+table.insert(data.uniques.generated, [[
+Generated Ring
+Iron Ring
++10 to Intelligence
+]])
@@ -0,0 +1,11 @@
+-- Item data (c) Grinding Gear Games
+
+return {
+-- Race rewards
+[[
+Elemental Ring
+Gold Ring
+Source: Race reward
++(10-20)% to Lightning Resistance
+]],
+}
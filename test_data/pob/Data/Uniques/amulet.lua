@@ -0,0 +1,32 @@
+-- Item data (c) Grinding Gear Games
+
+return {
+-- Amulet
+[[
+Test Amulet
+{variant:1}Gold Amulet
+{variant:2,3}Jade Amulet
+League: Test
+Variant: A
+Variant: B
+Variant: C
+Has Alt Variant: true
+Has Alt Variant Two: true
+Implicits: 1
+{tags:drop}(12-20)% increased Rarity of Items found
+Adds (1-2) to (3-4) Fire Damage to Attacks
+This item can be anointed by Cassia
+Upgrade: Upgrades somehow
+]],
+--[[
+Removed Amulet
+Gold Amulet
++10 to Strength
+]]
+[[
+Test Ring
+Iron Ring
+Source: Overridden by the ring file
++1 to Strength
+]],
+}
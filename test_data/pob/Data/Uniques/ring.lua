@@ -0,0 +1,30 @@
+-- Item data (c) Grinding Gear Games
+
+return {
+-- Ring
+[[
+Test Ring
+Iron Ring
+Variant: {3_0}Pre 3.0.0
+Variant: Current
+Source: Drops anywhere
+Upgrade: Upgrades to unique{Better Ring} using currency{Orb of Testing}
+Implicits: 1
+Adds 1 to 4 Physical Damage to Attacks
+LevelReq: 20
+{variant:2}LevelReq: 30
+{variant:1}(10-20)% increased Attack Speed
+{variant:2}{tags:speed}(15-25)% increased Attack Speed
+{crafted}Has 1 Socket
+]],[[
+Unknown Ring
+Unset Ring
++10 to Dexterity
+]],[[
+Elemental Ring
+Two-Stone Ring (Fire/Cold)
+Implicits: 1
+{tags:elemental}+(12-16)% to Fire and Cold Resistances
+{variant:1,2}+(20-30)% to Cold Resistance
+]],
+}
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import os
+import copy
+import json
+import asyncio
+import importlib.util
+from typing import Any
+
+import pytest
+
+spec = importlib.util.spec_from_file_location("find_uniques", "find-uniques.py")
+assert spec is not None and spec.loader is not None
+find_uniques = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(find_uniques)
+
+LEAGUE = "Standard"
+
+
+class FakeClient:
+    """serves a stash list and its tabs like AsyncPoEClient, and records the tabs that were requested"""
+    def __init__(self, tabs:list[dict[str,Any]]) -> None:
+        self.tabs = tabs
+        self.requested:list[str] = []
+        self.revalidated:list[bool] = []
+
+    async def list_stashes(self, league:str, flatten=True, revalidate=False) -> list[dict[str,Any]]:
+        self.revalidated.append(revalidate)
+        return [{k: v for k, v in tab.items() if k != "items"} for tab in self.tabs]
+
+    async def get_stash(self, league:str, stash_id:str, substash_id:str|None=None, get_children=False, revalidate=False) -> dict[str,Any]:
+        self.requested.append(stash_id)
+        self.revalidated.append(revalidate)
+        return copy.deepcopy(next(tab for tab in self.tabs if tab["id"] == stash_id))
+
+
+def make_tab(stash_id:str, name:str, index:int, items:list[str]) -> dict[str,Any]:
+    return {"id": stash_id, "name": name, "type": "PremiumStash", "index": index, "items": [{"name": item} for item in items]}
+
+
+def download(client:FakeClient, folder:str, **kwargs) -> list[dict[str,Any]]:
+    """download incrementally, and return the tabs in {league}_all.json"""
+    asyncio.run(find_uniques.download_all_async(client, LEAGUE, folder, **{"incremental": True, **kwargs}))
+    with open(f"{folder}/{LEAGUE}_all.json") as f:
+        return json.load(f)
+
+
+def test_download_all_incremental(monkeypatch, tmp_path) -> None:
+    folder = str(tmp_path)
+    saved:list[str] = []
+    real_save = find_uniques.save
+    def save(data:Any, fname:str) -> None:
+        saved.append(os.path.basename(fname))
+        real_save(data, fname)
+    monkeypatch.setattr(find_uniques, "save", save)
+
+    client = FakeClient([make_tab("a", "A", 0, ["one"]), make_tab("b", "B", 1, ["two"]), make_tab("c", "C", 2, ["three"])])
+    assert [tab["name"] for tab in download(client, folder)] == ["A", "B", "C"]
+    assert client.requested == ["a", "b", "c"]
+
+    # every tab is revalidated, but the files of unchanged tabs aren't written again
+    client.requested = []
+    saved.clear()
+    assert download(client, folder) == client.tabs
+    assert client.requested == ["a", "b", "c"]
+    assert saved == ["stash_list.json", f"{LEAGUE}_all.json", f"{LEAGUE}_sync.json"]
+
+    # new tabs, renamed tabs and tabs whose items changed are saved, even though the stash list doesn't show the change to the items
+    client.requested = []
+    saved.clear()
+    client.tabs = [make_tab("b", "B2", 1, ["two"]), make_tab("c", "C", 2, ["four"]), make_tab("d", "D", 3, ["five"])]
+    tabs = download(client, folder)
+    assert client.requested == ["b", "c", "d"]
+    assert saved[:3] == ["1_B2_PremiumStash.json", "2_C_PremiumStash.json", "3_D_PremiumStash.json"]
+    assert [(tab["name"], tab["items"][0]["name"]) for tab in tabs] == [("B2", "two"), ("C", "four"), ("D", "five")]
+
+    # the files of the removed tab and the renamed tab are deleted
+    assert sorted(os.listdir(tmp_path / LEAGUE)) == ["1_B2_PremiumStash.json", "2_C_PremiumStash.json", "3_D_PremiumStash.json", "stash_list.json"]
+
+    # the list and the tabs are never taken from a fresh cached response
+    assert all(client.revalidated)
+
+
+def test_download_all_start_index(tmp_path) -> None:
+    folder = str(tmp_path)
+    client = FakeClient([make_tab("a", "A", 0, ["one"]), make_tab("b", "B", 1, ["two"]), make_tab("c", "C", 2, ["three"])])
+    download(client, folder, incremental=False)
+
+    # the tabs before start_index are still in {league}_all.json, from their files
+    client.requested = []
+    client.tabs[0]["items"] = [{"name": "changed"}]
+    tabs = download(client, folder, incremental=False, start_index=2)
+    assert client.requested == ["c"]
+    assert [(tab["name"], tab["items"][0]["name"]) for tab in tabs] == [("A", "one"), ("B", "two"), ("C", "three")]
+
+
+def test_download_all_atomic(monkeypatch, tmp_path) -> None:
+    folder = str(tmp_path)
+    replaced:list[tuple[str,str]] = []
+    interrupt = [False]
+    real_replace = os.replace
+    def replace(src:str, dst:str) -> None:
+        if interrupt[0] and dst.endswith("_all.json"):
+            raise KeyboardInterrupt
+        replaced.append((src, dst))
+        real_replace(src, dst)
+    monkeypatch.setattr(os, "replace", replace)
+
+    client = FakeClient([make_tab("a", "A", 0, ["one"])])
+    download(client, folder)
+    for fname in (f"{folder}/{LEAGUE}_all.json", f"{folder}/{LEAGUE}_sync.json"):
+        assert (fname + ".tmp", fname) in replaced  # written to a temporary file, then moved into place
+    with open(f"{folder}/{LEAGUE}_sync.json") as f:
+        synced = f.read()
+
+    # a download that's interrupted while saving leaves {league}_all.json and {league}_sync.json as they were
+    replaced.clear()
+    interrupt[0] = True
+    client.tabs = [make_tab("a", "A2", 0, ["two"])]
+    with pytest.raises(KeyboardInterrupt):
+        download(client, folder)
+
+    assert (f"{folder}/{LEAGUE}/0_A2_PremiumStash.json.tmp", f"{folder}/{LEAGUE}/0_A2_PremiumStash.json") in replaced
+    assert not any(dst.endswith("_sync.json") for _, dst in replaced)
+    with open(f"{folder}/{LEAGUE}_sync.json") as f:
+        assert f.read() == synced
+    with open(f"{folder}/{LEAGUE}_all.json") as f:
+        assert json.load(f)[0]["name"] == "A"
+
+    interrupt[0] = False
+    assert download(client, folder)[0]["name"] == "A2"
+    assert not [fname for fname in os.listdir(folder) if fname.endswith(".tmp")]
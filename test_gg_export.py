@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+
+import gg_export
+import utils
+from models import GGItem
+
+TABLES_DIR = "test_data/gg_tables"
+
+
+def test_build_gg_export() -> None:
+    assert gg_export.build_gg_export(TABLES_DIR) == [
+        GGItem(0, "Test Ring", "Test%20Ring0", "Rings", False, False, False, "Test Ring"),
+        GGItem(1, "Replica Test Ring", "Test%20Ring1", "Amulets", True, False, False, "Test Ring/Replica Test Ring"),
+        GGItem(2, "Test Ring", "Test%20Ring2", "Rings", False, True, True, "Test Ring?Test%20Ring2"),
+    ]
+
+
+def test_update_gg_export(tmp_path) -> None:
+    tables_dir = str(tmp_path / "tables")
+    shutil.copytree(TABLES_DIR, tables_dir)
+    export_fname = str(tmp_path / "gg_export.json")
+    cache_dir = str(tmp_path / "cache")
+
+    def update() -> bool:
+        return gg_export.update_gg_export(tables_dir=tables_dir, export_fname=export_fname, cache_dir=cache_dir)
+
+    assert update()
+    assert utils.load_gg_export(export_fname) == gg_export.build_gg_export(TABLES_DIR)
+    assert not update()  # nothing changed
+
+    os.utime(os.path.join(tables_dir, "Words.json"), ns=(0, 0))
+    assert update()
+    assert not update()
+
+    os.remove(export_fname)
+    assert update()
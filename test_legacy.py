@@ -2,10 +2,14 @@
 
 import pytest
 import json
+import copy
+import concurrent.futures
 from typing import Any
 
 from legacy import *
+from models import BaseTypeVariant, LazyItems
 import utils
+import timing
 
 
 @pytest.fixture
@@ -16,7 +20,7 @@ def test_items() -> dict[str,Any]:
 
 
 @pytest.fixture
-def pob_db() -> list[PoBItem]:
+def pob_db() -> PoBDB:
     pob_db_ = utils.load_pob_db(POB_EXPORT_FNAME)
     return pob_db_
 
@@ -54,8 +58,270 @@ def pob_db() -> list[PoBItem]:
     (29, "Tremor Rod",               [('Pre 3.8.0', 1)]),
     (30, "Combat Focus",             [('Only', 0)])
 ))
-def test_get_variant(test_items:list[dict[str,Any]], pob_db:list[PoBItem], test_index:int, name:str, expected:list[tuple[str,int]]) -> None:
+def test_get_variant(test_items:list[dict[str,Any]], pob_db:PoBDB, test_index:int, name:str, expected:list[tuple[str,int]]) -> None:
     test_item = test_items[test_index]
     variant = get_variant(test_item, pob_db)
     assert test_item["name"] == name
     assert variant.backwards_compatible() == expected
+    assert get_variant(test_item, pob_db, best_only=True).backwards_compatible() == expected
+
+
+def test_find_pob_unique() -> None:
+    single = PoBItem("Combat Focus", "Cobalt Jewel", [], "Jewel", "", "", None, ["Only"], [], [])
+    single2 = PoBItem("Combat Focus", "Viridian Jewel", [], "Jewel", "", "", None, ["Only"], [], [])
+    multi = PoBItem("Atziri's Splendour", None, [BaseTypeVariant("Sacrificial Garb", [0, 1])], "Body Armour", "", "", None, ["A", "B"], [], [])
+    pob_db = PoBDB(sorted([single, single2, multi], key=lambda x:x.name))
+
+    assert find_pob_unique(pob_db, "Combat Focus", "Cobalt Jewel") is single
+    assert find_pob_unique(pob_db, "Combat Focus", "Viridian Jewel") is single2
+    assert find_pob_unique(pob_db, "Atziri's Splendour", "Sacrificial Garb") is multi
+    assert find_pob_unique(pob_db, "Combat Focus", "Crimson Jewel") is None
+    assert find_pob_unique(pob_db, "Zzz", "Cobalt Jewel") is None  # would have gone past the end of the list
+
+
+@pytest.fixture
+def ring_db() -> PoBDB:
+    def mod(line:str, variants:list[int]) -> GenericMod:
+        generic = GenericMod.genericize_mod(line)
+        generic.variants = variants
+        return generic
+
+    explicits = [
+        mod("+(20-30) to Strength", [0, 1, 2]),
+        mod("(10-20)% increased Attack Speed", [0]),
+        mod("(15-25)% increased Attack Speed", [1]),
+        mod("(10-20)% increased Cast Speed", [2]),
+    ]
+    return PoBDB([PoBItem("Test Ring", "Iron Ring", [], "Ring", "", "", None, ["A", "B", "C"], [], explicits)])
+
+
+def api_item(*mods:str) -> APIItem:
+    return {"name": "Test Ring", "baseType": "Iron Ring", "ilvl": 1, "explicitMods": list(mods)}
+
+
+def test_get_variant_exact_match(ring_db:PoBDB) -> None:
+    pob_db = ring_db
+
+    # inside the ranges of A only, and of both A and B
+    assert get_variant(api_item("12% increased Attack Speed", "+25 to Strength"), pob_db).backwards_compatible() == [("A", 0)]
+    assert get_variant(api_item("+25 to Strength", "17% increased Attack Speed"), pob_db).backwards_compatible() == [("A", 0), ("B", 1)]
+
+    # the exact matches are reported the same as by fuzzy matching every variant
+    for item in (api_item("12% increased Attack Speed", "+25 to Strength"), api_item("+25 to Strength", "17% increased Attack Speed")):
+        assert str(get_variant(item, pob_db, best_only=True)) == str(get_variant(item, pob_db).top(0))
+    assert len(get_variant(api_item("12% increased Attack Speed", "+25 to Strength"), pob_db)) == 1  # the other variants aren't scored
+    report = get_variant(api_item("12% increased Attack Speed", "+25 to Strength"), pob_db, report=True)
+    assert len(report) == 3  # every variant, with its scores
+    assert str(report.top(0)) == str(get_variant(api_item("12% increased Attack Speed", "+25 to Strength"), pob_db))
+
+    # not an exact match, so it falls back to fuzzy matching
+    fuzzy = get_variant(api_item("+25 to Strength", "30% increased Attack Speed"), pob_db)
+    assert fuzzy.backwards_compatible() == []
+    assert len(fuzzy) == 3
+
+    # A is the best fuzzy match. B is out of range and C scores lower, so they're abandoned once A has been scored
+    best = get_variant(api_item("+25 to Strength", "12% increased Attack Spd"), pob_db, best_only=True)
+    full = get_variant(api_item("+25 to Strength", "12% increased Attack Spd"), pob_db)
+    assert [m.variant_name for m in best.match_list] == ["A"]
+    assert [(m.variant_name, m.minumim_score) for m in best.match_list] == [(m.variant_name, m.minumim_score) for m in full.top(0).match_list]
+    assert best.best_score() == full.best_score()
+
+    # B and A are both inside the ranges, and A was scored with the scores below B's cut off
+    best = get_variant(api_item("+25 to Strength", "17% increased Attack Spd"), pob_db, best_only=True)
+    assert [m.variant_name for m in best.match_list] == ["A", "B"]
+    assert str(best) == str(get_variant(api_item("+25 to Strength", "17% increased Attack Spd"), pob_db).top(0))
+
+
+def test_get_variants(monkeypatch, ring_db:PoBDB) -> None:
+    monkeypatch.setattr("legacy.MIN_ITEMS_PER_WORKER", 1)
+    api_items = [
+        api_item("12% increased Attack Speed", "+25 to Strength"),
+        {"name": "Unknown Ring", "baseType": "Iron Ring", "ilvl": 1, "explicitMods": []},
+        api_item("+25 to Strength", "17% increased Attack Speed"),
+        api_item("+25 to Strength", "12% increased Cast Speed"),
+        api_item("+25 to Strength", "30% increased Attack Speed"),
+    ]
+    expected = [[("A", 0)], [], [("A", 0), ("B", 1)], [("C", 2)], []]
+
+    assert [v.backwards_compatible() for v in get_variants(api_items, ring_db)] == expected
+    assert [v.backwards_compatible() for v in get_variants(api_items, ring_db, workers=2)] == expected
+
+    pools = []
+    with Matcher(ring_db, workers=2) as matcher:
+        assert [v.backwards_compatible() for v in matcher.match_many(api_items)] == expected
+        pools.append(matcher._pool)
+        assert [v.backwards_compatible() for v in matcher.match_many(api_items[::-1])] == expected[::-1]
+        pools.append(matcher._pool)
+    assert pools[0] is not None and pools[1] is pools[0]  # the workers are kept between batches
+    assert matcher._pool is None
+
+    monkeypatch.setattr("legacy.MIN_ITEMS_PER_WORKER", 2)
+    with Matcher(ring_db, workers=8) as matcher:
+        assert [v.backwards_compatible() for v in matcher.match_many(api_items)] == expected
+        assert matcher._pool_workers == 2  # only as many workers as the items keep busy
+
+    monkeypatch.setattr("legacy.MIN_ITEMS_PER_WORKER", 50)
+    with Matcher(ring_db, workers=2) as matcher:
+        assert [v.backwards_compatible() for v in matcher.match_many(api_items)] == expected
+        assert matcher._pool is None  # too few items to start the workers
+
+
+def test_matcher(ring_db:PoBDB) -> None:
+    api_items = [
+        api_item("12% increased Attack Speed", "+25 to Strength"),
+        api_item("+25 to Strength", "12% increased Attack Spd"),
+        {"name": "Test Ring", "baseType": "Iron Ring", "ilvl": 1},  # no modlists
+        {"name": "Test Ring", "baseType": "Iron Ring", "ilvl": 1, "explicitMods": ["+25 to Strength\nPassives in radius are Conquered by the Maraketh"]},
+    ]
+    originals = copy.deepcopy(api_items)
+    matcher = Matcher(ring_db, best_only=True)
+
+    trace = MatchTrace()
+    assert matcher.match(api_items[1], trace).backwards_compatible() == []
+    assert [e.kind for e in trace.events if e.variant == "A"] == ["variant", "matrix", "pairs", "matrix", "pairs", "scores"]
+    assert [e.data for e in trace.events if e.kind == "basic_mismatch"] == []
+    assert "12% increased Attack Spd" not in trace.dump()  # pairs are recorded as generic lines
+    assert "#% increased Attack Spd" in trace.dump()
+
+    trace = MatchTrace()
+    matcher.match(api_items[2], trace)
+    assert {e.data["field"] for e in trace.events if e.kind == "basic_mismatch"} == {"explicits"}
+
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(matcher.match, api_items * 25))
+    assert [r.backwards_compatible() for r in results] == [[("A", 0)], [], [], []] * 25
+    assert api_items == originals
+
+
+def test_timing(ring_db:PoBDB) -> None:
+    items = [api_item("12% increased Attack Speed", "+25 to Strength"), api_item("+25 to Strength", "12% increased Attack Spd")]
+    timing.reset()
+    try:
+        get_variant(items[0], ring_db)
+        assert timing.stats()["stages"] == {}  # off by default
+
+        timing.enable()
+        for item in items * 2:
+            get_variant(item, ring_db)
+        for item in items * 2:
+            get_variant(item, ring_db, best_only=True)
+        stats = timing.stats()
+    finally:
+        timing.enable(False)
+        timing.reset()
+
+    assert stats["stages"]["match_item"].calls == 8
+    assert stats["stages"]["pair_mods"].calls == 2 * (1 + 3) + 2 + 2  # only A for the exact match, and every variant of the fuzzy one without best_only, then only A for each with it
+    assert stats["stages"]["match_item"].p50 <= stats["stages"]["match_item"].p99
+    assert "make_variants" not in stats["stages"]  # the variants were made before timing was enabled
+    assert stats["caches"]["variant_set"].hit_rate == 1
+    assert (stats["caches"]["exact_match"].hits, stats["caches"]["exact_match"].misses) == (4, 4)  # tried with and without best_only
+    assert "genericize_line" in stats["caches"]
+
+
+def test_timing_workers(monkeypatch, ring_db:PoBDB) -> None:
+    monkeypatch.setattr("legacy.MIN_ITEMS_PER_WORKER", 1)
+    items = [api_item("12% increased Attack Speed", "+25 to Strength"), api_item("+25 to Strength", "12% increased Attack Spd")] * 4
+    timing.reset()
+    timing.enable()
+    try:
+        def count(_:int) -> None:
+            for _ in range(1000):
+                timing.count("test")
+
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            list(pool.map(count, range(8)))
+
+        with Matcher(ring_db, workers=2) as matcher:
+            matcher.match_many(items)
+        stats = timing.stats()
+    finally:
+        timing.enable(False)
+        timing.reset()
+
+    assert stats["counters"]["test"] == 8000
+    assert stats["stages"]["match_item"].calls == len(items)  # recorded by the workers
+    assert stats["caches"]["variant_set"].hits + stats["caches"]["variant_set"].misses == len(items)
+
+
+def test_lazy_pob_db(monkeypatch, tmp_path, ring_db:PoBDB) -> None:
+    monkeypatch.setattr("legacy.MIN_ITEMS_PER_WORKER", 1)
+    records = [
+        {"name": "Other Ring", "basetypes": [{"basetype": "Gold Ring", "variants": [0]}, {"basetype": "Iron Ring", "variants": [1]}], "itemclass": "Ring", "source": "", "league": "",
+            "variants": ["A", "B"], "implicits": [], "explicits": [{"line": "+# to Dexterity", "ranges": [[10, 20]]}]},
+        {"name": "Test Ring", "basetype": "Iron Ring", "itemclass": "Ring", "source": "", "league": "", "variants": ["A", "B", "C"], "implicits": [],
+            "explicits": [{"line": m.line, "ranges": [list(map(float, r)) for r in m.ranges], "variants": m.variants} for m in ring_db[0].explicits]},
+    ]
+    fname = tmp_path / "pob_export.json"
+    fname.write_text(json.dumps(records))
+    items = [api_item("12% increased Attack Speed", "+25 to Strength"), api_item("+25 to Strength", "12% increased Attack Spd")]
+    expected = [v.backwards_compatible() for v in get_variants(items, ring_db)]
+
+    for snapshot in (False, True):
+        if snapshot:
+            utils.save_pob_snapshot(list(utils.load_pob_db(fname, use_snapshot=False)), fname)
+        pob_db = utils.load_pob_db(fname, lazy=True)
+        lazy_items = pob_db.items
+        assert isinstance(lazy_items, LazyItems)
+        assert lazy_items.num_built() == 0
+
+        assert find_pob_unique(pob_db, "Other Ring", "Iron Ring") is pob_db[0]
+        assert lazy_items.num_built() == 1
+        assert [v.backwards_compatible() for v in get_variants(items, pob_db)] == expected
+        assert [v.backwards_compatible() for v in get_variants(items, pob_db, workers=2)] == expected
+        assert pob_db[1] == ring_db[0]
+
+        pob_db.warm_up()
+        assert lazy_items.num_built() == 2
+        assert pob_db.pack_item(pob_db[0])[1].low.tolist() == [[10]]
+        pob_db.pack_item(pob_db[1])
+        assert len(pob_db.mod_store) == sum(len(item.implicits) + len(item.explicits) for item in lazy_items)  # one store for all of the items
+        copied_items = copy.deepcopy(pob_db).items
+        assert isinstance(copied_items, LazyItems) and copied_items.num_built() == 2
+
+
+def test_match_cache(monkeypatch, tmp_path, ring_db:PoBDB) -> None:
+    items = [api_item("12% increased Attack Speed", "+25 to Strength"), api_item("+25 to Strength", "12% increased Cast Speed"), api_item("+25 to Strength")]
+    manifest = utils.save_pob_manifest(list(ring_db), tmp_path / "pob_export.json")
+    fname = tmp_path / "match_cache.json"
+    expected = [v.backwards_compatible() for v in get_variants(items, ring_db)]
+
+    cache = MatchCache(fname, manifest)
+    assert [v.backwards_compatible() for v in get_variants(items, ring_db, cache=cache)] == expected
+    cache.save()
+    def fields(result:VariantMatchList) -> list[tuple]:
+        return [(m.variant_name, m.minumim_score, m.average_score, m.aggregate_score, m.scores, m.implicit_matrix.tolist(), m.explicit_matrix.tolist()) for m in result.match_list]
+    assert [fields(v) for v in get_variants(items, ring_db, cache=MatchCache(fname, manifest))] == [fields(v) for v in get_variants(items, ring_db)]  # with their matrices
+
+    timing.reset()
+    timing.enable()
+    try:
+        cache = MatchCache(fname, manifest)
+        assert [v.backwards_compatible() for v in get_variants(items, ring_db, cache=cache)] == expected
+        get_variants(items[:1], ring_db, best_only=True, cache=cache)  # cached separately
+        hits_misses = (timing.stats()["caches"]["match_cache"].hits, timing.stats()["caches"]["match_cache"].misses)
+
+        # only the items of a modified unique are matched again
+        changed = copy.deepcopy(ring_db[0])
+        changed.explicits[0].ranges = [[30, 40]]
+        changed_db = PoBDB([changed])
+        cache.manifest = utils.save_pob_manifest(list(changed_db), tmp_path / "pob_export.json")
+        assert [e.name for e in cache.manifest.modified] == ["Test Ring"]
+        timing.reset()
+        assert [v.backwards_compatible() for v in get_variants(items, changed_db, cache=cache)] == [[], [], []]  # the strength is out of range now
+        assert timing.stats()["caches"]["match_cache"].misses == 3
+    finally:
+        timing.enable(False)
+        timing.reset()
+
+    assert hits_misses == (3, 1)
+
+    # the results of a modified unique are dropped when the cache is loaded, and so are all the results of another version of the matcher
+    assert len(MatchCache(fname, manifest).results) == 1
+    assert MatchCache(fname, cache.manifest).results == {}
+    monkeypatch.setattr("legacy.match_cache_version", lambda: "other")
+    assert MatchCache(fname, manifest).results == {}
+
+    with open(fname, "w") as f:
+        f.write('{"version": "partly written')
+    assert MatchCache(fname, manifest).results == {}
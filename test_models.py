@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
+import json
 import pytest
+import hashlib
 
 from models import *
+import utils
 
 
 @pytest.mark.parametrize("line, generic_line, ranges", (
@@ -40,3 +43,118 @@ def test_GenericMod_genericize_mod(line, generic_line, ranges):
     generic = GenericMod.genericize_mod(line)
     assert generic.line == generic_line
     assert generic.ranges == ranges
+
+
+def test_genericize_line_cache():
+    line = "+(30-40)% to Fire Resistance"
+    genericize_line.cache_clear()
+
+    first = genericize_line(line)
+    second = genericize_line(line)
+    assert first is second
+    assert genericize_line.cache_info().hits == 1
+    assert genericize_line.cache_info().misses == 1
+    assert first == GenericLine("+#% to Fire Resistance", ((30, 40),))
+
+    with pytest.raises(attrs.exceptions.FrozenInstanceError):
+        first.line = "changed"  #type: ignore
+
+    # GenericMod.genericize_mod shares the cache but returns a new, mutable object each time
+    generic = GenericMod.genericize_mod(line)
+    assert generic is not GenericMod.genericize_mod(line)
+    generic.ranges[0][0] = 0
+    assert genericize_line(line).ranges == ((30, 40),)
+
+
+def test_tokenize_mod_unclosed_range():
+    # the old two-pass regex backtracked over every way of splitting the digits on this
+    line = f"({'1'*200}-{'2'*200} to Strength"
+    generic_line, ranges = tokenize_mod(line)
+    assert generic_line == "(## to Strength"
+    assert ranges == [(float("1"*200),)*2, (-float("2"*200),)*2]
+
+
+def test_pob_snapshot(tmp_path) -> None:
+    import utils
+
+    items = [
+        PoBItem("Test Ring", "Iron Ring", [], "Ring", "Drop", "", UpgradePath("Other Ring", "Blessing"), ["Only"], [], [GenericMod("+# to Strength", [[20.0,30.0]], [0])], 1),
+        PoBItem("Test Sword", None, [BaseTypeVariant("Rusted Sword", [0]), BaseTypeVariant("Copper Sword", [1])], "One Handed Sword", "", "", None, ["A", "B"],
+            [GenericMod("#% increased Attack Speed", [[10.0,10.0]], [0, 1])], [GenericMod("Hits can't be Evaded", [], [1], True)], 2),
+    ]
+    json_fname = tmp_path / "pob_export.json"
+    json_fname.write_text('["original"]')
+    utils.save_pob_snapshot(items, json_fname)
+
+    source_hash = hashlib.sha256(b'["original"]').digest()
+    assert utils.load_pob_snapshot(utils.pob_snapshot_fname(json_fname), source_hash) == items
+    assert utils.load_pob_snapshot(utils.pob_snapshot_fname(json_fname), hashlib.sha256(b'["changed"]').digest()) is None
+    assert utils.load_pob_snapshot(tmp_path / "missing.snapshot", source_hash) is None
+
+
+def test_pob_manifest(tmp_path) -> None:
+    import utils
+
+    ring = PoBItem("Test Ring", "Iron Ring", [], "Ring", "Drop", "", None, ["Only"], [], [GenericMod("+# to Strength", [[20,30]], [0])], 1)
+    sword = PoBItem("Test Sword", None, [BaseTypeVariant("Rusted Sword", [0]), BaseTypeVariant("Copper Sword", [1])], "One Handed Sword", "", "", None, ["A", "B"], [], [], 2)
+    json_fname = tmp_path / "pob_export.json"
+
+    first = utils.save_pob_manifest([ring, sword], json_fname)
+    assert (first.added, first.removed, first.modified) == ([], [], [])  # there's nothing to compare the first one to
+    assert first.find_hash("Test Sword", "Copper Sword") == utils.pob_item_hash(sword)
+    assert utils.pob_item_hash(PoBDB([ring])[0]) == utils.pob_item_hash(ring)  # the same in a PoBDB, and with float ranges
+
+    changed_ring = PoBItem("Test Ring", "Iron Ring", [], "Ring", "Drop", "", None, ["Only"], [], [GenericMod("+# to Strength", [[25,30]], [0])], 1)
+    other = PoBItem("Other Ring", "Gold Ring", [], "Ring", "", "", None, ["Only"], [], [], 1)
+    second = utils.save_pob_manifest([other, changed_ring], json_fname)
+    assert [e.name for e in second.added] == ["Other Ring"]
+    assert [e.name for e in second.removed] == ["Test Sword"]
+    assert [e.name for e in second.modified] == ["Test Ring"]
+    assert utils.load_pob_manifest(json_fname) == second
+    assert utils.load_pob_manifest(tmp_path / "missing.json") is None
+
+
+def test_mod_store() -> None:
+    import pickle
+
+    items = [
+        PoBItem("Test Ring", "Iron Ring", [], "Ring", "Drop", "", None, ["Only"],
+            [GenericMod("+# to Strength", [[20,30]], [0])], [GenericMod("+# to Strength", [[20,30]], [0]), GenericMod("Hits can't be Evaded", [], [0])], 1),
+        PoBItem("Test Sword", "Rusted Sword", [], "One Handed Sword", "", "", None, ["Only"],
+            [], [GenericMod("Adds # to # Cold Damage", [[1,2], [4,6]], [0]), GenericMod("+# to Strength", [[25,25]], [0])], 1),
+    ]
+    copies = [PoBItem(i.name, i.basetype, i.basetypes, i.itemclass, i.source, i.league, i.upgrade, i.variants,
+        [GenericMod(m.line, m.ranges, m.variants) for m in i.implicits], [GenericMod(m.line, m.ranges, m.variants) for m in i.explicits], i.variant_slots) for i in items]
+    db = PoBDB(items)
+    store = db.mod_store
+    assert len(store) == 0  # the mods are added when an item is first packed
+
+    implicits, explicits = db.pack_item(items[1])
+    assert len(store) == 2
+    assert db.pack_item(items[1])[1].low.tolist() == explicits.low.tolist() and len(store) == 2
+    db.pack_item(items[0])
+    assert len(store) == 5
+    assert store.lines == ["Adds # to # Cold Damage", "+# to Strength", "Hits can't be Evaded"]
+    assert store.bounds.tolist() == [[1,2], [4,6], [25,25], [20,30]]
+    assert items == copies  # the mods compare equal to list ranges
+    assert items[0].implicits[0].ranges is items[0].explicits[0].ranges  # identical ranges share a view
+    assert items[0].implicits[0].line is items[1].explicits[1].line
+    assert not np.asarray(items[0].implicits[0].ranges).flags.writeable
+
+    # the views are exported as lists
+    exported = [utils.export_dict(item) for item in items]
+    assert exported == [utils.export_dict(item) for item in copies]
+    assert json.loads(json.dumps(exported)) == exported
+    assert [attrs.asdict(mod, filter=utils.asdict_filter, value_serializer=utils.asdict_value) for mod in items[1].explicits] == [
+        {"line": "Adds # to # Cold Damage", "ranges": [[1,2], [4,6]], "variants": [0]},
+        {"line": "+# to Strength", "ranges": [[25,25]], "variants": [0]},
+    ]
+
+    assert implicits.low.shape == (0, 0)
+    assert explicits.counts.tolist() == [2, 1]
+    assert explicits.low.tolist() == [[1, 4], [25, -np.inf]]
+    assert explicits.high.tolist() == [[2, 6], [25, np.inf]]
+
+    unpickled = pickle.loads(pickle.dumps(db))
+    assert unpickled.items == items
+    assert unpickled.find("Test Sword", "Rusted Sword") is unpickled.items[1]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import json
+import time
+import asyncio
+import threading
+
+from typing import Any
+
+import pathofexile
+
+HEADERS = {
+    "X-Rate-Limit-Policy": "stash-request-limit",
+    "X-Rate-Limit-Rules": "Account",
+    "X-Rate-Limit-Account": "3:10:60",
+    "X-Rate-Limit-Account-State": "1:10:0",
+}
+
+
+class FakeResponse:
+    def __init__(self, data:dict, headers:dict[str,str]) -> None:
+        self.status_code = 200
+        self.headers = headers
+        self._data = data
+
+    def json(self) -> dict:
+        return self._data
+
+
+class CachingSession:
+    """answers every request with the same ETag, or a 304 if it's asked with that ETag. Stash requests get a tab, and other requests get a profile"""
+    def __init__(self) -> None:
+        self.requests:list[dict[str,str]|None] = []
+
+    def get(self, url:str, headers:dict[str,str]|None=None) -> FakeResponse:
+        self.requests.append(headers)
+        response = FakeResponse({"stash": {"id": "1"}, "stashes": []} if "/stash/" in url else {"name": "test"}, {"ETag": '"1"'})
+        if headers and headers.get("If-None-Match") == '"1"':
+            response.status_code = 304
+        return response
+
+
+class FakeSession:
+    """answers stash requests with a tab that has two children, and keeps track of how many requests were made at once"""
+    def __init__(self) -> None:
+        self.headers:dict[str,str] = {}
+        self.urls:list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get(self, url:str, headers:dict[str,str]|None=None) -> FakeResponse:
+        with self._lock:
+            self.urls.append(url)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self._lock:
+            self.in_flight -= 1
+
+        stash_id = url.split("/stash/Standard/", 1)[1]
+        stash:dict[str,Any] = {"id": stash_id, "name": stash_id}
+        if "/" not in stash_id:
+            stash["children"] = [{"id": "a"}, {"id": "b"}]
+        return FakeResponse({"stash": stash}, {**HEADERS, "X-Rate-Limit-Account": "10:10:60"})
+
+
+def make_client(tmp_path, cache:pathofexile.ResponseCache|None=None, access_token:str="token") -> pathofexile.PoEClient:
+    files = {
+        "oauth.json": {"client_id": "test", "version": "1.0"},
+        "secrets.json": {"contact_email": "test@example.com"},
+        "token.json": {"access_token": access_token},
+    }
+    for fname, data in files.items():
+        (tmp_path / fname).write_text(json.dumps(data))
+    return pathofexile.PoEClient(str(tmp_path / "oauth.json"), str(tmp_path / "secrets.json"), str(tmp_path / "token.json"), cache=cache)
+
+
+def test_reserve() -> None:
+    ratelimiter = pathofexile.RateLimiter()
+    assert ratelimiter.reserve("stash", True) == 0  # policy isn't known yet
+    ratelimiter.update("stash", True, HEADERS)
+
+    # the first request was counted by update. The next two are counted before they return
+    assert ratelimiter.reserve("stash", True) == 0
+    assert ratelimiter.reserve("stash", True) == 0
+    assert ratelimiter.reserve("stash", True) > 0
+
+    ratelimiter.update("stash", True, HEADERS, reserved=True)
+    ratelimiter.update("stash", True, HEADERS, reserved=True)
+    assert len(ratelimiter.policies["stash-request-limit"]["Account", 10].state.times) == 3
+
+
+def test_multiple_rules() -> None:
+    ratelimiter = pathofexile.RateLimiter()
+    ratelimiter.update("stash", True, {
+        **HEADERS,
+        "X-Rate-Limit-Rules": "Account,Ip",
+        "X-Rate-Limit-Ip": "5:10:60,20:60:120",
+        "X-Rate-Limit-Ip-State": "5:10:0,6:60:0",
+    })
+
+    rules = ratelimiter.policies["stash-request-limit"]
+    assert [(rule.name(), len(rule.state.times)) for rule in rules.values()] == [
+        ("Account/stash-request-limit/3:10:60", 1),
+        ("Ip/stash-request-limit/5:10:60", 5),  # other requests from the same IP are counted too
+        ("Ip/stash-request-limit/20:60:120", 6),
+    ]
+    assert 10 < ratelimiter.time_until_ready("stash", True) <= 10 + pathofexile.TIME_PADDING  # the Account rule allows a request, but the 10 second Ip rule doesn't
+
+
+def test_save_load(tmp_path) -> None:
+    fname = str(tmp_path / "ratelimit_state.json")
+    ratelimiter = pathofexile.RateLimiter()
+    ratelimiter.update("stash", True, {**HEADERS, "X-Rate-Limit-Account-State": "1:10:30"})
+    ratelimiter.policies["stash-request-limit"]["Account", 10].state.times.appendleft(time.time() - 20)  # expired
+    ratelimiter.save(fname)
+
+    loaded = pathofexile.RateLimiter.load(fname)
+    assert loaded.endpoint_policies == {("stash", True): "stash-request-limit"}
+    rule = loaded.policies["stash-request-limit"]["Account", 10]
+    assert (rule.name(), len(rule.state.times)) == ("Account/stash-request-limit/3:10:60", 1)
+    assert 0 < loaded.time_until_ready("stash", True) <= 30 + pathofexile.TIME_PADDING  # still restricted
+
+    assert pathofexile.RateLimiter.load(str(tmp_path / "missing.json")).policies == {}
+
+    # a file that was only partly written, or isn't a state file, is ignored
+    for text in ('{"policies": {"stash-request-limit": [{"rule": "Acc', '{"policies": {"stash-request-limit": [{}]}}', "[]"):
+        with open(fname, "w") as f:
+            f.write(text)
+        loaded = pathofexile.RateLimiter.load(fname)
+        assert (loaded.policies, loaded.endpoint_policies) == ({}, {})
+
+
+def test_shared(monkeypatch, tmp_path) -> None:
+    registered:list[tuple] = []
+    monkeypatch.setattr(pathofexile, "_shared_ratelimiters", {})
+    monkeypatch.setattr(pathofexile.atexit, "register", lambda *args: registered.append(args))
+    monkeypatch.chdir(tmp_path)
+
+    ratelimiter = pathofexile.RateLimiter.shared("ratelimit_state.json")
+    assert pathofexile.RateLimiter.shared(str(tmp_path / "ratelimit_state.json")) is ratelimiter
+    assert pathofexile.RateLimiter.shared("other.json") is not ratelimiter
+    assert registered == [(ratelimiter.save, str(tmp_path / "ratelimit_state.json")), (registered[1][0], str(tmp_path / "other.json"))]  # saved once per file
+
+
+def test_scheduler(monkeypatch) -> None:
+    monkeypatch.setattr(pathofexile, "TIME_PADDING", 0)
+    ratelimiter = pathofexile.RateLimiter()
+    ratelimiter.update("stash", True, {**HEADERS, "X-Rate-Limit-Account": "2:1:60", "X-Rate-Limit-Account-State": "1:1:0"})
+    scheduler = pathofexile.RateLimitScheduler(ratelimiter)
+
+    async def request(i:int, released:list[tuple[int,float]]) -> None:
+        assert await scheduler.acquire("stash", True)
+        released.append((i, time.time()))
+
+    async def requests() -> list[tuple[int,float]]:
+        released:list[tuple[int,float]] = []
+        await asyncio.gather(*(request(i, released) for i in range(3)))
+        return released
+
+    start = time.time()
+    released = asyncio.run(requests())
+    assert [i for i, _ in released] == [0, 1, 2]  # in order
+    assert released[0][1] - start < 0.5  # one hit of two was used by the first request
+    assert released[1][1] - start >= 0.9  # released as soon as the first request expires
+    assert released[2][1] - start < 1.5
+
+
+def test_async_get_stash(tmp_path) -> None:
+    poe = make_client(tmp_path)
+    session = FakeSession()
+    threads:set[int] = set()
+    def session_factory() -> FakeSession:
+        threads.add(threading.get_ident())
+        return session
+
+    async def get_stashes() -> list[dict]:
+        client = pathofexile.AsyncPoEClient(poe, session_factory=session_factory)  #type: ignore
+        return await asyncio.gather(*(client.get_stash("Standard", stash_id, get_children=True) for stash_id in ["1", "2", "3"]))
+
+    stashes = asyncio.run(get_stashes())
+    assert [[child["id"] for child in stash["children"]] for stash in stashes] == [["1/a", "1/b"], ["2/a", "2/b"], ["3/a", "3/b"]]
+    assert len(session.urls) == 9
+    assert session.max_in_flight > 1
+    assert len(threads) > 1  # a session for each worker thread
+    assert session.headers["Authorization"] == "Bearer token" and session.headers["User-Agent"].startswith("OAuth test/1.0")
+
+    # the first request found the policy before any others were made, and every request counted against it
+    assert session.urls[0] == f"{pathofexile.ROOT}/stash/Standard/1"
+    assert len(poe._ratelimiter.policies["stash-request-limit"]["Account", 10].state.times) == 9
+
+
+def test_response_cache(tmp_path) -> None:
+    cache = pathofexile.ResponseCache(str(tmp_path / "cache"), ttl=60)
+    poe = make_client(tmp_path, cache)
+    session = CachingSession()
+    poe._ses = session  #type: ignore
+
+    assert poe.get_stash("Standard", "1") == {"id": "1"}
+    assert poe.get_stash("Standard", "1") == {"id": "1"}  # fresh, so no request is made
+    assert session.requests == [{}]
+
+    cache.ttl = 0
+    assert poe.get_stash("Standard", "1") == {"id": "1"}  # revalidated
+    assert session.requests == [{}, {"If-None-Match": '"1"'}]
+
+    cache.prefer_cached = True
+    assert poe.get_stash("Standard", "1") == {"id": "1"}
+    assert len(session.requests) == 2
+
+    # only stash requests are cached
+    assert poe.get_profile() == {"name": "test"}
+    assert poe.get_profile() == {"name": "test"}
+    assert session.requests[2:] == [None, None]
+
+    # another account doesn't get this account's responses
+    other = make_client(tmp_path, cache, access_token="other")
+    other._ses = session  #type: ignore
+    assert other.get_stash("Standard", "1") == {"id": "1"}
+    assert session.requests[4:] == [{}]
+
+    # a cache file that can't be read is a miss
+    for fname in (tmp_path / "cache").iterdir():
+        fname.write_text('{"account": "')
+    assert poe.get_stash("Standard", "1") == {"id": "1"}
+    assert session.requests[5:] == [{}]
+
+    # revalidated requests go to the server even with prefer_cached
+    assert poe.list_stashes("Standard", revalidate=True) == []
+    assert poe.list_stashes("Standard", revalidate=True) == []
+    assert session.requests[6:] == [{}, {"If-None-Match": '"1"'}]
+    assert poe.get_stash("Standard", "1", revalidate=True) == {"id": "1"}
+    assert session.requests[8:] == [{"If-None-Match": '"1"'}]
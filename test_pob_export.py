@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import json
+import pytest
+
+lupa = pytest.importorskip("lupa.lua51")
+
+import pob_export
+from models import BaseTypeVariant, UpgradePath
+
+
+# a few items in the shape of PoB's uniqueDB.list
+UNIQUE_DB_LUA = r"""
+{
+    ["Test Ring, Iron Ring"] = {
+        title = "Test Ring", baseName = "Iron Ring", type = "Ring", source = "Drops anywhere",
+        variantList = {"Pre 3.0.0", "Current"},
+        baseLines = {},
+        implicitModLines = {{line = "+(5-10) to Strength"}},
+        explicitModLines = {
+            {line = "LevelReq: 20"},
+            {line = "(10-20)% increased Attack Speed", variantList = {[1] = true}},
+            {line = "(15-25)% increased Attack Speed", variantList = {[2] = true}},
+            {line = "Has 1 Socket", crafted = "{crafted}"},
+            {line = 'Quote " and backslash \\ and tab \t'},
+        },
+        upgradePaths = {"Upgrades to unique{Better Ring} using currency{Orb of Testing}"},
+    },
+    ["Test Amulet, Gold Amulet"] = {
+        title = "Test Amulet", baseName = "Gold Amulet", type = "Amulet", league = "Test",
+        variantList = {"A", "B", "C"}, variantAlt = 1, variantAlt2 = 2,
+        baseLines = {{line = "Gold Amulet", variantList = {[1] = true}}, {line = "Jade Amulet", variantList = {[2] = true, [3] = true}}},
+        implicitModLines = {},
+        explicitModLines = {{line = "Adds (1-2) to (3-4) Fire Damage to Attacks"}, {line = "This item can be anointed by Cassia"}},
+        upgradePaths = {"Upgrades somehow"},
+    },
+    ["Generated Jewel, Cobalt Jewel"] = {
+        title = "Generated Jewel", baseName = "Cobalt Jewel", type = "Jewel",
+        baseLines = {}, implicitModLines = {}, explicitModLines = {},
+    },
+}
+"""
+
+
+def test_pob_export_bulk() -> None:
+    lua = lupa.LuaRuntime()
+    unique_db = lua.eval(UNIQUE_DB_LUA)
+
+    per_item = pob_export.pob_export(unique_db, {"Generated Jewel"})
+    bulk = pob_export.pob_export_bulk(lua, unique_db, {"Generated Jewel"})
+    assert bulk == per_item
+
+    amulet, ring = bulk
+    assert (amulet.basetype, amulet.basetypes) == (None, [BaseTypeVariant("Gold Amulet", [0]), BaseTypeVariant("Jade Amulet", [1, 2])])
+    assert (amulet.variant_slots, amulet.upgrade, amulet.league) == (3, "Upgrades somehow", "Test")
+    assert [mod.line for mod in amulet.explicits] == ["Adds # to # Fire Damage to Attacks"]
+
+    assert (ring.basetype, ring.variants, ring.variant_slots) == ("Iron Ring", ["Pre 3.0.0", "Current"], 1)
+    assert ring.upgrade == UpgradePath("Better Ring", "Orb of Testing")
+    assert [(mod.line, mod.variants, mod.crafted) for mod in ring.explicits] == [
+        ("#% increased Attack Speed", [0], False),
+        ("#% increased Attack Speed", [1], False),
+        ("Has # Socket", [0, 1], True),
+        ('Quote " and backslash \\ and tab \t', [0, 1], False),
+    ]
+
+
+def test_export_shards() -> None:
+    lua = lupa.LuaRuntime()
+    unique_db = lua.eval(UNIQUE_DB_LUA)
+    for basetype in ("Cobalt Jewel", "Crimson Jewel", "Viridian Jewel", "Prismatic Jewel"):  # the same name, so they're ordered by base type
+        unique_db[f"Combat Focus, {basetype}"] = lua.eval(f'{{title = "Combat Focus", baseName = "{basetype}", type = "Jewel", baseLines = {{}}, implicitModLines = {{}}, explicitModLines = {{}}}}')
+
+    expected = pob_export.pob_export(unique_db, {"Generated Jewel"})
+    assert pob_export.pob_export_bulk(lua, unique_db, {"Generated Jewel"}) == expected
+    for num_shards in (2, 3, 10):
+        shards = [pob_export.export_shard(lua, unique_db, {"Generated Jewel"}, shard, num_shards) for shard in range(num_shards)]
+        assert sum(len(shard) for shard in shards) == len(expected)
+        assert pob_export.merge_shards(reversed(shards)) == expected
+
+
+def write_old_export(uniques:list, fname:str) -> str:
+    """write the export the way save_export did before write_export, and return it"""
+    with open(fname, "w") as f:
+        json.dump(uniques, f, cls=pob_export.JE, indent=4)
+    with open(fname) as f:
+        return f.read()
+
+
+def test_write_export(tmp_path) -> None:
+    lua = lupa.LuaRuntime()
+    uniques = pob_export.pob_export_bulk(lua, lua.eval(UNIQUE_DB_LUA), set())
+    fname = str(tmp_path / "pob_export.json")
+    expected = write_old_export(uniques, fname)
+
+    pob_export.write_export(uniques, fname)
+    with open(fname) as f:
+        assert f.read() == expected
+
+    pob_export.write_export(uniques, fname, compact=True)
+    with open(fname) as f:
+        assert json.load(f) == json.loads(expected)
+
+    pob_export.write_export([], fname)
+    with open(fname) as f:
+        assert json.load(f) == []
+
+
+def test_write_export_compact_json_encoder(tmp_path) -> None:
+    CompactJSONEncoder = pytest.importorskip("CompactJSONEncoder").CompactJSONEncoder
+    assert issubclass(pob_export.JE, CompactJSONEncoder)
+
+    # CompactJSONEncoder puts short lists of mods on one line, so the output is only the same if it sees the same objects as json.dump gave it
+    lua = lupa.LuaRuntime()
+    uniques = pob_export.pob_export_bulk(lua, lua.eval(UNIQUE_DB_LUA), set())
+    fname = str(tmp_path / "pob_export.json")
+    expected = write_old_export(uniques, fname)
+
+    pob_export.write_export(uniques, fname)
+    with open(fname) as f:
+        assert f.read() == expected
+
+
+def test_compare_exports() -> None:
+    lua = lupa.LuaRuntime()
+    uniques = pob_export.pob_export(lua.eval(UNIQUE_DB_LUA), set())
+    assert pob_export.compare_exports(uniques, list(uniques))
+    assert not pob_export.compare_exports(uniques, uniques[::-1])  # the same items in a different order
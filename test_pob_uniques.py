@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import pob_uniques
+from models import BaseTypeVariant, GenericMod, UpgradePath
+
+POB_DIR = "test_data/pob"
+
+
+def test_load_item_bases() -> None:
+    assert pob_uniques.load_item_bases(POB_DIR) == {
+        "Gold Amulet": "Amulet", "Jade Amulet": "Amulet", "Iron Ring": "Ring", "Gold Ring": "Ring", "Two-Stone Ring (Fire/Cold)": "Ring"
+    }
+
+
+def test_pob_export_direct() -> None:
+    race, elemental, amulet, ring = pob_uniques.pob_export_direct(POB_DIR)  # the commented out, unknown base, overridden and generated items aren't included
+
+    assert (race.name, race.basetype, race.source) == ("Elemental Ring", "Gold Ring", "Race reward")  # from Special/race.lua, and before the other Elemental Ring by base type
+
+    assert (amulet.name, amulet.basetype, amulet.itemclass, amulet.league) == ("Test Amulet", None, "Amulet", "Test")
+    assert amulet.basetypes == [BaseTypeVariant("Gold Amulet", [0]), BaseTypeVariant("Jade Amulet", [1, 2])]
+    assert (amulet.variants, amulet.variant_slots, amulet.upgrade) == (["A", "B", "C"], 3, "Upgrades somehow")
+    assert amulet.implicits == [GenericMod("#% increased Rarity of Items found", [[12, 20]], [0, 1, 2])]
+    assert amulet.explicits == [GenericMod("Adds # to # Fire Damage to Attacks", [[1, 2], [3, 4]], [0, 1, 2])]
+
+    assert (elemental.basetype, elemental.variants, elemental.variant_slots) == ("Two-Stone Ring (Fire/Cold)", ["Only"], 1)
+    assert [mod.line for mod in elemental.implicits] == ["+#% to Fire and Cold Resistances"]
+    assert elemental.explicits == [GenericMod("+#% to Cold Resistance", [[20, 30]], [0, 1])]
+
+    assert (ring.basetype, ring.variants, ring.source) == ("Iron Ring", ["Pre 3.0.0", "Current"], "Drops anywhere")
+    assert ring.upgrade == UpgradePath("Better Ring", "Orb of Testing")
+    assert [mod.line for mod in ring.implicits] == ["Adds # to # Physical Damage to Attacks"]
+    assert [(mod.line, mod.variants, mod.crafted) for mod in ring.explicits] == [
+        ("#% increased Attack Speed", [0], False),
+        ("#% increased Attack Speed", [1], False),
+        ("Has # Socket", [0, 1], True),
+    ]
+
+
+def test_lua_long_strings() -> None:
+    source = 'return {\n-- a [[comment]]\n[[one]], --[==[two]==]\n"[[three]]", [=[fo]]ur]=],\n}'
+    assert pob_uniques.lua_long_strings(source) == ["one", "fo]]ur"]
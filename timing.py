@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import threading
+from array import array
+from typing import Any, Callable, TextIO
+
+import attrs
+import numpy as np
+
+_enabled = False
+_stages:dict[str,'Stage'] = {}
+_counters:dict[str,int] = {}
+_caches:dict[str,Callable[[],Any]] = {}
+_merged_caches:dict[str,list[int]] = {}  # {name : [hits, misses]} of registered caches in other processes, added by merge()
+_taken_caches:dict[str,tuple[int,int]] = {}  # {name : (hits, misses)} of registered caches in this process, as of the last take()
+_lock = threading.Lock()  # for the counters, and for take() and merge()
+
+
+
+@attrs.define
+class StageStats:
+    """timing summary of one stage. Times are in seconds"""
+    calls: int
+    total: float
+    mean: float
+    p50: float
+    p99: float
+
+
+
+@attrs.define
+class CacheStats:
+    """hit/miss summary of one cache"""
+    hits: int
+    misses: int
+    hit_rate: float
+
+
+
+class Stage:
+    """the recorded run times of a named stage"""
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.samples = array("q")  # nanoseconds
+
+
+    def stats(self) -> StageStats:
+        """summarize the recorded samples"""
+        if not self.samples:
+            return StageStats(0, 0, 0, 0, 0)
+        samples = np.frombuffer(self.samples, dtype=np.int64) / 1e9
+        p50, p99 = np.percentile(samples, [50, 99])
+        return StageStats(len(samples), float(samples.sum()), float(samples.mean()), float(p50), float(p99))
+
+
+
+class _Timer:
+    """times one run of a stage. A new one is made for each run, so stages can be timed from several threads at once"""
+    __slots__ = ("samples", "start")
+
+    def __init__(self, samples:array) -> None:
+        self.samples = samples
+        self.start = 0
+
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter_ns()
+
+
+    def __exit__(self, *exc_info:Any) -> None:
+        self.samples.append(time.perf_counter_ns() - self.start)
+
+
+
+class _NullStage:
+    """stands in for a Stage when timing is disabled"""
+    def __enter__(self) -> None:
+        pass
+
+
+    def __exit__(self, *exc_info:Any) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def enable(enabled:bool=True) -> None:
+    """turn timing on or off. It's off by default"""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """discard all recorded timings and counts"""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _merged_caches.clear()
+
+
+def stage(name:str) -> _Timer|_NullStage:
+    """get a context manager that times the code it wraps as part of the named stage. Does nothing if timing is disabled.
+    Timings are kept in the current process. Worker processes send theirs with take() to be added with merge()"""
+    if not _enabled:
+        return _NULL_STAGE
+    s = _stages.get(name)
+    if s is None:
+        s = _stages.setdefault(name, Stage(name))
+    return _Timer(s.samples)
+
+
+def count(name:str, n:int=1) -> None:
+    """add to a named counter, if timing is enabled. Counters ending in ".hit" and ".miss" are reported as caches by stats()"""
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def register_cache(name:str, cache_info:Callable[[],Any]) -> None:
+    """include a functools.lru_cache in stats(), by its cache_info method"""
+    _caches[name] = cache_info
+
+
+def take() -> dict[str,Any]:
+    """remove everything recorded in this process since the last take() and return it, to be added to the results of another process with merge().
+    Registered caches can't be reset, so their hits and misses since the last take() are returned instead"""
+    with _lock:
+        stages = {name: s.samples.tobytes() for name, s in _stages.items()}
+        counters = dict(_counters)
+        _stages.clear()
+        _counters.clear()
+
+        caches = {}
+        for name, cache_info in _caches.items():
+            info = cache_info()
+            hits, misses = _taken_caches.get(name, (0, 0))
+            caches[name] = (info.hits - hits, info.misses - misses)
+            _taken_caches[name] = (info.hits, info.misses)
+
+    return {"stages": stages, "counters": counters, "caches": caches}
+
+
+def merge(taken:dict[str,Any]) -> None:
+    """add the results of take() from another process"""
+    with _lock:
+        for name, samples in taken["stages"].items():
+            _stages.setdefault(name, Stage(name)).samples.frombytes(samples)
+        for name, n in taken["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+        for name, (hits, misses) in taken["caches"].items():
+            merged = _merged_caches.setdefault(name, [0, 0])
+            merged[0] += hits
+            merged[1] += misses
+
+
+def stats() -> dict[str,dict[str,Any]]:
+    """get the timing summary of each stage, the hit rate of each cache, and the other counters"""
+    caches:dict[str,CacheStats] = {}
+    for name, cache_info in _caches.items():
+        info = cache_info()
+        hits, misses = _merged_caches.get(name, (0, 0))
+        caches[name] = _cache_stats(info.hits + hits, info.misses + misses)
+    for name in _counters:
+        if name.endswith(".hit") or name.endswith(".miss"):
+            base = name.rsplit(".", 1)[0]
+            caches[base] = _cache_stats(_counters.get(f"{base}.hit", 0), _counters.get(f"{base}.miss", 0))
+
+    return {
+        "stages": {name: s.stats() for name, s in _stages.items()},
+        "caches": caches,
+        "counters": {name: n for name, n in _counters.items() if not (name.endswith(".hit") or name.endswith(".miss"))},
+    }
+
+
+def print_stats(file:TextIO=sys.stdout) -> None:
+    """print the results of stats() as tables"""
+    s = stats()
+
+    print(f"{'stage':<24} {'calls':>9} {'total s':>10} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10}", file=file)
+    for name, st in s["stages"].items():
+        print(f"{name:<24} {st.calls:>9} {st.total:>10.3f} {st.mean*1000:>10.4f} {st.p50*1000:>10.4f} {st.p99*1000:>10.4f}", file=file)
+
+    print(f"\n{'cache':<24} {'hits':>9} {'misses':>9} {'hit rate':>9}", file=file)
+    for name, c in s["caches"].items():
+        print(f"{name:<24} {c.hits:>9} {c.misses:>9} {c.hit_rate:>9.1%}", file=file)
+
+    if s["counters"]:
+        print(f"\n{'counter':<24} {'count':>9}", file=file)
+        for name, n in s["counters"].items():
+            print(f"{name:<24} {n:>9}", file=file)
+
+
+def _cache_stats(hits:int, misses:int) -> CacheStats:
+    total = hits + misses
+    return CacheStats(hits, misses, hits / total if total else 0)
@@ -1,23 +1,35 @@
 #!/usr/bin/env python
 from __future__ import annotations
 
+import os
 import logging
+import functools
 import json
-from typing import Any, cast
+import hashlib
+import marshal
+import struct
+from typing import Any, Callable
+from collections.abc import Sequence
 
 import attrs
 import cattrs
+import numpy as np
+from cattrs.gen import make_dict_structure_fn
 
 from consts import META_MISSING_VALUE, POB_EXPORT_FNAME, GG_EXPORT_FNAME
 import models as m
 
 log = logging.getLogger(__name__)
 
+SNAPSHOT_MAGIC = b"PoBSnap\0"
+SNAPSHOT_VERSION = 2  # bump when the encoding below changes. Changes to the fields of the models are picked up by _snapshot_layout_hash
+SNAPSHOT_HEADER = struct.Struct("<8sHH32s32s")  # magic, version, marshal version, layout hash, source json hash
 
-def make_variant_list(lua_mod, num_variants:int) -> list[int]:
-    """make a list of (zero-indexed) variant numbers that a Lua mod applies to"""
-    if lua_mod.variantList:
-        mod_variants = list(x-1 for x in lua_mod.variantList.keys())
+
+def make_variant_list(variant_list:list[int]|None, num_variants:int) -> list[int]:
+    """make a list of (zero-indexed) variant numbers that a mod applies to, from the (one-indexed) keys of its Lua variantList. No variantList means all variants"""
+    if variant_list is not None:
+        mod_variants = list(x-1 for x in variant_list)
     else:
         mod_variants = list(range(num_variants))
     return mod_variants
@@ -30,7 +42,10 @@ def asdict_filter(at:attrs.Attribute, value:Any) -> bool:
     or (for attributes that are not at the end of the attribute list and therefore cannot have a default)
     have a metadata[META_MISSING_VALUE] value and are equal to it.
     Use attrs.field(metadata={META_MISSING_VALUE: ...}) to set it.
+    Arrays (like the ranges of mods in a PoBDB) are compared as lists.
     """
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
     if at.default != attrs.NOTHING and value == at.default:
         return False
     if META_MISSING_VALUE in at.metadata and at.metadata[META_MISSING_VALUE] == value:
@@ -38,30 +53,271 @@ def asdict_filter(at:attrs.Attribute, value:Any) -> bool:
     return True
 
 
-def load_pob_db(fname:m.FName=POB_EXPORT_FNAME) -> list[m.PoBItem]:
-    """load list of PoBItem from json"""
-    with open(fname) as f:
-        data:list[dict[str,Any]] = json.load(f)
-    for item in data:
-        _fix_loaded_data(item, m.PoBItem)
-        for modlist in (item["implicits"], item["explicits"]):
-            for mod in modlist:
-                _fix_loaded_data(mod, m.GenericMod)
-    return cattrs.structure(data, list[m.PoBItem])
+def asdict_value(inst:Any, at:attrs.Attribute, value:Any) -> Any:
+    """A value_serializer for attrs.asdict to go with asdict_filter, that converts arrays (like the ranges of mods in a PoBDB) into lists"""
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+
+def export_dict(o:Any) -> Any:
+    """convert an attrs object into a dict for the json exports, recursively, without the attributes that asdict_filter removes. Lists are converted item by item
+
+    This gives the same result as attrs.asdict with asdict_filter, but it's faster because the attributes to check for each class are only worked out once (see _export_fields).
+    """
+    if isinstance(o, list):
+        if not o or not (isinstance(o[0], list) or attrs.has(type(o[0]))):
+            return o  # lists of primitives don't need converting
+        return [export_dict(x) for x in o]
+    cls:type = type(o)
+    if not attrs.has(cls):
+        return o
+
+    result = {}
+    for name, superfluous_values in _export_fields(cls):
+        value = getattr(o, name)
+        if isinstance(value, np.ndarray):
+            value = value.tolist()  # the ranges of mods in a PoBDB (see models.ModStore.attach)
+        if superfluous_values and value in superfluous_values:
+            continue
+        result[name] = export_dict(value)
+    return result
+
+
+@functools.cache
+def _export_fields(cls:type) -> tuple[tuple[str,tuple[Any,...]],...]:
+    """the attributes of an attrs class, each with the values that make it superfluous (see asdict_filter)"""
+    fields = []
+    for at in attrs.fields(cls):
+        superfluous_values = []
+        if at.default != attrs.NOTHING:
+            superfluous_values.append(at.default)
+        if META_MISSING_VALUE in at.metadata:
+            superfluous_values.append(at.metadata[META_MISSING_VALUE])
+        fields.append((at.name, tuple(superfluous_values)))
+    return tuple(fields)
+
+
+def load_pob_db(fname:m.FName=POB_EXPORT_FNAME, *, use_snapshot:bool=True, lazy:bool=False) -> m.PoBDB:
+    """load the PoB unique database from json
+
+    If the snapshot next to the json (see pob_snapshot_fname) was made from the same json, the items are loaded from it instead, which is much faster.
+    With `lazy`, only the names and basetypes of the items are read up front, and each item is built the first time it's used (see models.LazyItems and PoBDB.warm_up).
+    """
+    with open(fname, "rb") as f:
+        raw = f.read()
+
+    snapshot = load_pob_snapshot_records(pob_snapshot_fname(fname), hashlib.sha256(raw).digest()) if use_snapshot else None
+
+    if snapshot is not None:
+        keys, records = snapshot
+        if lazy:
+            return m.PoBDB(m.LazyItems(records, keys, _unmarshal_pob_item), fname)
+        return m.PoBDB([_unmarshal_pob_item(r) for r in records], fname)
+
+    data:list[dict[str,Any]] = json.loads(raw)
+    if lazy:
+        return m.PoBDB(m.LazyItems(data, [_json_record_keys(r) for r in data], _structure_pob_item), fname)
+    return m.PoBDB([_structure_pob_item(r) for r in data], fname)
+
+
+def pob_snapshot_fname(fname:m.FName) -> str:
+    """the file name of the snapshot of a PoB export json file"""
+    return os.path.splitext(os.fsdecode(fname))[0] + ".snapshot"
+
+
+def save_pob_snapshot(items:list[m.PoBItem], json_fname:m.FName=POB_EXPORT_FNAME) -> None:
+    """save a binary snapshot of the PoB unique database, for load_pob_db. `json_fname` is the json export the items were saved to
+
+    The snapshot is a header (see SNAPSHOT_HEADER) followed by the marshalled name and basetypes of each item, and each item marshalled separately as a tuple of its fields.
+    Keeping the items separate lets a lazy PoBDB hold on to them as compact bytes until they're needed.
+    It records a hash of the json, so it's only used while it matches the json.
+    """
+    with open(json_fname, "rb") as f:
+        source_hash = hashlib.sha256(f.read()).digest()
+
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version, _snapshot_layout_hash(), source_hash)
+    keys = [(item.name, [item.basetype] if item.basetype is not None else [b.basetype for b in item.basetypes]) for item in items]
+    body = marshal.dumps((keys, [marshal.dumps(_encode_pob_item(item)) for item in items]))
+
+    # write to a temporary file first, so a reader never sees a half-written snapshot
+    fname = pob_snapshot_fname(json_fname)
+    with open(fname + ".tmp", "wb") as f:
+        f.write(header + body)
+    os.replace(fname + ".tmp", fname)
+
+
+def load_pob_snapshot(fname:m.FName, source_hash:bytes) -> list[m.PoBItem]|None:
+    """load the items from a PoB snapshot. Returns None if there is no snapshot, or it wasn't made from the json with the given hash, or it's from a different version"""
+    snapshot = load_pob_snapshot_records(fname, source_hash)
+    return [_unmarshal_pob_item(record) for record in snapshot[1]] if snapshot is not None else None
+
+
+def load_pob_snapshot_records(fname:m.FName, source_hash:bytes) -> tuple[list[tuple[str,list[str]]], list[bytes]]|None:
+    """load the names and basetypes of the items in a PoB snapshot, and the items still marshalled, without building the PoBItems. See load_pob_snapshot"""
+    try:
+        with open(fname, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < SNAPSHOT_HEADER.size:
+        log.info(f"{fname!r} is not a snapshot")
+        return None
+    magic, version, marshal_version, layout_hash, snapshot_source_hash = SNAPSHOT_HEADER.unpack_from(data)
+    if (magic, version, marshal_version, layout_hash) != (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version, _snapshot_layout_hash()):
+        log.info(f"{fname!r} is from a different version")
+        return None
+    if snapshot_source_hash != source_hash:
+        log.info(f"{fname!r} is out of date")
+        return None
+
+    keys, records = marshal.loads(data[SNAPSHOT_HEADER.size:])
+    return keys, records
+
+
+def pob_item_hash(item:m.PoBItem) -> str:
+    """a hash of the contents of a PoBItem, which stays the same between runs and exports as long as the item doesn't change"""
+    return hashlib.sha256(repr(_encode_pob_item(item)).encode()).hexdigest()
+
+
+def pob_export_key(item:m.PoBItem) -> tuple[str,tuple[str,...]]:
+    """the key the PoB exports are sorted by: the name, then the base types
+
+    PoB's uniqueDB is a Lua table keyed by name and base type, so the order it gives items with the same name comes from its hashing.
+    That depends on every item that was added to it, including the generated uniques that pob_uniques can't read, so the base types are used instead.
+    """
+    return item.name, (item.basetype,) if item.basetype is not None else tuple(b.basetype for b in item.basetypes)
+
+
+def pob_manifest_fname(fname:m.FName) -> str:
+    """the file name of the manifest of a PoB export json file"""
+    return os.path.splitext(os.fsdecode(fname))[0] + ".manifest.json"
+
+
+def save_pob_manifest(items:Sequence[m.PoBItem], json_fname:m.FName=POB_EXPORT_FNAME) -> m.PoBManifest:
+    """save the manifest of a PoB export: the hash of each item (see pob_item_hash), and the items that were added, removed or modified since the last manifest that was saved"""
+    previous = load_pob_manifest(json_fname)
+    entries = [
+        m.ManifestEntry(item.name, [item.basetype] if item.basetype is not None else [b.basetype for b in item.basetypes], pob_item_hash(item))
+        for item in items
+    ]
+    manifest = m.PoBManifest(entries)
+
+    if previous is not None:
+        def key(entry:m.ManifestEntry) -> tuple[str,tuple[str,...]]:
+            return entry.name, tuple(entry.basetypes)
+        old = {key(entry): entry for entry in previous.items}
+        new = {key(entry): entry for entry in entries}
+        manifest.added = [entry for k, entry in new.items() if k not in old]
+        manifest.removed = [entry for k, entry in old.items() if k not in new]
+        manifest.modified = [entry for k, entry in new.items() if k in old and old[k].hash != entry.hash]
+
+    fname = pob_manifest_fname(json_fname)
+    with open(fname + ".tmp", "w") as f:
+        json.dump(export_converter().unstructure(manifest), f, indent=1)
+    os.replace(fname + ".tmp", fname)
+    return manifest
+
+
+def load_pob_manifest(json_fname:m.FName=POB_EXPORT_FNAME) -> m.PoBManifest|None:
+    """load the manifest of a PoB export, or None if it doesn't have one. See save_pob_manifest"""
+    try:
+        with open(pob_manifest_fname(json_fname)) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    return export_converter().structure(data, m.PoBManifest)
 
 
 def load_gg_export(fname:m.FName=GG_EXPORT_FNAME) -> list[m.GGItem]:
     with open(fname) as f:
         data = json.load(f)
-    return cattrs.structure(data, list[m.GGItem])
-
-
-def _fix_loaded_data(o:dict[str,Any], type_:type) -> None:
-    """hack to add missing attributes to loaded json. Basically the oposite of utils.asdict_filter"""
-    for at in attrs.fields(type_):
-        at = (cast)((attrs.Attribute), at)  #noop
-        if at.name not in o:
-            if at.default != attrs.NOTHING:
-                o[at.name] = at.default
-            elif META_MISSING_VALUE in at.metadata:
-                o[at.name] = at.metadata[META_MISSING_VALUE]
+    return export_converter().structure(data, list[m.GGItem])
+
+
+@functools.cache
+def export_converter() -> cattrs.Converter:
+    """the converter for loading the json exports into models
+
+    Each model gets a generated structure function, which fills in missing attributes (the opposite of asdict_filter):
+    attributes with defaults get their default, and ones with metadata[META_MISSING_VALUE] get that value.
+    Detailed validation is off, since the exports are generated, so errors aren't collected into exception groups.
+    """
+    converter = cattrs.Converter(detailed_validation=False)
+
+    # the generic list hooks call a hook per element, which dominates with this many small lists
+    converter.register_structure_hook_func(lambda t: t == list[int], lambda o, _: [int(x) for x in o])
+    converter.register_structure_hook_func(lambda t: t == list[str], lambda o, _: [str(x) for x in o])
+    converter.register_structure_hook_func(lambda t: t == m.ModRanges, lambda o, _: [[float(low), float(high)] for low, high in o])
+
+    # the fields of the later classes use the hooks of the earlier ones, so the order matters
+    for mod_cls in (m.UpgradePath, m.BaseTypeVariant, m.GenericMod):
+        converter.register_structure_hook(mod_cls, _make_structure_fn(mod_cls, converter))
+    structure_upgrade_path = converter.get_structure_hook(m.UpgradePath)
+    converter.register_structure_hook(m.UpgradePath|str|None, lambda o, _: structure_upgrade_path(o, m.UpgradePath) if isinstance(o, dict) else o)
+    for item_cls in (m.PoBItem, m.GGItem):
+        converter.register_structure_hook(item_cls, _make_structure_fn(item_cls, converter))
+
+    return converter
+
+
+def _make_structure_fn(cls:type, converter:cattrs.Converter) -> Callable[[dict[str,Any],type],Any]:
+    """generate a function that structures a dict into an attrs class, filling in missing attributes that have a metadata[META_MISSING_VALUE]"""
+    structure:Callable[[dict[str,Any],type],Any] = make_dict_structure_fn(cls, converter)
+    missing = {at.name: at.metadata[META_MISSING_VALUE] for at in attrs.fields(cls) if at.default is attrs.NOTHING and META_MISSING_VALUE in at.metadata}
+    if not missing:
+        return structure
+
+    def structure_with_missing(o:dict[str,Any], t:type) -> Any:
+        return structure(o if missing.keys() <= o.keys() else {**missing, **o}, t)
+    return structure_with_missing
+
+
+def _structure_pob_item(record:dict[str,Any]) -> m.PoBItem:
+    """build a PoBItem from an item loaded from the json export"""
+    return export_converter().structure(record, m.PoBItem)
+
+
+def _json_record_keys(record:dict[str,Any]) -> tuple[str,list[str]]:
+    """the name and basetypes of an item loaded from the json export, without building it"""
+    if record.get("basetype") is not None:
+        return record["name"], [record["basetype"]]
+    return record["name"], [b["basetype"] for b in record.get("basetypes", [])]
+
+
+def _unmarshal_pob_item(record:bytes) -> m.PoBItem:
+    """build a PoBItem from an item in a snapshot. See save_pob_snapshot"""
+    return _decode_pob_item(marshal.loads(record))
+
+
+def _snapshot_layout_hash() -> bytes:
+    """hash of the fields of the models stored in snapshots, so snapshots of older models aren't loaded"""
+    layout = [(cls.__name__, [at.name for at in attrs.fields(cls)]) for cls in (m.PoBItem, m.BaseTypeVariant, m.UpgradePath, m.GenericMod)]
+    return hashlib.sha256(repr(layout).encode()).digest()
+
+
+def _encode_pob_item(item:m.PoBItem) -> tuple:
+    """convert a PoBItem into nested tuples of the values of its fields, in field order. UpgradePaths become tuples to tell them apart from strings"""
+    def astuple(o:Any) -> tuple:
+        return attrs.astuple(o, recurse=False)
+
+    upgrade = astuple(item.upgrade) if isinstance(item.upgrade, m.UpgradePath) else item.upgrade
+    return (
+        item.name, item.basetype, [astuple(b) for b in item.basetypes], item.itemclass, item.source, item.league, upgrade, item.variants,
+        [_encode_mod(mod) for mod in item.implicits], [_encode_mod(mod) for mod in item.explicits], item.variant_slots
+    )
+
+
+def _encode_mod(mod:m.GenericMod) -> tuple:
+    """convert a GenericMod into a tuple of the values of its fields. Ranges are copied into lists, since in a PoBDB they're views into its ModStore"""
+    line, ranges, *rest = attrs.astuple(mod, recurse=False)
+    return (line, [[float(low), float(high)] for low, high in ranges], *rest)
+
+
+def _decode_pob_item(t:tuple) -> m.PoBItem:
+    """the reverse of _encode_pob_item"""
+    name, basetype, basetypes, itemclass, source, league, upgrade, variants, implicits, explicits, variant_slots = t
+    return m.PoBItem(
+        name, basetype, [m.BaseTypeVariant(*b) for b in basetypes], itemclass, source, league,
+        m.UpgradePath(*upgrade) if isinstance(upgrade, tuple) else upgrade, variants,
+        [m.GenericMod(*mod) for mod in implicits], [m.GenericMod(*mod) for mod in explicits], variant_slots
+    )